@@ -164,7 +164,7 @@ def propose_edits(llm_handler: LLMHandler,
     script_prompt = script_prompt.replace("{code}", code).replace("{error}", error)\
         .replace("{description}", description).replace("{notes}", notes)\
         .replace("{game_engine_code}", engine_code).replace("{example_code}", example_code_str)
-    raw_content = llm_handler.chat(script_prompt)
+    raw_content = llm_handler.chat(script_prompt, caller='debug')
     result = raw_content
 
     if target_path:
@@ -1,4 +1,4 @@
-from retrying import retry
+from Utils.LLMHandler import reask
 from GameCode.debug.ApplyEdits import apply_edits
 from GameCode.debug.ProposeEdits import propose_edits
 from GameCode.utils.formatting import unwrap_code, wrap_code
@@ -9,7 +9,7 @@ DEBUG_NOTES = """
 - Verify the legalness of the action in get_legal_actions() functions. Don't re-validate the action anywhere else.
 """
 
-@retry(stop_max_attempt_number=3)
+@reask(stop_max_attempt_number=3)
 def debug_code(llm_handler, game_code, error, game_desc, example_code, game_engine_code):
     if isinstance(example_code, str):
         example_core_code = unwrap_code(example_code)
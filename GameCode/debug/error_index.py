@@ -0,0 +1,142 @@
+"""
+Index of the errors sent to debugging, by signature.
+
+Consecutive edits, and the trials of a game, often fail with the same error: the same
+exception raised at the same line. The signature of an error is its exception type and its
+normalized frames, i.e. the function and the source text of the frames of the game code
+(the line numbers and the file name change with every edit), so the same error of two
+versions of the code has the same signature, whether it is a traceback or a shrunk repro.
+A repeated signature is debugged with more context, and a run stops spending credits on an
+error its edits already failed to fix `max_repeats` times.
+
+Usage:
+    signature = error_signature(error_msg)
+    if error_index.should_stop(signature, run):   # sent max_repeats times in this run
+        ...
+    repeats = error_index.add(signature, run)     # times it was sent before, in any run
+    if repeats:
+        error_msg = escalate_error(error_msg, repeats, game_log_tail)
+"""
+from __future__ import annotations
+import os
+import re
+import math
+from typing import Dict, List, Optional, Tuple
+
+GAME_CODE_FILE = "<game_code"  # prefix of the file name of the game code, see load_code_module
+TIMEOUT_SIGNATURE = "Timeout"
+
+# the frame of a syntax error has no function
+_FRAME_PATTERN = re.compile(r'^\s*File "(?P<file>[^"]+)", line \d+(, in (?P<func>.+))?$')
+_EXCEPTION_PATTERN = re.compile(r'^(?P<type>[A-Za-z_][\w.]*)(:|$)')
+
+
+def _parse_traceback(error_msg: str) -> Tuple[List[Tuple[str, str, str]], Optional[str]]:
+    """The frames (file, function, source) of the last traceback in the text, and its exception type."""
+    lines = error_msg.split('\n')
+    start = max((i for i, line in enumerate(lines) if line.startswith("Traceback (most recent call last)")),
+                default=None)
+    if start is None:
+        return [], None
+    frames, exception_type = [], None
+    for line in lines[start + 1:]:
+        frame = _FRAME_PATTERN.match(line)
+        if frame:
+            frames.append((frame.group('file'), frame.group('func') or "", ""))
+        elif line.startswith(' '):
+            source = line.strip()
+            # the source line of the frame, not the carets under it
+            if frames and not frames[-1][2] and source and set(source) - set('^~ '):
+                frames[-1] = (*frames[-1][:2], source)
+        else:
+            exception = _EXCEPTION_PATTERN.match(line)
+            if exception:
+                exception_type = exception.group('type')
+            break
+    return frames, exception_type
+
+
+def error_signature(error_msg: str) -> str:
+    """
+    The signature of the error message of a failed test: the exception type and the frames of
+    the game code (with the frame raising it), or TIMEOUT_SIGNATURE if the test timed out.
+    The message itself is left out, it holds values of the game, e.g. a card index.
+    """
+    frames, exception_type = _parse_traceback(error_msg)
+    if exception_type is None:
+        if error_msg.startswith("Execution timed out"):
+            return TIMEOUT_SIGNATURE
+        # not a traceback, e.g. a validation report, the first line tells the error
+        return error_msg.strip().split('\n')[0][:200]
+    parts = [exception_type]
+    for i, (file, func, source) in enumerate(frames):
+        if file.startswith(GAME_CODE_FILE):
+            parts.append(f"game:{func}:{source}")
+        elif i == len(frames) - 1:
+            parts.append(f"{os.path.basename(file.replace(os.sep, '/'))}:{func}:{source}")
+    return " | ".join(parts)
+
+
+class ErrorIndex:
+    """
+    Args:
+        max_repeats: times an error is sent to debugging in a run, the run stops at the next one
+    """
+
+    def __init__(self, max_repeats: int = 3):
+        assert max_repeats > 0, "max_repeats must be positive"
+        self.max_repeats = max_repeats
+        self.sent: Dict[str, List[str]] = {}  # signature -> the runs it was sent in, once per edit
+        self.edits_saved = 0
+        self.stopped_runs = 0
+
+    def repeats(self, signature: str, run: str = None) -> int:
+        """Times the error was sent, in the run if given, else in all the runs."""
+        runs = self.sent.get(signature, [])
+        return len(runs) if run is None else runs.count(run)
+
+    def should_stop(self, signature: str, run: str) -> bool:
+        """
+        The edits of the run already failed to fix the error max_repeats times.
+        Never for timeouts, they share a signature whatever their cause.
+        """
+        return signature != TIMEOUT_SIGNATURE and self.repeats(signature, run) >= self.max_repeats
+
+    def add(self, signature: str, run: str) -> int:
+        """Record the error sent to debugging in the run, returns the times it was sent before."""
+        repeats = self.repeats(signature)
+        self.sent.setdefault(signature, []).append(run)
+        return repeats
+
+    def stop(self, edits_left: int, credits_left: float):
+        """Record a stopped run, with the edits its budget still allowed."""
+        self.stopped_runs += 1
+        self.edits_saved += max(0, min(edits_left, math.ceil(credits_left)))
+
+    def get_state(self) -> Dict:
+        """The errors sent, json serializable, e.g. for a checkpoint of the pipeline."""
+        return {"sent": self.sent, "edits_saved": self.edits_saved, "stopped_runs": self.stopped_runs}
+
+    def set_state(self, state: Dict):
+        self.sent = {signature: list(runs) for signature, runs in state["sent"].items()}
+        self.edits_saved = state["edits_saved"]
+        self.stopped_runs = state["stopped_runs"]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "error_signatures": len(self.sent),
+            "repeated_errors": sum(len(runs) - 1 for runs in self.sent.values()),
+            "edits_saved": self.edits_saved,
+            "stopped_runs": self.stopped_runs,
+        }
+
+
+def escalate_error(error_msg: str, repeats: int, game_log_tail: str = "") -> str:
+    """The error message of an error sent `repeats` times before, with more context."""
+    escalated = (f"This error was already sent for debugging {repeats} time(s), and the edits did not fix it. "
+                 f"Do not patch the line raising it again, find its root cause, e.g. in the game state or "
+                 f"in the legal actions leading to it.\n\n{error_msg}")
+    if game_log_tail and game_log_tail not in error_msg:
+        escalated += f"\n\nThe last turns of the failed game:\n{game_log_tail}"
+    return escalated
+
@@ -0,0 +1,475 @@
+"""
+Coverage-guided fuzzing of generated game code.
+
+A fuzz campaign plays a series of games in one sandbox worker while measuring the line and
+branch coverage of the game code (proceed_round, get_legal_actions, get_payoffs and their
+helpers). The coverage steers the campaign, at no cost beyond the measure:
+- every number of players of num_players_range is played, first the numbers never played,
+  then the ones whose last game found new coverage;
+- the games finding new arcs are kept in a corpus (their seed and their decisions), half of
+  the next games replay the first decisions of a game of the corpus and then play new ones;
+- the actions are random, biased toward the kinds of actions whose handlers have branch
+  outcomes not covered yet, see FuzzAgent.
+So the rare branches (a number of players, a late state of a long game) are reached, and crash,
+in fewer games than with random games. Trying the legal actions on a copy of the game state
+before each decision was measured too: it reached no more coverage, at twice the time.
+
+Usage:
+    passed, gameplay_logs, error_logs, report = fuzz_test(temp_dir, game_name, temp_id, game_code, games=30)
+    python -m GameCode.debug.fuzz data/gameplay_ai_generation/examples/uno/uno.py
+"""
+from __future__ import annotations
+import os
+import ast
+import math
+import sys
+import time
+import random
+import logging
+import traceback
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from GameEngine.utils.code import load_code_module, code_hash, code_filename
+from GameEngine.utils.base_message import ObservationMsg, PayoffMsg, TurnEndMsg
+from GameCode.debug.test_env import TestResult, TIMEOUT_MESSAGE, close_game_log, read_log_tail
+from GameCode.debug.sandbox import get_sandbox_pool, SandboxTimeout, SandboxCrashed, SandboxError
+
+Arc = Tuple[int, int]  # (from line, to line), a negative line is the entry or exit of a function
+# a game that found new arcs: its seed, its number of players, its decisions and the arcs found
+CorpusEntry = Tuple[int, int, List[int], int]
+
+MUTATION_RATE = 0.5  # games replaying a game of the corpus, once every number of players was played
+GUIDED_RATE = 0.25  # decisions preferring the kinds of actions with the most open branch points
+MAX_CORPUS = 50  # games kept in the corpus, the ones finding the most arcs
+
+
+def _code_section(code: str) -> Tuple[int, int]:
+    """First and last line of the game code in the wrapped code, the whole code if not wrapped."""
+    lines = code.splitlines()
+    first, last = 1, len(lines)
+    for i, line in enumerate(lines, start=1):
+        if line.strip() == '"""Beginning of the game code"""':
+            first = i
+        elif line.strip() == '"""End of the game code"""':
+            last = i
+    return first, last
+
+
+def _is_docstring(node: ast.AST) -> bool:
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+class GameCodeCoverage:
+    """
+    Line and branch coverage of the functions of the game code, measured with sys.settrace.
+    A branch is an outcome of an if, while or for statement: the body runs, or not.
+
+    Args:
+        code: the wrapped game code, as loaded by load_code_module
+    """
+
+    def __init__(self, code: str):
+        self.filename = code_filename(code)
+        self.first_line, self.last_line = _code_section(code)
+        self.lines: Dict[int, str] = {}  # executable line to its function
+        self.points: Dict[int, Tuple[range, int]] = {}  # branch point line to its test lines and body line
+        self.point_of_line: Dict[int, int] = {}  # test line to its branch point line
+        self.arcs: Set[Arc] = set()
+        self.covered_branches: Set[Tuple[int, bool]] = set()  # (branch point line, outcome)
+        self._pending: Set[Arc] = set()  # arcs run, not counted yet
+        self._sink: Set[Arc] = self._pending
+        self._analyze(code)
+
+    def _analyze(self, code: str):
+        for node in ast.parse(code).body:
+            if not self.first_line < node.lineno < self.last_line:
+                continue
+            if isinstance(node, ast.ClassDef):
+                functions = [(f"{node.name}.{child.name}", child) for child in node.body
+                             if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                functions = [(node.name, node)]
+            else:
+                continue
+            for name, function in functions:
+                for child in ast.walk(function):
+                    if child is function or not isinstance(child, ast.stmt) or _is_docstring(child):
+                        continue
+                    self.lines.setdefault(child.lineno, name)
+                    if isinstance(child, (ast.If, ast.While)):
+                        test_end = child.test.end_lineno
+                        if isinstance(child.test, ast.Constant):
+                            continue  # e.g. while True
+                    elif isinstance(child, (ast.For, ast.AsyncFor)):
+                        test_end = child.iter.end_lineno
+                    else:
+                        continue
+                    body_line = child.body[0].lineno
+                    if body_line <= test_end:
+                        continue  # one-line statement, the outcome is not visible in the lines
+                    test_lines = range(child.lineno, test_end + 1)
+                    self.points[child.lineno] = (test_lines, body_line)
+                    for line in test_lines:
+                        self.point_of_line[line] = child.lineno
+
+    def _trace(self, frame, event, arg):
+        code = frame.f_code
+        if code.co_filename != self.filename or not self.first_line < code.co_firstlineno < self.last_line:
+            return None
+        last_line = [-code.co_firstlineno]
+
+        def trace_lines(frame, event, arg):
+            if event == 'line':
+                self._sink.add((last_line[0], frame.f_lineno))
+                last_line[0] = frame.f_lineno
+            elif event == 'return':
+                self._sink.add((last_line[0], -code.co_firstlineno))
+            return trace_lines
+        return trace_lines
+
+    @contextmanager
+    def measure(self):
+        """Measure the coverage of the code run in this block."""
+        previous = sys.gettrace()
+        sys.settrace(self._trace)
+        try:
+            yield self
+        finally:
+            sys.settrace(previous)
+
+    @contextmanager
+    def collect(self, arcs: Set[Arc]):
+        """Collect the arcs run in this block into `arcs` instead, they are not covered until added."""
+        sink, self._sink = self._sink, arcs
+        try:
+            yield arcs
+        finally:
+            self._sink = sink
+
+    def add(self, arcs: Set[Arc]):
+        for source, target in arcs - self.arcs:
+            point = self.point_of_line.get(source)
+            if point is not None:
+                test_lines, body_line = self.points[point]
+                if target not in test_lines:
+                    self.covered_branches.add((point, target == body_line))
+        self.arcs.update(arcs)
+
+    def update(self):
+        """Count the arcs run since the last update."""
+        self.add(self._pending)
+        self._pending.clear()
+
+    def new_arcs(self, arcs: Set[Arc]) -> int:
+        """Number of arcs not covered yet, i.e. the novelty of the code run."""
+        return len(arcs - self.arcs)
+
+    def summary(self) -> Dict:
+        """Coverage ratios, and the lines of each function never run (lines of the wrapped code)."""
+        self.update()
+        covered_lines = {target for _, target in self.arcs} & self.lines.keys()
+        functions = {}
+        for line, name in sorted(self.lines.items()):
+            function = functions.setdefault(name, {"lines": 0, "covered_lines": 0, "uncovered_lines": []})
+            function["lines"] += 1
+            if line in covered_lines:
+                function["covered_lines"] += 1
+            else:
+                function["uncovered_lines"].append(line)
+        return {
+            "line_coverage": len(covered_lines) / len(self.lines) if self.lines else 1.0,
+            "branch_coverage": len(self.covered_branches) / (2 * len(self.points)) if self.points else 1.0,
+            "lines": len(self.lines),
+            "covered_lines": len(covered_lines),
+            "branches": 2 * len(self.points),
+            "covered_branches": len(self.covered_branches),
+            "functions": functions,
+        }
+
+
+def action_kind(action) -> str:
+    """The handler of an action in proceed_round: its name and the names of its arguments."""
+    if not isinstance(action, dict):
+        return type(action).__name__
+    args = action.get('args')
+    arg_names = sorted(args) if isinstance(args, dict) else []
+    return f"{action.get('action')}({', '.join(map(str, arg_names))})"
+
+
+class FuzzAgent:
+    """
+    Random legal actions, biased toward the kinds of actions (see action_kind) whose handlers
+    have open branch points, i.e. reached with an outcome not covered yet: a kind never played
+    is played first, and GUIDED_RATE of the decisions prefer the kinds with the most open
+    points, if the kinds differ. Otherwise all the legal actions are equally likely, a bias
+    toward a kind changes the course of the games, e.g. more wild cards and fewer draws in uno.
+    The first decisions of a game can be replayed from `prefix`,
+    the indices of the actions in the legal actions, to mutate a game of the corpus.
+    One agent plays for all the players, so the decisions of the game are in one list.
+
+    Args:
+        coverage: the coverage of the campaign, None for uniformly random actions
+    """
+
+    def __init__(self, rng: random.Random, coverage: GameCodeCoverage = None,
+                 kind_points: Dict[str, Set[int]] = None, prefix: List[int] = ()):
+        self.rng = rng
+        self.coverage = coverage
+        self.kind_points = kind_points if kind_points is not None else {}  # kind to the branch points it reached
+        self.prefix = list(prefix)
+        self.decisions: List[int] = []  # indices of the actions played
+
+    def _open_points(self, kind: str) -> float:
+        points = self.kind_points.get(kind)
+        if points is None:
+            return math.inf
+        covered = self.coverage.covered_branches
+        return sum((point, True) not in covered or (point, False) not in covered for point in points)
+
+    def _choose(self, legal_actions: list) -> int:
+        if self.coverage is None:
+            return self.rng.randrange(len(legal_actions))
+        by_kind: Dict[str, List[int]] = {}
+        for i, action in enumerate(legal_actions):
+            by_kind.setdefault(action_kind(action), []).append(i)
+        if len(by_kind) > 1:
+            open_points = {kind: self._open_points(kind) for kind in by_kind}
+            most = max(open_points.values())
+            if most > min(open_points.values()) and (most == math.inf or self.rng.random() < GUIDED_RATE):
+                kind = self.rng.choice([kind for kind, count in open_points.items() if count == most])
+                return self.rng.choice(by_kind[kind])
+        return self.rng.randrange(len(legal_actions))
+
+    def eval_step(self, observation: Dict) -> Tuple[Dict, Dict]:
+        legal_actions = list(observation['legal_actions'])
+        if not legal_actions:
+            return None, {}  # like RandomAgent, the game code gets the None action
+        step = len(self.decisions)
+        if step < len(self.prefix) and self.prefix[step] < len(legal_actions):
+            index = self.prefix[step]
+        else:
+            index = self._choose(legal_actions)
+        self.decisions.append(index)
+        return legal_actions[index], {}
+
+    def record(self, action, arcs: Set[Arc]):
+        """Record the branch points reached by the handler of the action played."""
+        if self.coverage is None:
+            return
+        points = self.kind_points.setdefault(action_kind(action), set())
+        points.update(self.coverage.point_of_line[source] for source, _ in arcs
+                      if source in self.coverage.point_of_line)
+
+
+def play_game(env, module, agent: FuzzAgent, coverage: GameCodeCoverage) -> list:
+    """Play a game like LLMGame.run (see GameEngine/mini_env.py), the agent plays for every player."""
+    game_state = env.reset()
+    legal_actions = module.get_legal_actions(game_state)
+    observation = module.get_observation(game_state)
+    observation['legal_actions'] = legal_actions
+
+    while not game_state['common']['is_over']:
+        env.logger.append(game_state)
+
+        current_player = game_state.common['current_player']
+        env.logger.record(ObservationMsg(current_player, observation))
+
+        action, _ = agent.eval_step(observation)
+        env.logger.act(current_player, action)
+
+        with coverage.collect(set()) as arcs:
+            game_state = module.proceed_round(action, game_state, env.logger)
+        coverage.add(arcs)
+        agent.record(action, arcs)
+        legal_actions = module.get_legal_actions(game_state)
+        observation = module.get_observation(game_state)
+        observation['legal_actions'] = legal_actions
+        env.logger.record(TurnEndMsg(current_player))
+
+    payoffs = module.get_payoffs(game_state, env.logger)
+    if env.logger.enable_info:
+        env.logger.info(f"Game over. Payoffs for each player: {payoffs}")
+    else:
+        env.logger.record(PayoffMsg(payoffs))
+    return payoffs
+
+
+@dataclass
+class FuzzResult(TestResult):
+    """Outcome of a fuzz campaign, `seed` and `num_players` are the ones of the last game."""
+    games: int = 0  # games played
+    coverage: Dict = field(default_factory=dict)  # see GameCodeCoverage.summary
+
+
+def _player_counts(module, num_players: int) -> List[int]:
+    if num_players is not None:
+        return [num_players]
+    counts = getattr(module, 'num_players_range', None)
+    if isinstance(counts, (list, tuple)) and counts and all(isinstance(n, int) and n > 0 for n in counts):
+        return list(counts)
+    return [getattr(module, 'recommended_num_players', None)]
+
+
+def fuzz_worker(game_code: str,
+                game_log_path: str,
+                seed: int,
+                games: int = 30,
+                num_players: int = None,
+                time_limit: float = None,
+                enable_info: bool = True,
+                detect_loops: bool = True,
+                guided: bool = True
+                ) -> FuzzResult:
+    """
+    Play a fuzz campaign of up to `games` games, stopped at the first crash, or when
+    `time_limit` seconds are over after a game. The gameplay log is the one of the last game.
+    Without `guided`, the games are uniformly random, with a random number of players,
+    e.g. to compare the coverage.
+    Run in a sandbox worker process (see GameCode.debug.sandbox).
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    coverage = GameCodeCoverage(game_code)
+    game_seed, players, played = seed, num_players, 0
+
+    def result(passed, error=""):
+        return FuzzResult(passed, game_seed, players, error=error, duration=time.perf_counter() - start,
+                          games=played, coverage=coverage.summary())
+
+    try:
+        module = load_code_module(game_code)
+    except Exception:
+        return result(False, traceback.format_exc())
+    player_counts = _player_counts(module, num_players)
+    # games played, and arcs found by the last game, of each number of players
+    count_games = {count: 0 for count in player_counts}
+    count_gains = {count: 0 for count in player_counts}
+    corpus: List[CorpusEntry] = []
+    kind_points: Dict[str, Set[int]] = {}  # see FuzzAgent
+
+    with coverage.measure():
+        for played in range(1, games + 1):
+            game_seed, prefix = rng.randint(0, 10**6), []
+            if not guided:
+                players = rng.choice(player_counts)
+            elif corpus and all(count_games.values()) and rng.random() < MUTATION_RATE:
+                # replay the first decisions of a game of the corpus, the next ones are new
+                game_seed, players, decisions, _ = rng.choices(corpus, weights=[entry[3] for entry in corpus])[0]
+                prefix = decisions[:rng.randrange(len(decisions))] if decisions else []
+            else:
+                players = max(player_counts, key=lambda count: (count_games[count] == 0, count_gains[count],
+                                                                -count_games[count]))
+            count = players
+            np.random.seed(game_seed)
+            known_arcs = len(coverage.arcs)
+            with open(game_log_path, 'w'):
+                pass
+            try:
+                env = module.LLMGame({'game_num_players': players, 'seed': game_seed, 'log_path': game_log_path,
+                                      'enable_info': enable_info, 'detect_loops': detect_loops})
+                players = env.num_players
+                agent = FuzzAgent(random.Random(rng.random()), coverage if guided else None, kind_points, prefix)
+                env.set_agents([agent] * players)
+                play_game(env, module, agent, coverage)
+            except Exception:
+                logging.error(f"Fuzzing found a crash in game {played} of {game_log_path}.")
+                return result(False, traceback.format_exc())
+            finally:
+                close_game_log(game_log_path)
+            coverage.update()
+            count_games[count] += 1
+            count_gains[count] = len(coverage.arcs) - known_arcs
+            if guided and count_gains[count]:
+                corpus.append((game_seed, count, agent.decisions, count_gains[count]))
+                if len(corpus) > MAX_CORPUS:
+                    corpus.remove(min(corpus, key=lambda entry: entry[3]))
+            if time_limit is not None and time.perf_counter() - start > time_limit:
+                break
+    logging.info(f"Fuzzing passed {played} games of {game_log_path}.")
+    return result(True)
+
+
+def fuzz_test(temp_dir: str,
+              game_name: str,
+              temp_id: str,
+              game_code: str,
+              games: int = 30,
+              num_players: int = None,
+              timeout: int = 10,
+              time_limit: float = None,
+              enable_info: bool = True,
+              seed: int = None,
+              ) -> Tuple[bool, List[str], List[str], Dict]:
+    """
+    Fuzz the game code in a sandbox worker. The campaign stops starting games after
+    `time_limit` seconds (3 timeouts by default), and is killed if a game then runs longer than `timeout`.
+    The seed is drawn from the hash of the code if None, so the same code plays the same campaign.
+    Returns:
+        - A boolean indicating if no crash was found.
+        - The gameplay log file of the crash, empty if passed.
+        - The error log file of the crash, empty if passed.
+        - The fuzz report: the coverage (see GameCodeCoverage.summary), the games played and the duration.
+    """
+    if seed is None:
+        seed = random.Random(code_hash(game_code)).randint(0, 10**6)
+    if time_limit is None:
+        time_limit = 3 * timeout
+    game_log_path = os.path.join(temp_dir, f"{game_name}_{temp_id}_fuzz.log")
+    error_log_path = os.path.join(temp_dir, f"{game_name}_{temp_id}_fuzz_error.log")
+    start = time.perf_counter()
+    try:
+        result = get_sandbox_pool().call(
+            fuzz_worker,
+            dict(game_code=game_code, game_log_path=game_log_path, seed=seed, games=games,
+                 num_players=num_players, time_limit=time_limit, enable_info=enable_info),
+            timeout=time_limit + timeout)
+    except (SandboxTimeout, SandboxCrashed) as e:
+        logging.error(f"Fuzzing timed out for {game_log_path}: {e}")
+        log_tail = read_log_tail(game_log_path)
+        result = FuzzResult(False, seed, num_players, error=TIMEOUT_MESSAGE.format(log_tail=log_tail),
+                            log_tail=log_tail, timed_out=True)
+    except SandboxError as e:
+        result = FuzzResult(False, seed, num_players, error=str(e))
+    result.duration = time.perf_counter() - start
+
+    report = {
+        "fuzz_games": result.games,
+        "fuzz_crash": not result.passed,
+        "fuzz_duration": result.duration,
+        **result.coverage,
+    }
+    if result.passed:
+        if os.path.exists(game_log_path):
+            os.remove(game_log_path)
+        return True, [], [], report
+    with open(error_log_path, 'w', encoding='utf-8') as error_file:
+        error_file.write(result.error)
+    return False, [game_log_path], [error_log_path], report
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    from GameCode.utils.formatting import wrap_code, unwrap_code
+
+    parser = argparse.ArgumentParser(description="Compare the coverage of guided and random games")
+    parser.add_argument("code_path", type=str, help="path of the game code, wrapped or not")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.code_path, 'r', encoding='utf-8') as f:
+        game_code = wrap_code(unwrap_code(f.read()))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for guided in (True, False):
+            fuzz_result = fuzz_worker(game_code, os.path.join(temp_dir, "fuzz.log"), args.seed,
+                                      games=args.games, enable_info=False, guided=guided)
+            print(f"{'guided' if guided else 'random'}: passed {fuzz_result.passed} in {fuzz_result.games} games, "
+                  f"{fuzz_result.duration:.1f}s, line coverage {fuzz_result.coverage['line_coverage']:.1%}, "
+                  f"branch coverage {fuzz_result.coverage['branch_coverage']:.1%}")
+            if not fuzz_result.passed:
+                print(fuzz_result.error)
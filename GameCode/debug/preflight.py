@@ -0,0 +1,188 @@
+"""
+Static pre-flight check of the game code, before it is tested.
+
+Syntax errors, undefined names and missing template functions are otherwise found by
+playing a game in a sandbox worker. The wrapped code (the engine and the game code) is
+parsed once, and its names are resolved statically against the module namespace, i.e.
+the engine (DotDict, LLMCard, EnvLogger, ...) and the game code, and the builtins. The
+errors are formatted like the traceback of a failed test, with the file name of the code
+in the tests, so debug_code and the error index treat them alike.
+
+Usage:
+    error = preflight_check(game_code)   # "" if the code passes
+"""
+from __future__ import annotations
+import ast
+import builtins
+import symtable
+import traceback
+from typing import Dict, List, Set, Tuple
+
+from GameEngine.utils.code import code_filename
+
+# functions of the code template called by the engine, and their positional arguments
+TEMPLATE_FUNCTIONS = {
+    'initiation': ('num_players', 'logger'),
+    'get_legal_actions': ('game_state',),
+    'proceed_round': ('action', 'game_state', 'logger'),
+    'get_payoffs': ('game_state', 'logger'),
+}
+MAX_REPORTED_ERRORS = 10  # errors listed after the first one
+MODULE_NAMES = {'__name__', '__file__', '__doc__', '__builtins__', '__spec__', '__loader__', '__package__'}
+
+_SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda,
+                ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+_ANONYMOUS_SCOPES = {'lambda', 'genexpr', 'listcomp', 'setcomp', 'dictcomp'}
+
+# an error: its line, the function it is in, the exception type and its message
+Error = Tuple[int, str, str, str]
+
+
+def _undefined_names(game_code: str, filename: str, tree: ast.Module) -> List[Error]:
+    """
+    The names loaded in the code and bound nowhere, with the symbol tables of the compiler:
+    a name global in its scope must be bound in the module (or declared global and assigned
+    in a function), or be a builtin.
+    """
+    if any(isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names)
+           for node in tree.body):
+        return []  # the names of a star import are unknown
+    top = symtable.symtable(game_code, filename, 'exec')
+    module_names = MODULE_NAMES | set(dir(builtins))
+    module_names.update(symbol.get_name() for symbol in top.get_symbols()
+                        if symbol.is_assigned() or symbol.is_imported() or symbol.is_namespace())
+
+    undefined = []  # (table, the function reported, name)
+    tables = [(top, "<module>")]
+    while tables:
+        table, function_name = tables.pop()
+        for symbol in table.get_symbols():
+            if symbol.is_declared_global() and symbol.is_assigned():
+                module_names.add(symbol.get_name())
+            elif symbol.is_referenced() and symbol.is_global() and not symbol.is_declared_global():
+                undefined.append((table, function_name, symbol.get_name()))
+        for child in table.get_children():
+            # a lambda or a comprehension is reported in the function it is in
+            tables.append((child, function_name if child.get_name() in _ANONYMOUS_SCOPES else child.get_name()))
+    undefined = [item for item in undefined if item[2] not in module_names]
+    if not undefined:
+        return []
+
+    # the line of the first use of each name, in the scope of its table
+    scopes = {(node.lineno, getattr(node, 'name', 'lambda')): node for node in ast.walk(tree)
+              if isinstance(node, _SCOPE_NODES)}
+    errors = []
+    for table, function_name, name in undefined:
+        scope = tree if table.get_type() == 'module' else scopes.get((table.get_lineno(), table.get_name()), tree)
+        line = min((node.lineno for node in ast.walk(scope)
+                    if isinstance(node, ast.Name) and node.id == name and isinstance(node.ctx, ast.Load)),
+                   default=table.get_lineno())
+        errors.append((line, function_name, "NameError", f"name '{name}' is not defined"))
+    return errors
+
+
+def _template_calls(tree: ast.Module) -> Dict[str, Tuple[int, str]]:
+    """The line and the function of the first call of each template function, e.g. in LLMGame.run."""
+    calls = {}
+    functions = [node for statement in tree.body
+                 for node in (statement.body if isinstance(statement, ast.ClassDef) else [statement])
+                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    for function in functions:
+        for node in ast.walk(function):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                    and node.func.id in TEMPLATE_FUNCTIONS and node.func.id != function.name:
+                calls.setdefault(node.func.id, (node.lineno, function.name))
+    return calls
+
+
+def _template_errors(tree: ast.Module) -> Tuple[List[Error], Set[str]]:
+    """The errors of the template functions, at the lines calling them, and the missing functions."""
+    definitions: Dict[str, ast.AST] = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            for target in (node.targets if isinstance(node, ast.Assign) else [node.target]):
+                if isinstance(target, ast.Name):
+                    definitions[target.id] = node
+
+    problems, missing = [], set()
+    for name, arguments in TEMPLATE_FUNCTIONS.items():
+        signature = f"{name}({', '.join(arguments)})"
+        definition = definitions.get(name)
+        if definition is None:
+            missing.add(name)
+            problems.append((name, "NameError", f"name '{name}' is not defined. "
+                             f"The game code must define the function {signature} of the code template"))
+        elif not isinstance(definition, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            problems.append((name, "TypeError", f"'{name}' is not a function. "
+                             f"The game code must define the function {signature} of the code template"))
+        else:
+            parameters = definition.args
+            positional = parameters.posonlyargs + parameters.args
+            required = len(positional) - len(parameters.defaults)
+            required_keywords = [default for default in parameters.kw_defaults if default is None]
+            accepts = required <= len(arguments) and (parameters.vararg is not None
+                                                      or len(arguments) <= len(positional))
+            if not accepts or required_keywords:
+                problems.append((name, "TypeError",
+                                 f"{name}() is called with {len(arguments)} positional arguments, as {signature}, "
+                                 f"but defined at line {definition.lineno} with other arguments"))
+    if not problems:
+        return [], missing
+    calls = _template_calls(tree)
+    return [(*calls.get(name, (1, "<module>")), error_type, message)
+            for name, error_type, message in problems], missing
+
+
+def _format_errors(errors: List[Error], filename: str, lines: List[str]) -> str:
+    """The first error as the traceback of a failed test, the others listed after it."""
+    errors = sorted(set(errors))
+    line, scope_name, error_type, message = errors[0]
+    source = lines[line - 1].strip() if 0 < line <= len(lines) else ""
+    text = (f"Traceback (most recent call last):\n  File \"{filename}\", line {line}, in {scope_name}\n"
+            f"    {source}\n{error_type}: {message}")
+    if len(errors) > 1:
+        text += "\n\nThe static check of the code also found:"
+        for line, scope_name, error_type, message in errors[1:1 + MAX_REPORTED_ERRORS]:
+            text += f"\n- line {line}, in {scope_name}: {error_type}: {message}"
+        if len(errors) > 1 + MAX_REPORTED_ERRORS:
+            text += f"\n- ... {len(errors) - 1 - MAX_REPORTED_ERRORS} more"
+    return text
+
+
+def preflight_check(game_code: str) -> str:
+    """
+    Check the wrapped game code statically: its syntax, the names it uses and the template
+    functions. Returns "" if the code passes, else the errors formatted like a failed test.
+    """
+    filename = code_filename(game_code)
+    try:
+        tree = ast.parse(game_code, filename)
+        errors, missing = _template_errors(tree)
+        # a missing template function is reported once, by the template check
+        errors += [error for error in _undefined_names(game_code, filename, tree)
+                   if error[3] not in {f"name '{name}' is not defined" for name in missing}]
+    except SyntaxError as e:
+        e.filename = filename
+        return "Traceback (most recent call last):\n" + "".join(traceback.format_exception_only(type(e), e)).rstrip()
+    if not errors:
+        return ""
+    return _format_errors(errors, filename, game_code.splitlines())
+
+
+if __name__ == '__main__':
+    import os
+    import time
+    from GameCode.utils.formatting import wrap_code, unwrap_code
+
+    examples_dir = os.path.join('data', 'gameplay_ai_generation', 'examples')
+    for game_name in sorted(os.listdir(examples_dir)):
+        code_path = os.path.join(examples_dir, game_name, f"{game_name}.py")
+        if not os.path.exists(code_path):
+            continue
+        with open(code_path, 'r', encoding='utf-8') as f:
+            code = wrap_code(unwrap_code(f.read()))
+        start = time.perf_counter()
+        error = preflight_check(code)
+        print(f"{game_name}: {(time.perf_counter() - start) * 1000:.1f} ms, {'passed' if not error else error}")
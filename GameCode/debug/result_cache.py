@@ -0,0 +1,112 @@
+"""
+Persistent cache of game test results.
+
+A random playthrough is fully determined by the game code (with the engine it is wrapped
+in), the seed, the number of players and the test settings, so its outcome is cached under
+these. Code that was already tested, e.g. after a no-op edit or when a pipeline repetition
+converges to a known version, is not played again; the cached gameplay log and error are
+written back to the log paths expected by the caller.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from GameEngine.utils.code import code_hash
+
+
+class TestResultCache:
+    """
+    Args:
+        path: path of the sqlite database, created if not exists, in memory if ':memory:'
+        max_entries: the least recently used results are evicted beyond this number
+    """
+    __test__ = False  # not a pytest test class
+
+    def __init__(self, path: str = 'test_cache.sqlite', max_entries: int = 20000):
+        assert max_entries is None or max_entries > 0, "max_entries must be positive"
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, code_hash TEXT, passed INTEGER, result TEXT, game_log TEXT, "
+                "created REAL, accessed REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    @staticmethod
+    def make_key(game_code: str, seed: int, num_players: int, **settings) -> str:
+        """Key of a playthrough, `settings` are the test settings changing its outcome, e.g. the timeout."""
+        data = json.dumps({
+            "code": code_hash(game_code),
+            "seed": seed,
+            "num_players": num_players,
+            "settings": settings,
+        }, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """The cached result fields and its gameplay log (as 'game_log'), None if not cached."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT result, game_log FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return {**json.loads(row[0]), "game_log": row[1]}
+
+    def put(self, key: str, game_code: str, result: Dict, game_log: str):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, code_hash, passed, result, game_log, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, code_hash(game_code), int(result["passed"]), json.dumps(result), game_log, now, now))
+            if self.max_entries is not None:
+                count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY accessed LIMIT ?)", (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "test_cache_hits": self.hits,
+            "test_cache_misses": self.misses,
+        }
+
+    def close(self):
+        self._conn.close()
+
+    def __getstate__(self):
+        # the connection is reopened in the new process
+        state = self.__dict__.copy()
+        del state['_conn'], state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
@@ -0,0 +1,263 @@
+"""
+A pool of warm worker processes running untrusted game code.
+
+The workers are forked from a forkserver that has already imported the game engine, so a
+test starts in milliseconds. Each call runs in a worker under memory and CPU rlimits; a call
+that times out is hard-killed with its worker, which is replaced by a fresh one, so an
+infinite loop in generated code never keeps burning a core after its test.
+
+Usage:
+    pool = get_sandbox_pool()
+    result = pool.call(test_env_worker, {...}, timeout=8)   # raises SandboxTimeout
+"""
+from __future__ import annotations
+import os
+import math
+import time
+import atexit
+import logging
+import threading
+import traceback
+import multiprocessing as mp
+from typing import Any, Callable, Dict, List
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the limits are not enforced
+    resource = None
+
+# modules imported once by the forkserver, so the workers start warm.
+# '__main__' is imported there too, instead of again by every worker
+PRELOAD_MODULES = [
+    '__main__',
+    'GameEngine.utils.env_logger',
+    'GameEngine.utils.base_message',
+    'GameEngine.utils.base_agents',
+    'GameEngine.utils.code',
+    'GameCode.debug.test_env',
+    'GameCode.debug.fuzz',
+    'GameCode.debug.shrink',
+]
+DEFAULT_MEMORY_LIMIT_MB = 2048  # address space of a worker
+DEFAULT_NUM_WORKERS = min(10, os.cpu_count() or 1)
+CANCEL_CHECK_INTERVAL = 0.02  # seconds between checks of the cancel event
+
+
+class SandboxError(RuntimeError):
+    """The call raised in the worker, the message is its traceback."""
+
+
+class SandboxTimeout(TimeoutError):
+    """The call did not finish in time, its worker was killed."""
+
+
+class SandboxCrashed(RuntimeError):
+    """The worker died during the call, e.g. when it exceeded its CPU limit or crashed."""
+
+
+class SandboxCancelled(RuntimeError):
+    """The call was cancelled by its caller, its worker was killed."""
+
+
+def _set_memory_limit(memory_limit_mb: int):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as err:
+        logging.warning(f"Failed to limit the memory of the sandbox worker: {err}")
+
+
+def _set_cpu_limit(seconds: float):
+    """Limit the CPU time of the next call, the soft limit sends SIGXCPU which kills the worker."""
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    except (ValueError, OSError) as err:
+        logging.warning(f"Failed to limit the CPU time of the sandbox worker: {err}")
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    _set_memory_limit(memory_limit_mb)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return  # the pool is gone
+        if task is None:
+            return
+        func, kwargs, cpu_time_limit = task
+        _set_cpu_limit(cpu_time_limit)
+        try:
+            reply = ("ok", func(**kwargs))
+        except BaseException:
+            reply = ("error", traceback.format_exc())
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            return
+
+
+def _get_context():
+    if "forkserver" in mp.get_all_start_methods():
+        context = mp.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD_MODULES)
+        return context
+    return mp.get_context("spawn")
+
+
+class _Worker:
+
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Args:
+        num_workers: worker processes, i.e. calls running at the same time
+        memory_limit_mb: address space limit of each worker, no limit if 0
+        cpu_margin: CPU seconds allowed on top of the timeout of a call
+    """
+
+    def __init__(self, num_workers: int = DEFAULT_NUM_WORKERS,
+                 memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+                 cpu_margin: float = 1.0):
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_margin = cpu_margin
+        self.context = _get_context()
+        self.idle: List[_Worker] = [_Worker(self.context, memory_limit_mb) for _ in range(num_workers)]
+        self.num_workers = num_workers
+        self.killed_count = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def _acquire(self) -> _Worker:
+        with self._condition:
+            while not self.idle:
+                if self.closed:
+                    raise RuntimeError("The sandbox pool is closed")
+                self._condition.wait()
+            return self.idle.pop()
+
+    def _release(self, worker: _Worker):
+        with self._condition:
+            self.idle.append(worker)
+            self._condition.notify()
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        self.killed_count += 1
+        self._release(_Worker(self.context, self.memory_limit_mb))
+
+    def _wait(self, worker: _Worker, timeout: float, cancel: threading.Event) -> bool:
+        """Wait for the reply of the worker, False if the call timed out."""
+        if cancel is None:
+            return worker.conn.poll(timeout)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not cancel.is_set():
+            interval = CANCEL_CHECK_INTERVAL
+            if deadline is not None:
+                interval = min(interval, deadline - time.monotonic())
+                if interval <= 0:
+                    return False
+            if worker.conn.poll(interval):
+                return True
+        self._replace(worker)
+        raise SandboxCancelled("The call was cancelled")
+
+    def call(self, func: Callable[..., Any], kwargs: Dict = None, timeout: float = None,
+             cancel: threading.Event = None) -> Any:
+        """
+        Call func(**kwargs) in a worker and return its result. func must be a module-level
+        function, and its arguments and result picklable. Thread-safe, the calls wait for
+        an idle worker. Setting the `cancel` event stops the call, and the calls waiting to start.
+        Raises SandboxTimeout, SandboxCrashed, SandboxCancelled, or SandboxError if func raised.
+        """
+        cpu_time_limit = timeout + self.cpu_margin if timeout else None
+        worker = self._acquire()
+        if cancel is not None and cancel.is_set():
+            self._release(worker)
+            raise SandboxCancelled("The call was cancelled before it started")
+        try:
+            worker.conn.send((func, kwargs or {}, cpu_time_limit))
+            if not self._wait(worker, timeout, cancel):
+                self._replace(worker)
+                raise SandboxTimeout(f"{func.__name__} did not finish in {timeout} seconds")
+            status, value = worker.conn.recv()
+        except (SandboxTimeout, SandboxCancelled):  # a SandboxTimeout is an OSError
+            raise
+        except (EOFError, OSError) as err:
+            self._replace(worker)
+            exitcode = worker.process.exitcode
+            raise SandboxCrashed(f"The sandbox worker died (exit code {exitcode})") from err
+        except BaseException:
+            # e.g. interrupted while waiting, the worker may still be busy
+            self._replace(worker)
+            raise
+        self._release(worker)
+        if status == "error":
+            raise SandboxError(value)
+        return value
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            workers, self.idle = self.idle, []
+            self._condition.notify_all()
+        for worker in workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_pools: Dict[int, SandboxPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_sandbox_pool(num_workers: int = None) -> SandboxPool:
+    """The sandbox pool of this process, started on first use with num_workers workers."""
+    with _pools_lock:
+        pool = _pools.get(os.getpid())
+        if pool is None or pool.closed:
+            pool = SandboxPool(num_workers or DEFAULT_NUM_WORKERS)
+            _pools[os.getpid()] = pool
+        return pool
+
+
+@atexit.register
+def close_sandbox_pools():
+    with _pools_lock:
+        pool = _pools.pop(os.getpid(), None)
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,263 @@
+"""
+Shrinking of failing random playthroughs.
+
+A failed test is replayed with its seed while its actions are recorded (the random agents
+draw from numpy, seeded like in test_env_worker, so the game is the same). The action
+sequence is then minimized by delta debugging (ddmin): subsets of the actions are replayed
+with the same seed, an action no longer legal being replaced by the first legal one, and the
+actions played by any replay failing with the same error (exception type and game code line)
+are kept. The compact repro, i.e.
+the shortest reproducing actions, the error and the last turn, is sent to debug_code
+instead of the traceback of the whole game.
+
+Usage:
+    repro = shrink_failure(game_code, seed=42, num_players=2)   # "" if not reproduced
+"""
+from __future__ import annotations
+import math
+import time
+import logging
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from GameEngine.utils.base_agents import RandomAgent
+from GameEngine.utils.base_message import ObservationMsg, action_to_str
+from GameEngine.utils.code import load_code_module
+from GameCode.debug.sandbox import get_sandbox_pool, SandboxError, SandboxTimeout, SandboxCrashed
+
+MAX_REPLAYS = 300  # replays of a shrinking at most
+MAX_REPRO_ACTIONS = 30  # actions shown in the repro, the last ones if more
+MAX_TURN_LOG_LENGTH = 3000  # characters of the last turn shown in the repro
+
+Signature = Tuple[str, int]  # exception type and the game code line it was raised from
+
+
+class _Exhausted(Exception):
+    """All the replayed actions were played without error."""
+
+
+class RecordingAgent(RandomAgent):
+    """A random agent recording its actions in a list shared by the players."""
+
+    def __init__(self, actions: List[Tuple[int, Dict]], player_id: int):
+        super().__init__()
+        self.actions = actions
+        self.player_id = player_id
+
+    def eval_step(self, state):
+        action, info = RandomAgent.eval_step(state)
+        self.actions.append((self.player_id, action))
+        return action, info
+
+
+class ReplayAgent:
+    """
+    Play the next action of a sequence shared by the players, or the first legal action if
+    it is not legal, e.g. a card index after a removed draw. The actions played are recorded
+    with the player playing them.
+    """
+
+    def __init__(self, actions: List[Tuple[int, Dict]], played: List[Tuple[int, Dict]], player_id: int):
+        self.actions = actions
+        self.played = played
+        self.player_id = player_id
+
+    def eval_step(self, observation):
+        if len(self.played) >= len(self.actions):
+            raise _Exhausted()
+        _, action = self.actions[len(self.played)]
+        legal_actions = observation['legal_actions']
+        if action not in legal_actions:
+            if not legal_actions:
+                return None, {}
+            action = legal_actions[0]
+        self.played.append((self.player_id, action))
+        return action, {}
+
+
+def _signature(error: BaseException, filename: str) -> Signature:
+    """The type of the error and the last line of the game code in its traceback."""
+    line = -1
+    for frame in traceback.extract_tb(error.__traceback__):
+        if frame.filename == filename:
+            line = frame.lineno
+    return type(error).__name__, line
+
+
+def _format_error(error: BaseException, filename: str) -> str:
+    """The traceback of the error with the frames of the game code only, and the frame raising it."""
+    frames = traceback.extract_tb(error.__traceback__)
+    kept = [frame for i, frame in enumerate(frames) if frame.filename == filename or i == len(frames) - 1]
+    return ("Traceback (most recent call last):\n" + "".join(traceback.format_list(kept))
+            + "".join(traceback.format_exception_only(type(error), error)))
+
+
+def _last_turn_log(log_items) -> str:
+    """The log of the turn of the error, from its observation."""
+    start = max((i for i, item in enumerate(log_items) if isinstance(item, ObservationMsg)), default=0)
+    turn_log = '\n'.join(str(item) for item in log_items[start:])
+    if len(turn_log) > MAX_TURN_LOG_LENGTH:
+        turn_log = "...\n" + turn_log[-MAX_TURN_LOG_LENGTH:]
+    return turn_log
+
+
+def ddmin(items: List, test: Callable[[List], Optional[List]]) -> List:
+    """
+    Minimize the failing list of items by delta debugging, test returns the failing list
+    (possibly shorter than its argument, e.g. a prefix) or None if it does not fail.
+    """
+    granularity = 2
+    while len(items) >= 2:
+        chunk = math.ceil(len(items) / granularity)
+        subsets = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+        reduced = None
+        for subset in subsets:
+            reduced = test(subset)
+            if reduced is not None:
+                granularity = 2
+                break
+        if reduced is None and len(subsets) > 2:
+            for i in range(len(subsets)):
+                reduced = test([item for j, subset in enumerate(subsets) if j != i for item in subset])
+                if reduced is not None:
+                    granularity = max(granularity - 1, 2)
+                    break
+        if reduced is not None:
+            items = reduced
+        elif granularity >= len(items):
+            break
+        else:
+            granularity = min(len(items), granularity * 2)
+    return items
+
+
+class _Shrinker:
+
+    def __init__(self, module, seed: int, num_players: int, enable_info: bool, detect_loops: bool,
+                 max_replays: int, deadline: float):
+        self.module = module
+        self.seed = seed
+        self.num_players = num_players
+        self.enable_info = enable_info
+        self.detect_loops = detect_loops
+        self.max_replays = max_replays
+        self.deadline = deadline
+        self.replays = 0
+        self.signature: Signature = None
+
+    def play(self, agents_for) -> Tuple[object, Optional[BaseException]]:
+        """Play a game with the agents made by agents_for(num_players), the env and the error."""
+        np.random.seed(self.seed)
+        env = self.module.LLMGame({'game_num_players': self.num_players, 'seed': self.seed,
+                                   'enable_info': self.enable_info, 'detect_loops': self.detect_loops})
+        try:
+            env.set_agents(agents_for(env.num_players))
+            env.run()
+        except Exception as error:
+            return env, error
+        return env, None
+
+    def record(self) -> Tuple[List[Tuple[int, Dict]], Optional[BaseException]]:
+        """The actions of the failing game and its error."""
+        actions = []
+        _, error = self.play(lambda num_players: [RecordingAgent(actions, i) for i in range(num_players)])
+        return actions, error
+
+    def replay(self, actions: List[Tuple[int, Dict]]) -> Tuple[object, Optional[BaseException], List]:
+        """The env, the error, and the actions played before the error."""
+        played = []
+        env, error = self.play(lambda num_players: [ReplayAgent(actions, played, i) for i in range(num_players)])
+        return env, error, played
+
+    def test(self, actions: List[Tuple[int, Dict]]) -> Optional[List[Tuple[int, Dict]]]:
+        if self.replays >= self.max_replays or time.perf_counter() > self.deadline:
+            return None
+        self.replays += 1
+        _, error, played = self.replay(actions)
+        if error is None or isinstance(error, _Exhausted):
+            return None
+        if _signature(error, self.module.__file__) != self.signature:
+            return None
+        return played  # the error may be raised before the last actions
+
+
+def shrink_worker(game_code: str,
+                  seed: int,
+                  num_players: int = None,
+                  enable_info: bool = True,
+                  detect_loops: bool = True,
+                  max_replays: int = MAX_REPLAYS,
+                  time_limit: float = 5.0
+                  ) -> Optional[Dict]:
+    """
+    Record the failing game of the seed and shrink its actions, run in a sandbox worker.
+    Returns None if the game does not fail, else the shrunk repro, see format_repro.
+    """
+    module = load_code_module(game_code)
+    shrinker = _Shrinker(module, seed, num_players, enable_info, detect_loops, max_replays,
+                         time.perf_counter() + time_limit)
+    actions, error = shrinker.record()
+    if error is None:
+        return None
+    shrinker.signature = _signature(error, module.__file__)
+
+    shrunk = ddmin(actions, shrinker.test) if actions else actions
+    env, shrunk_error, played = shrinker.replay(shrunk)
+    if shrunk_error is None or _signature(shrunk_error, module.__file__) != shrinker.signature:
+        # e.g. the shrinking ran out of time, show the recorded game
+        shrunk = actions
+        env, shrunk_error, played = shrinker.replay(actions)
+    return {
+        "seed": seed,
+        "num_players": env.num_players,
+        "original_actions": len(actions),
+        "actions": [(player_id, action_to_str(action)) for player_id, action in played],
+        "error": _format_error(shrunk_error, module.__file__),
+        "last_turn": _last_turn_log(env.logger.log_items),
+        "replays": shrinker.replays,
+    }
+
+
+def format_repro(repro: Dict) -> str:
+    """The compact repro sent to debug_code."""
+    actions = repro["actions"]
+    lines = [f"The error is reproduced with seed {repro['seed']} and {repro['num_players']} players "
+             f"after {len(actions)} actions (the failing random game took {repro['original_actions']}):"]
+    if len(actions) > MAX_REPRO_ACTIONS:
+        lines.append(f"... {len(actions) - MAX_REPRO_ACTIONS} earlier actions")
+    first = max(0, len(actions) - MAX_REPRO_ACTIONS)
+    for i, (player_id, action) in enumerate(actions[first:], start=first + 1):
+        lines.append(f"{i}. Player {player_id}: {action}")
+    lines.append(f"\n{repro['error']}")
+    lines.append(f"The last turn before the error:\n{repro['last_turn']}")
+    return '\n'.join(lines)
+
+
+def shrink_failure(game_code: str,
+                   seed: int,
+                   num_players: int = None,
+                   enable_info: bool = True,
+                   detect_loops: bool = True,
+                   timeout: float = 10
+                   ) -> str:
+    """
+    The compact repro of the failing game of the seed, shrunk in a sandbox worker within
+    `timeout` seconds; "" if the failure is not reproduced, e.g. a timeout.
+    """
+    try:
+        repro = get_sandbox_pool().call(
+            shrink_worker,
+            dict(game_code=game_code, seed=seed, num_players=num_players, enable_info=enable_info,
+                 detect_loops=detect_loops, time_limit=timeout / 2),
+            timeout=timeout)
+    except (SandboxTimeout, SandboxCrashed, SandboxError) as e:
+        logging.warning(f"Failed to shrink the failing game of seed {seed}: {e}")
+        return ""
+    if repro is None:
+        logging.warning(f"The failing game of seed {seed} is not reproduced")
+        return ""
+    logging.info(f"Shrunk the failing game of seed {seed} from {repro['original_actions']} to "
+                 f"{len(repro['actions'])} actions in {repro['replays']} replays")
+    return format_repro(repro)
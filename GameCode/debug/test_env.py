@@ -1,40 +1,68 @@
-from importlib import import_module
 import traceback
+from dataclasses import dataclass, asdict
 from typing import List, Tuple
 import os
-import threading
+import time
 import logging
 from GameEngine.utils.base_agents import RandomAgent
+from GameEngine.utils.code import load_code_module, code_hash
+from GameCode.debug.result_cache import TestResultCache
+from GameCode.debug.shrink import shrink_failure
+from GameCode.debug.sandbox import get_sandbox_pool, SandboxTimeout, SandboxCrashed, SandboxError, SandboxCancelled
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import random
+import numpy as np
+
+
+@dataclass
+class TestResult:
+    """Outcome of one random playthrough."""
+    passed: bool
+    seed: int = None
+    num_players: int = None
+    error: str = ""  # the traceback, or why the test was stopped
+    log_tail: str = ""  # the last lines of the gameplay log
+    timed_out: bool = False
+    duration: float = 0.0  # seconds
+    repro: str = ""  # the shrunk actions reproducing the error, see GameCode.debug.shrink
 
-class StoppableThread(threading.Thread):
-    """Thread class with a stop() method. The thread itself has to check
-    regularly for the stopped() condition."""
+    __test__ = False  # not a pytest test class
 
-    def __init__(self,  *args, **kwargs):
-        super(StoppableThread, self).__init__(*args, **kwargs)
-        self._stop_event = threading.Event()
 
-    def stop(self):
-        self._stop_event.set()
+def read_log_tail(game_log_path: str, character_limit: int = 6000) -> str:
+    """The last lines of the gameplay log, about character_limit characters."""
+    try:
+        with open(game_log_path, 'r', encoding='utf-8') as game_log_file:
+            game_log_items = game_log_file.read().split('\n')
+    except OSError:
+        return ""
+    last_n_logs = []
+    # repeat adding the last element to the front until the total character length is over the limit or game log items are exhausted
+    while len(''.join(last_n_logs)) < character_limit and game_log_items:
+        last_n_logs.insert(0, game_log_items.pop())
+    return '\n'.join(last_n_logs)
 
-    def stopped(self):
-        return self._stop_event.is_set()
 
-def test_env_worker(module_path: str,
-                    error_log_path: str,
+def test_env_worker(game_code: str,
                     game_log_path: str,
                     seed: int,
                     num_players: int,
-                    result,
-                    enable_info: bool = True
-                    ) -> None:
+                    enable_info: bool = True,
+                    detect_loops: bool = True
+                    ) -> TestResult:
     """
-    Worker function to run the test environment in a separate thread.
+    Play one random game, run in a sandbox worker process (see GameCode.debug.sandbox).
+    The code is compiled in memory, see load_code_module.
+    With detect_loops, a game making no progress fails in a few dozen turns, see EnvLogger.check_loop.
     """
     if seed is None:
         seed = random.randint(0, 1000)
     class_name = "LLMGame"
+    start = time.perf_counter()
+
+    # the random agents draw from numpy, seed it too so the game is reproducible
+    np.random.seed(seed)
 
     # clear the game log file content
     with open(game_log_path, 'w') as game_log_file:
@@ -42,34 +70,70 @@ def test_env_worker(module_path: str,
 
     try:
         # Dynamically load the environment class
-        envClass = getattr(import_module(module_path), class_name)
+        envClass = getattr(load_code_module(game_code), class_name)
         env = envClass({'game_num_players': num_players,
-                        'seed': seed, 'log_path': game_log_path, 'enable_info': enable_info})
+                        'seed': seed, 'log_path': game_log_path, 'enable_info': enable_info,
+                        'detect_loops': detect_loops})
         num_players = env.num_players # use the number of players from the environment since input can be None
         env.set_agents([RandomAgent() for _ in range(num_players)])
         env.run()
-        logging.info(f"Testing passed {module_path}.")
+        logging.info(f"Testing passed {game_log_path}.")
+        return TestResult(True, seed, num_players, duration=time.perf_counter() - start)
+    except Exception as e:
+        logging.error(f"Error occurred during testing the environment {game_log_path}.")
+        return TestResult(False, seed, num_players, error=traceback.format_exc(),
+                          duration=time.perf_counter() - start)
+    finally:
+        close_game_log(game_log_path)
 
-        # Clear the error file content (can be done once at the start of your program)
-        with open(error_log_path, 'w'):
-            pass  # Just open and close the file to clear contents
 
-        result.append(True)
-    except Exception as e:
-        logging.error(f"Error occurred during testing the environment {module_path}.")
+def close_game_log(game_log_path: str):
+    """Remove the handlers of the game log added by EnvLogger, the sandbox worker is reused."""
+    logger = logging.getLogger(game_log_path.split('/')[-1].split('.')[0])
+    for handler in logger.handlers[:]:
+        handler.close()
+        logger.removeHandler(handler)
+
 
-        # Get the formatted exception traceback
-        exception_trace = traceback.format_exc()
+TIMEOUT_MESSAGE = "Execution timed out. Probably an infinite loop, infinite reshuffling the deck, or lack of game ending condition. Please infer from the last few turns of game play (if successfully generated) below:\n```\n{log_tail}\n```"
 
-        # Write the traceback to the error log file safely
-        with open(error_log_path, 'w') as error_file:
-            error_file.write(exception_trace)
 
-        result.append(False)
+def run_test(game_code: str,
+             game_log_path: str,
+             seed: int = 42,
+             timeout: int = 10,
+             num_players: int = None,
+             enable_info: bool = True,
+             cancel: threading.Event = None,
+             detect_loops: bool = True
+             ) -> TestResult:
+    """
+    Play one random game of the game code in a sandbox worker, killed if it times out.
+    Raises SandboxCancelled if the `cancel` event is set before the game ends.
+    """
+    start = time.perf_counter()
+    try:
+        result = get_sandbox_pool().call(
+            test_env_worker,
+            dict(game_code=game_code, game_log_path=game_log_path, seed=seed,
+                 num_players=num_players, enable_info=enable_info, detect_loops=detect_loops),
+            timeout=timeout, cancel=cancel)
+    except (SandboxTimeout, SandboxCrashed) as e:
+        # killed by the timeout or by its CPU limit
+        logging.error(f"Execution timed out for {game_log_path}: {e}")
+        log_tail = read_log_tail(game_log_path)
+        return TestResult(False, seed, num_players, error=TIMEOUT_MESSAGE.format(log_tail=log_tail),
+                          log_tail=log_tail, timed_out=True, duration=time.perf_counter() - start)
+    except SandboxError as e:
+        result = TestResult(False, seed, num_players, error=str(e), duration=time.perf_counter() - start)
+    if not result.passed:
+        result.log_tail = read_log_tail(game_log_path)
+    return result
+
 
-def test_env(module_path: str, 
-             bug_log_path: str, 
-             game_log_path: str, 
+def test_env(game_code: str,
+             bug_log_path: str,
+             game_log_path: str,
              seed: int = 42,
              timeout: int = 10,
              num_players: int = None,
@@ -78,45 +142,14 @@ def test_env(module_path: str,
     """
     Test the environment with a random agent.
     Test will be considered failed if the environment throws an exception or times out.
+    The traceback or the timeout message is written to bug_log_path, which is cleared if the test passed.
     """
-    result = []
-    worker_thread = StoppableThread(
-        target=test_env_worker, 
-        args=(module_path, bug_log_path, game_log_path, seed, num_players, result, enable_info))
-    worker_thread.start()
-    worker_thread.join(timeout=timeout)
-
-    # remove all handlers in this logger
-    logger_name = game_log_path.split('/')[-1].split('.')[0]
-    logger = logging.getLogger(logger_name)
-    handlers = logger.handlers[:]
-    for handler in handlers:
-        handler.close()
-        logger.removeHandler(handler)
+    result = run_test(game_code, game_log_path, seed=seed, timeout=timeout,
+                      num_players=num_players, enable_info=enable_info)
+    with open(bug_log_path, 'w', encoding='utf-8') as error_file:
+        error_file.write(result.error)
+    return result.passed
 
-    # If the thread is still alive, it means it timed out
-    if worker_thread.is_alive():
-        # terminate the thread
-        worker_thread.stop()
-        logging.error(f"Execution timed out for {module_path}.")
-        # try read game log file
-        with open(game_log_path, 'r', encoding='utf-8') as game_log_file:
-            game_log = game_log_file.read()
-            game_log_items = game_log.split('\n')
-            character_limit = 6000
-            last_n_logs = []
-            # repeat adding the last element to the front until the total character length of the last_n_logs is more than 1000 or game log items are exhausted
-            while len(''.join(last_n_logs)) < character_limit and game_log_items:
-                last_n_logs.insert(0, game_log_items.pop())
-            with open(bug_log_path, 'w', encoding='utf-8') as error_file:
-                error_msg = f"Execution timed out. Probably an infinite loop, infinite reshuffling the deck, or lack of game ending condition. Please infer from the last few turns of game play (if successfully generated) below:\n```\n{'\n'.join(last_n_logs)}\n```"
-                error_file.write(error_msg)
-        return False
-    else:
-        # end the thread
-        worker_thread.join()
-        return result[0] if result else False
-    
 
 def test_with_repetition(
         temp_dir: str,
@@ -126,41 +159,116 @@ def test_with_repetition(
         num_players: int = None,
         timeout: int = 10,
         enable_info: bool = True,
+        num_workers: int = None,
+        game_code: str = None,
+        cache: TestResultCache = None,
+        detect_loops: bool = True,
+        shrink: bool = False,
         ) -> Tuple[bool, List[str], float, int]:
     """
     Test the game code with multiple repetitions.
+    The repetitions play concurrently with distinct seeds, and the others are cancelled
+    as soon as one fails. The seeds are drawn from the hash of the code, so the same code
+    plays the same games, and with a cache the games already played are not played again.
     Args:
         temp_dir (str): The directory where temporary files will be stored.
         game_name (str): The name of the game to be tested.
         temp_id (str): A temporary identifier for the test run.
         repetition (int, optional): The number of times to repeat the test. Defaults to 5.
         num_players (int, optional): The number of players in the game. Defaults to 2.
+        num_workers (int, optional): The sandbox workers of this process, when first started.
+        game_code (str, optional): The code to test, read from <temp_dir>/<game_name>_<temp_id>.py if None.
+        cache (TestResultCache, optional): The results of the games already played.
+        detect_loops (bool, optional): Fail a game as soon as it makes no progress, instead of at its timeout.
+        shrink (bool, optional): Write the shortest actions reproducing the error of the failed game
+            to its error log instead of the traceback, see shrink_failure. Timeouts are not shrunk.
     Returns:
         Tuple[bool, List[str], float, int]: A tuple containing:
             - A boolean indicating if the test was successful.
-            - A list of paths to the gameplay log files.
-            - A list of paths to the error log files.
+            - A list of paths to the gameplay log files, the failed one last.
+            - A list of paths to the error log files, the failed one last.
             - An integer representing the number of repetitions completed.
     """
-    temp_module_prefix = temp_dir.replace('/', '.').replace('\\', '.')
-    gameplay_log_files = []
-    error_log_files = []
+    if game_code is None:
+        code_path = os.path.join(temp_dir, f"{game_name}_{temp_id}.py" if temp_id != "" else f"{game_name}.py")
+        with open(code_path, 'r', encoding='utf-8') as f:
+            game_code = f.read()
+    # distinct seeds, from a wider range if there are more repetitions than the usual seeds
+    seeds = random.Random(code_hash(game_code)).sample(range(max(1001, repetition)), repetition)
+
+    def play_log_path(i):
+        return os.path.join(temp_dir, f"{game_name}_{temp_id}_{i}.log")
+
+    def error_log_path(i):
+        return os.path.join(temp_dir, f"{game_name}_{temp_id}_{i}_error.log")
+
+    def cache_key(i):
+        return TestResultCache.make_key(game_code, seeds[i], num_players, timeout=timeout, enable_info=enable_info,
+                                        detect_loops=detect_loops)
+
+    passed, failed, to_play = [], None, []
     for i in range(repetition):
-        play_log_path = os.path.join(temp_dir, f"{game_name}_{temp_id}_{i}.log")
-        error_log_path = os.path.join(temp_dir, f"{game_name}_{temp_id}_{i}_error.log")
-        gameplay_log_files.append(play_log_path)
-        error_log_files.append(error_log_path)
-        module_path = f"{temp_module_prefix}.{game_name}_{temp_id}" if temp_id != "" else f"{temp_module_prefix}.{game_name}"
-        is_success = test_env(
-            module_path, 
-            error_log_path,
-            play_log_path,
-            seed=random.randint(0, 1000),
-            num_players=num_players,
-            timeout=timeout,
-            enable_info=enable_info
-            )
-        if not is_success:
+        cached = cache.get(cache_key(i)) if cache is not None else None
+        if cached is None:
+            to_play.append(i)
+            continue
+        with open(play_log_path(i), 'w', encoding='utf-8') as game_log_file:
+            game_log_file.write(cached['game_log'])
+        with open(error_log_path(i), 'w', encoding='utf-8') as error_file:
+            error_file.write(cached.get('repro') or cached['error'])
+        if cached['passed']:
+            passed.append(i)
+        else:
+            # a known failure, nothing to play
+            failed, to_play = i, []
             break
-    return is_success, gameplay_log_files, error_log_files, len(gameplay_log_files) 
-    
+    if to_play:
+        get_sandbox_pool(num_workers)
+
+    def record(i, result):
+        with open(error_log_path(i), 'w', encoding='utf-8') as error_file:
+            error_file.write(result.repro or result.error)
+        # a timeout depends on the load of the machine, play it again next time
+        if cache is not None and not result.timed_out:
+            with open(play_log_path(i), 'r', encoding='utf-8') as game_log_file:
+                cache.put(cache_key(i), game_code, asdict(result), game_log_file.read())
+
+    cancel = threading.Event()
+    to_shrink = None
+    with ThreadPoolExecutor(max_workers=max(1, len(to_play))) as executor:
+        futures = {
+            executor.submit(run_test, game_code, play_log_path(i), seed=seeds[i], num_players=num_players,
+                            timeout=timeout, enable_info=enable_info, cancel=cancel,
+                            detect_loops=detect_loops): i
+            for i in to_play}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except SandboxCancelled:
+                continue
+            if not result.passed and failed is None:
+                # stop the other games first, the failure is shrunk once their workers are free
+                failed = i
+                cancel.set()
+                if shrink and not result.timed_out:
+                    to_shrink = result
+                    continue
+            record(i, result)
+            if result.passed:
+                passed.append(i)
+
+    if to_shrink is not None:
+        to_shrink.repro = shrink_failure(game_code, seeds[failed], num_players, enable_info=enable_info,
+                                         detect_loops=detect_loops, timeout=timeout)
+        record(failed, to_shrink)
+
+    completed = sorted(passed) + ([failed] if failed is not None else [])
+    # remove the logs of the cancelled games, the caller only knows the completed ones
+    for i in set(range(repetition)) - set(completed):
+        for path in (play_log_path(i), error_log_path(i)):
+            if os.path.exists(path):
+                os.remove(path)
+    gameplay_log_files = [play_log_path(i) for i in completed]
+    error_log_files = [error_log_path(i) for i in completed]
+    return failed is None, gameplay_log_files, error_log_files, len(gameplay_log_files)
@@ -5,13 +5,21 @@ import threading
 import json
 
 from GameCode.utils.code_drafting import code_drafting
-from GameCode.debug.test_env import test_with_repetition
+from GameCode.debug.test_env import test_with_repetition, read_log_tail
+from GameCode.debug.error_index import ErrorIndex, error_signature, escalate_error
+from GameCode.debug.fuzz import fuzz_test
+from GameCode.debug.preflight import preflight_check
+from GameCode.debug.result_cache import TestResultCache
 from GameCode.validation.validate_env import validate_code
 from GameCode.debug.debug_code import debug_code
 from GameCode.utils.structure_description import structurize_description
+from GameCode.utils.checkpoint import PipelineCheckpoint
 from GameCode.retrieval.retrieve import retrieve
 from GameCode.utils.formatting import unwrap_code, replace_print_with_pass
+from GameEngine.utils.code import code_hash
 from Utils.LLMHandler import LLMHandler
+from Utils.LLMCache import cache_namespace
+from Utils.LLMUsage import usage_context
 from GameCode.retrieval.retrieve_snippets import CodeSnippetRetriever
 
 logger = logging.getLogger(__name__)
@@ -30,22 +38,54 @@ def create_with_repetition(kwargs) -> Tuple[bool, str, Dict]:
     if llm_model is None:
         logger.error("LLM model is not provided, use the default model gpt-4o-2024-08-06")
         llm_model = "gpt-4o-2024-08-06"
-    kwargs["llm_handler"] = LLMHandler(llm_model=llm_model)
+    kwargs["llm_handler"] = LLMHandler(llm_model=llm_model, routes=configs.get("llm_routes", None))
+
+    # optional response cache, e.g. to resume or re-run a batch without asking the LLM again
+    cache_configs = configs.get("llm_cache", None)
+    if cache_configs:
+        kwargs["llm_handler"].enable_cache(**cache_configs)
+
+    # optional record/replay of the LLM requests, e.g. to benchmark the pipeline offline
+    cassette_configs = configs.get("llm_cassette", None)
+    if cassette_configs:
+        kwargs["llm_handler"].use_cassette(**cassette_configs)
 
     # set up the code retriever
     code_retriever = CodeSnippetRetriever(\
         configs['retrieval']['library_path'])
     code_retriever.build_index()
     kwargs["code_retriever"] = code_retriever
+
+    # results of the games already played by the trials, kept across runs if a path is configured
+    kwargs["test_cache"] = TestResultCache(
+        configs['test_and_validate']['test'].get('cache_path', None) or ':memory:')
+    # the errors sent to debugging by the trials, a repeated one is debugged with more context
+    kwargs["error_index"] = ErrorIndex(configs['test_and_validate']['test'].get('max_error_repeats', 3))
     
+    # the outputs of the stages of the trials, a restarted game resumes after its last completed stage
+    checkpoint_path = None
+    if configs.get("checkpoint", True):
+        checkpoint_path = os.path.join(kwargs["temp_dir"], f"{kwargs['game_name']}_checkpoint.json")
+    resume_attempts = configs.get("resume_attempts", 1)
+
     # create the game code with repetition
+    is_success = False
     for i in range(repetition):
-        try:
-            is_success, latest_code, latest_performance = create_pipeline(**kwargs)
-            if is_success:
+        kwargs["checkpoint"] = PipelineCheckpoint(checkpoint_path, trial=i)
+        for attempt in range(1 + resume_attempts):
+            try:
+                # each trial samples its own answers, the trials are cached apart
+                with cache_namespace(f"trial-{i}"), usage_context(game=kwargs.get("game_name")):
+                    is_success, latest_code, latest_performance = create_pipeline(**kwargs)
                 break
-        except Exception as e:
-            logger.error(f"Error in creating game code in {i+1}th trial: {e}")
+            except Exception as e:
+                logger.error(f"Error in creating game code in {i+1}th trial: {e}")
+                # e.g. the LLM service failed, the trial resumes after its last completed stage
+                if attempt < resume_attempts:
+                    logger.info(f"Resuming the {i+1}th trial after the stages "
+                                f"{kwargs['checkpoint'].completed_stages()}")
+        if is_success:
+            break
     return is_success, latest_code, latest_performance
 
 
@@ -57,6 +97,9 @@ def create_pipeline(
         temp_dir: str, 
         configs: Dict,
         code_retriever: CodeSnippetRetriever,
+        test_cache: TestResultCache = None,
+        error_index: ErrorIndex = None,
+        checkpoint: PipelineCheckpoint = None,
         structurize_game_desc: bool = True,
         skip_debug: bool = False,
         skip_validation: bool = False,
@@ -65,10 +108,20 @@ def create_pipeline(
     """
     Create a pipeline to generate and test game code
     Notice: the file path shall use single slash or double backslashes
+    The output of each stage is saved to the checkpoint, the completed stages are skipped.
     """
     # set up logging
     logger.info(f"Creating game code for {game_name} in thread {threading.current_thread().name}")
     llm_handler.set_log_path(os.path.join(temp_dir, f"{game_name}_llm_chat.log"))
+    if checkpoint is None:
+        checkpoint = PipelineCheckpoint()
+    done = checkpoint.get("done")
+    if done is not None:
+        logger.info(f"The trial of {game_name} was completed, its result is read from the checkpoint")
+        return done["is_success"], done["game_code"], done["performance"]
+    resumed_stages = checkpoint.completed_stages()
+    if resumed_stages:
+        logger.info(f"Resuming {game_name} after the stages {resumed_stages}")
 
     # read the game description from file if it's a valid path
     if os.path.exists(game_description_or_file_path):
@@ -82,20 +135,30 @@ def create_pipeline(
         game_description = game_description_or_file_path
     
     # Step 1: structurize the game description
-    if structurize_game_desc:
-        struct_game_desc = structurize_description(game_description, llm_handler)
-    else:
-        struct_game_desc = game_description
+    struct_game_desc = checkpoint.get("structurize")
+    if struct_game_desc is None:
+        if structurize_game_desc:
+            with usage_context(stage="structurize"):
+                struct_game_desc = structurize_description(game_description, llm_handler)
+        else:
+            struct_game_desc = game_description
+        checkpoint.save("structurize", struct_game_desc)
     with open(os.path.join(temp_dir, f"{game_name}.md"), 'w', encoding="utf-8") as f:
         f.write(struct_game_desc)
 
     # Step 2: retrieve examples
-    example_str, example_codes = retrieve(
-        llm_handler, struct_game_desc, 
-        configs['retrieval']['library_path'],
-        configs['retrieval']['init_retrieval_num'],
-        configs['retrieval']['final_example_num'],
-    )
+    examples = checkpoint.get("retrieve")
+    if examples is None:
+        with usage_context(stage="retrieve"):
+            example_str, example_codes = retrieve(
+                llm_handler, struct_game_desc, 
+                configs['retrieval']['library_path'],
+                configs['retrieval']['init_retrieval_num'],
+                configs['retrieval']['final_example_num'],
+            )
+        checkpoint.save("retrieve", {"example_str": example_str, "example_codes": example_codes})
+    else:
+        example_str, example_codes = examples["example_str"], examples["example_codes"]
         
     # Step 3: draft the initial code
     # read game engine code
@@ -105,34 +168,36 @@ def create_pipeline(
     game_engine_code = unwrap_code(base_game_code, 'game engine')
     code_template = unwrap_code(base_game_code, 'code template')
     # draft the initial code
-    game_code = code_drafting(
-        llm_handler, struct_game_desc, example_str, game_engine_code, 
-        code_template, 
-        llm_model_for_init_draft=configs.get('init_llm_model', None),
-        refine_num=configs.get('self_refinement_repetition', None)
-    )
-    # save the initial code to a temporary file
-    temp_id = save_new_temp_code(game_code, temp_dir, game_name)
+    game_code = checkpoint.get("draft")
+    if game_code is None:
+        with usage_context(stage="draft"):
+            game_code = code_drafting(
+                llm_handler, struct_game_desc, example_str, game_engine_code, 
+                code_template, 
+                llm_model_for_init_draft=configs.get('init_llm_model', None),
+                refine_num=configs.get('self_refinement_repetition', None)
+            )
+        checkpoint.save("draft", game_code)
+    temp_id = new_temp_id(game_code)
 
     # Apply iterative debugging and validation
     if not skip_debug or not skip_validation:
-        is_success, game_code, edit_count, temp_ids, quality_score = iterative_debugging_and_validation(
+        is_success, game_code, edit_count, temp_ids, quality_score, fuzz_reports = iterative_debugging_and_validation(
             game_code, struct_game_desc, example_codes, game_engine_code, llm_handler, temp_dir, game_name, temp_id, 
-            configs['test_and_validate'], code_retriever=code_retriever)
+            configs['test_and_validate'], code_retriever=code_retriever, test_cache=test_cache,
+            error_index=error_index, checkpoint=checkpoint)
     else:
         is_success = True
         edit_count = 0
         quality_score = -1
         temp_ids = [temp_id]
+        fuzz_reports = []
         logger.info(f"Skipping debugging and validation for {game_name}")
         
     # Save the final game code
     with open(game_code_path, 'w', encoding="utf-8") as f:
         f.write(game_code)
 
-    # Clean up temporary files
-    clean_up_temp_files(temp_dir, game_name, temp_ids)
-
     if not is_success:
         logger.info(f"Failed to generate a working game code for {game_name} after {edit_count} edits")
     else:
@@ -142,17 +207,40 @@ def create_pipeline(
         "game_name": game_name,
         "edit_count": edit_count,
         "max_score_so_far": quality_score,
+        "resumed_stages": len(resumed_stages),
     }
     performance_dict.update(llm_handler.get_usage())
+    if test_cache is not None:
+        performance_dict.update(test_cache.get_stats())
+    if error_index is not None:
+        performance_dict.update(error_index.get_stats())
+    if fuzz_reports:
+        # the coverage of the last version of the code
+        performance_dict.update({
+            "line_coverage": fuzz_reports[-1]["line_coverage"],
+            "branch_coverage": fuzz_reports[-1]["branch_coverage"],
+            "fuzz_games": sum(report["fuzz_games"] for report in fuzz_reports),
+            "fuzz_crashes": sum(report["fuzz_crash"] for report in fuzz_reports),
+        })
+    # per-call records for cost and latency analysis
+    llm_handler.export_usage(os.path.join(temp_dir, f"{game_name}_llm_usage.jsonl"), game=game_name)
+    logger.info(f"LLM latency and re-asks per call site for {game_name}: "
+                f"{json.dumps(llm_handler.get_route_stats(game=game_name))}")
+    checkpoint.save("done", {"is_success": is_success, "game_code": game_code, "performance": performance_dict})
     return is_success, game_code, performance_dict          
 
 
 def iterative_debugging_and_validation(
         game_code: str, game_desc: str, example_codes: List[str], engine_code: str,
-        llm_handler, temp_dir: str, game_name: str, temp_id: str, configs: Dict, code_retriever=None
-        ) -> Tuple[bool, str, int, str, str, List[str]]:
+        llm_handler, temp_dir: str, game_name: str, temp_id: str, configs: Dict, code_retriever=None,
+        test_cache: TestResultCache = None, error_index: ErrorIndex = None,
+        checkpoint: PipelineCheckpoint = None
+        ) -> Tuple[bool, str, int, List[str], int, List[Dict]]:
     """
     Function to iteratively debug and validate the generated game code.
+    Each version of the code, the draft and every edit, is checked statically before it is tested.
+    An error its edits already failed to fix max_error_repeats times stops the debugging, see ErrorIndex.
+    The state of the loop is saved to the checkpoint after each iteration, and resumed from it.
     """
     edit_count = 0
     is_success = False
@@ -161,6 +249,9 @@ def iterative_debugging_and_validation(
     validation_candidate_code_path = ''
     test_candidate_code_path = ''
     validation_analysis_history = []
+    fuzz_reports = []
+    run_id = temp_id  # the errors of this run, in the index shared by the trials
+    stopped = False
 
     # unpack the configs
     max_edits = configs['max_edits']
@@ -172,38 +263,97 @@ def iterative_debugging_and_validation(
     test_repetition = configs['test']['repetition']
     test_timeout = configs['test']['timeout']
     debug_example_num = configs['test'].get('debug_example_num', 2)
+    test_workers = configs['test'].get('workers', None)
+    fuzz_games = configs['test'].get('fuzz_games', 0)
+    fuzz_time_limit = configs['test'].get('fuzz_time_limit', None)
+    shrink = configs['test'].get('shrink', True)
+    if error_index is None:
+        error_index = ErrorIndex(configs['test'].get('max_error_repeats', 3))
+    if checkpoint is None:
+        checkpoint = PipelineCheckpoint()
+
+    # resume after the last completed iteration
+    state = checkpoint.get("debug")
+    if state is not None:
+        game_code, temp_id, temp_ids, run_id = state["game_code"], state["temp_id"], state["temp_ids"], state["run_id"]
+        edit_count, credits, is_success, stopped = state["edit_count"], state["credits"], state["is_success"], state["stopped"]
+        is_first_validation = state["is_first_validation"]
+        validation_candidate_code_path = state["validation_candidate_code_path"]
+        test_candidate_code_path = state["test_candidate_code_path"]
+        validation_analysis_history = state["validation_analysis_history"]
+        fuzz_reports = state["fuzz_reports"]
+        error_index.set_state(state["error_index"])
+        logger.info(f"Resuming the debugging of {game_name}-{temp_id} after {edit_count} edits, {credits} credits left")
 
     enable_info = configs.get('enable_info', True)
     enable_validation = configs.get('enable_validation', True)
     validate_repetition = min(configs['validate'].get('repetition', test_repetition), test_repetition)
     
-    while (not is_success) and (max_edits > edit_count) and (credits > 0):
-        # need to be successful in each test repetition
-        is_success, gameplay_log_files, error_log_files, suceess_num = test_with_repetition(
-            temp_dir, game_name, temp_id, repetition=test_repetition, timeout=test_timeout,
-            enable_info=enable_info)
+    while (not is_success) and (not stopped) and (max_edits > edit_count) and (credits > 0):
+        # syntax errors, undefined names and missing template functions need no game to be found
+        preflight_error = preflight_check(game_code)
+        if preflight_error:
+            is_success, suceess_num, gameplay_log_files = False, 0, []
+            error_log_files = [os.path.join(temp_dir, f"{game_name}_{temp_id}_preflight_error.log")]
+            with open(error_log_files[0], 'w', encoding="utf-8") as f:
+                f.write(preflight_error)
+            logger.info(f"Pre-flight check failed for {game_name}-{temp_id}: {error_signature(preflight_error)}")
+        # fuzz games first, the coverage steers them to the rare branches in fewer games
+        if fuzz_games and not preflight_error:
+            is_success, gameplay_log_files, error_log_files, fuzz_report = fuzz_test(
+                temp_dir, game_name, temp_id, game_code, games=fuzz_games, timeout=test_timeout,
+                time_limit=fuzz_time_limit, enable_info=enable_info)
+            fuzz_reports.append({"temp_id": temp_id, **fuzz_report})
+            suceess_num = 0
+            logger.info(f"Fuzzing {game_name}-{temp_id}: crash found {not is_success} in {fuzz_report['fuzz_games']} games, "
+                        f"line coverage {fuzz_report['line_coverage']:.1%}, branch coverage {fuzz_report['branch_coverage']:.1%}")
+        if not preflight_error and (not fuzz_games or is_success):
+            # need to be successful in each test repetition
+            is_success, gameplay_log_files, error_log_files, suceess_num = test_with_repetition(
+                temp_dir, game_name, temp_id, repetition=test_repetition, timeout=test_timeout,
+                enable_info=enable_info, num_workers=test_workers, game_code=game_code, cache=test_cache,
+                shrink=shrink)
         # apply the credits change during the test
         credits += suceess_num * execute_reward
+        checkpoint.record("tests", {"temp_id": temp_id, "passed": is_success, "success_num": suceess_num,
+                                    "preflight_failed": bool(preflight_error)})
 
         if not is_success:
             # read the error message and propose edits
             error_log_path = error_log_files[-1]
             with open(error_log_path, 'r', encoding="utf-8") as f:
                 error_msg = f.read()
-            game_code = debug_code(llm_handler, game_code, error_msg, game_desc, 
-                                     example_codes[:min(debug_example_num, len(example_codes))], engine_code)
-            game_code = replace_print_with_pass(game_code)
-            edit_count += 1
-            credits -= 1
-
-            # if the error_msg contains "infinite loop", deduct more credits
-            if "infinite loop" in error_msg:
-                credits += loop_penalty  # penalty is a negative number
-
-            # we need to save the new code to another file
-            # otherwise the test_env function will not be able to import the new code
-            temp_id = save_new_temp_code(game_code, temp_dir, game_name)
-            temp_ids.append(temp_id)
+            signature = error_signature(error_msg)
+            if error_index.should_stop(signature, run_id):
+                # the same failure again, more edits would spend credits on it in vain
+                error_index.stop(max_edits - edit_count, credits)
+                logger.info(f"Stopped debugging {game_name}-{temp_id}: the same error was sent "
+                            f"{error_index.max_repeats} times, error signature: {signature}")
+                stopped = True
+            else:
+                repeats = error_index.add(signature, run_id)
+                example_num = debug_example_num
+                if repeats:
+                    # a repeated error, more context and examples for the debugging
+                    error_msg = escalate_error(
+                        error_msg, repeats, read_log_tail(gameplay_log_files[-1]) if gameplay_log_files else "")
+                    example_num += repeats
+                with cache_namespace(f"edit-{edit_count}"), usage_context(stage="debug"):
+                    game_code = debug_code(llm_handler, game_code, error_msg, game_desc, 
+                                             example_codes[:min(example_num, len(example_codes))], engine_code)
+                game_code = replace_print_with_pass(game_code)
+                edit_count += 1
+                credits -= 1
+
+                # if the error_msg contains "infinite loop", deduct more credits
+                if "infinite loop" in error_msg:
+                    credits += loop_penalty  # penalty is a negative number
+
+                # the new code is tested in memory, its id names its logs
+                temp_id = new_temp_id(game_code)
+                temp_ids.append(temp_id)
+                checkpoint.record("edits", {"edit": edit_count, "stage": "debug", "error_signature": signature,
+                                            "temp_id": temp_id, "game_code": game_code, "credits": credits})
         else:
             if is_first_validation:
                 is_first_validation = False
@@ -230,17 +380,21 @@ def iterative_debugging_and_validation(
                 for valid_idx, play_log_path in enumerate(gameplay_log_files[: validate_repetition]):
                     with open(play_log_path, 'r', encoding="utf-8") as f:
                         game_play_log = f.read()
-                    is_success, game_code, analysis_dict = \
-                        validate_code(llm_handler, game_desc, game_code, game_play_log, 
-                                      config=configs['validate'], code_retriever=code_retriever)
+                    with cache_namespace(f"edit-{edit_count}"), usage_context(stage="validate"):
+                        is_success, game_code, analysis_dict = \
+                            validate_code(llm_handler, game_desc, game_code, game_play_log, 
+                                          config=configs['validate'], code_retriever=code_retriever)
                     validation_analysis_history.append(analysis_dict)
                     logger.info(f"Validation result for {game_name}-{temp_id}: {is_success}")
+                    checkpoint.record("validations", {"temp_id": temp_id, "log": valid_idx, "passed": is_success})
                     if not is_success:
                         game_code = replace_print_with_pass(game_code)
                         edit_count += 1
                         credits -= 1
-                        temp_id = save_new_temp_code(game_code, temp_dir, game_name)
+                        temp_id = new_temp_id(game_code)
                         temp_ids.append(temp_id)
+                        checkpoint.record("edits", {"edit": edit_count, "stage": "validate", "temp_id": temp_id,
+                                                    "game_code": game_code, "credits": credits})
                         break
                     else:
                         # award the credits if the validation is successful
@@ -259,10 +413,24 @@ def iterative_debugging_and_validation(
             if os.path.exists(error_log_file):
                 os.remove(error_log_file)
 
+        checkpoint.save("debug", {
+            "game_code": game_code, "temp_id": temp_id, "temp_ids": temp_ids, "run_id": run_id,
+            "edit_count": edit_count, "credits": credits, "is_success": is_success, "stopped": stopped,
+            "is_first_validation": is_first_validation,
+            "validation_candidate_code_path": validation_candidate_code_path,
+            "test_candidate_code_path": test_candidate_code_path,
+            "validation_analysis_history": validation_analysis_history,
+            "fuzz_reports": fuzz_reports,
+            "error_index": error_index.get_state(),
+        })
+
     game_code, quality_score = select_final_code(temp_dir, game_name, test_repetition, validation_candidate_code_path, test_candidate_code_path)
     save_analysis_history(temp_dir, game_name, validation_analysis_history)
+    if fuzz_reports:
+        with open(os.path.join(temp_dir, f"{game_name}_fuzz_reports.json"), 'w', encoding="utf-8") as f:
+            json.dump(fuzz_reports, f, indent=4)
 
-    return is_success, game_code, edit_count, temp_ids, quality_score
+    return is_success, game_code, edit_count, temp_ids, quality_score, fuzz_reports
 
 def select_final_code(temp_dir: str, game_name: str, test_repetition: int, 
                       validation_candidate_code_path: str, test_candidate_code_path: str
@@ -283,26 +451,12 @@ def select_final_code(temp_dir: str, game_name: str, test_repetition: int,
     return "", -1
 
 
-def clean_up_temp_files(temp_dir: str, game_name: str, temp_ids: List[str]) -> None:
+def new_temp_id(game_code: str) -> str:
     """
-    Clean up temporary files created during the pipeline.
+    Id of a version of the game code, the hash of the code.
+    The code is tested in memory (see load_code_module), only the kept versions are written to disk.
     """
-    for temp_id in temp_ids:
-        temp_file_path = os.path.join(temp_dir, f"{game_name}_{temp_id}.py")
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-
-def save_new_temp_code(game_code: str, temp_dir: str, game_name: str
-                        ) -> str:
-    """
-    Save the game code to a new temporary file
-    """
-    import uuid
-    temp_id = uuid.uuid4().hex
-    temp_code_path = os.path.join(temp_dir, f"{game_name}_{temp_id}.py")
-    with open(temp_code_path, 'w', encoding="utf-8") as f:
-        f.write(game_code)
-    return temp_id
+    return code_hash(game_code)[:16]
 
 def save_analysis_history(temp_dir: str, game_name: str, analysis_history: List[Dict]) -> None:
     """
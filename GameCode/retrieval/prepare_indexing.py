@@ -5,7 +5,7 @@ from tqdm import tqdm
 
 from GameCode.utils.formatting import unwrap_code, extract_from_python
 from GameCode.utils.structure_description import structurize_description
-from Utils.LLMHandler import LLMHandler
+from Utils.LLMHandler import LLMHandler, StopAfterBlock
 import argparse
 
 MERGE_PROMPT = """
@@ -37,13 +37,21 @@ Responed with the complete code with comments, wrapped by triple quotes. For exa
 """
 
 
-def comment(code: str, desc: str) -> str:
+_comment_llm_handler: LLMHandler = None
+
+
+def comment(code: str, desc: str, llm_handler: LLMHandler = None) -> str:
     """
     This function takes a code snippet and a description and returns a commented version of the code.
     """
-    llm_handler = LLMHandler(llm_model='gpt-4o-mini')
+    global _comment_llm_handler
+    if llm_handler is None:
+        # one handler for all functions, instead of a new one per call
+        if _comment_llm_handler is None:
+            _comment_llm_handler = LLMHandler(llm_model='gpt-4o-mini')
+        llm_handler = _comment_llm_handler
     prompt = MERGE_PROMPT.replace('{game_description}', desc).replace('{game_code}', code)
-    response = llm_handler.chat(prompt)
+    response = llm_handler.chat(prompt, caller='index_comment', stop_when=StopAfterBlock('python'))
     commented_code = extract_from_python(response)
     return commented_code
 
@@ -0,0 +1,88 @@
+"""
+Checkpoints of the pipeline, to resume a game after a timeout or a crash.
+
+The output of every stage of a trial (the structured description, the retrieved examples,
+the draft, the state of the debugging loop after each iteration and the result) is saved
+to a json file, with the history of its tests, edits and validations. A trial restarted
+with the same checkpoint skips its completed stages and resumes the debugging loop after
+its last completed iteration, without asking the LLM again.
+
+Usage:
+    checkpoint = PipelineCheckpoint(os.path.join(temp_dir, f"{game_name}_checkpoint.json"), trial=0)
+    struct_game_desc = checkpoint.get("structurize")      # None if not completed
+    checkpoint.save("structurize", struct_game_desc)
+    checkpoint.record("tests", {"temp_id": temp_id, "passed": False})
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import logging
+from typing import Any, Dict, List
+
+
+class PipelineCheckpoint:
+    """
+    Args:
+        path: the json file of the game, shared by its trials, in memory only if None
+        trial: the trial of the pipeline, its stages are kept apart from the other trials
+    """
+
+    def __init__(self, path: str = None, trial: int = 0):
+        self.path = path
+        self.trial = str(trial)
+        self._data = self._load()
+
+    def _load(self) -> Dict:
+        if self.path is None or not os.path.exists(self.path):
+            return {"trials": {}}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to read the checkpoint {self.path}, starting over: {e}")
+            return {"trials": {}}
+
+    def _write(self):
+        if self.path is None:
+            return
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        # write a copy then replace, a process killed while writing leaves the last checkpoint
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def _trial_data(self) -> Dict:
+        return self._data["trials"].setdefault(self.trial, {"stages": {}, "history": {}})
+
+    def for_trial(self, trial: int) -> PipelineCheckpoint:
+        """The checkpoint of another trial of the same game."""
+        return PipelineCheckpoint(self.path, trial)
+
+    def get(self, stage: str, default: Any = None) -> Any:
+        """The output of the stage, default if it was not completed."""
+        stage_data = self._trial_data()["stages"].get(stage)
+        return default if stage_data is None else stage_data["output"]
+
+    def save(self, stage: str, output: Any):
+        """Save the output of the completed stage, it must be json serializable."""
+        trial_data = self._trial_data()
+        # a copy, the output may be changed by the next stages, e.g. the list of the edits
+        trial_data["stages"][stage] = {"output": json.loads(json.dumps(output)), "time": time.time()}
+        # read again, the other trials of the game may have saved their stages since
+        self._data = self._load()
+        self._data["trials"][self.trial] = trial_data
+        self._write()
+
+    def record(self, kind: str, entry: Dict):
+        """Add an entry to the history of the trial, e.g. a test or an edit, saved with the next stage."""
+        self._trial_data()["history"].setdefault(kind, []).append({**entry, "time": time.time()})
+
+    def history(self, kind: str) -> List[Dict]:
+        return self._trial_data()["history"].get(kind, [])
+
+    def completed_stages(self) -> List[str]:
+        return list(self._trial_data()["stages"])
@@ -64,7 +64,7 @@ def code_drafting(
         .replace('{game_description}', game_description)
    
     # get the first draft
-    response = llm_handler.chat(prompt, model=llm_model_for_init_draft)
+    response = llm_handler.chat(prompt, model=llm_model_for_init_draft, caller='draft')
 
     # refine the code
     code = naive_refine(prompt, response, llm_handler, refine_num)
@@ -96,7 +96,7 @@ def naive_refine(prompt: str,
     sequence.append(Message('assistant', response))
     sequence.append(Message('user', REFINE_PROMPT_NAIVE))
     for _ in range(refine_num):
-        response = llm_handler.chat(sequence)
+        response = llm_handler.chat(sequence, caller='draft_refine')
         sequence.append(Message('assistant', response))
         sequence.append(Message('user', REFINE_PROMPT_NAIVE))
     return extract_from_python(response)
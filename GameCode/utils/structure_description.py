@@ -166,5 +166,5 @@ def structurize_description(game_description: str,
     """Create a structured description for the game"""
 
     response = llm_handler.chat(
-        STRUCTURE_TEMPLATE + "\n# Your input\n" + game_description)
+        STRUCTURE_TEMPLATE + "\n# Your input\n" + game_description, caller='structurize')
     return extract_from_language(response, 'markdown')
\ No newline at end of file
@@ -1,7 +1,6 @@
-from retrying import retry
 import logging
 from typing import Dict
-from Utils.LLMHandler import LLMHandler, ChatSequence, Message
+from Utils.LLMHandler import LLMHandler, ChatSequence, Message, LLMRequestError, reask
 from GameCode.debug.ApplyEdits import apply_edits
 from GameCode.debug.ProposeEdits import FORMAT_PYTHON
 from GameCode.utils.formatting import unwrap_code
@@ -92,7 +91,7 @@ Based on the analysis, you should correct the code to make the game play log ali
 # Code Edit Instruction
 """+ FORMAT_PYTHON
 
-@retry(stop_max_attempt_number=3)
+@reask(stop_max_attempt_number=3)
 def validate_code(
     llm_handler: LLMHandler, 
     game_desc: str, 
@@ -122,7 +121,7 @@ def validate_code(
     propose_prompt = VALIDATE_PROMPT.replace('{game_description}', game_desc)\
                                   .replace('{code}', core_code)\
                                   .replace('{game_play_log}', game_play_log)
-    raw_content = llm_handler.chat(propose_prompt)
+    raw_content = llm_handler.chat(propose_prompt, caller='validate')
 
     pass_identifier = """***Analysis Summary***\n```pass```"""
     # if the identifier is found, return the original code
@@ -143,7 +142,7 @@ def validate_code(
         additional_examples = ""
 
     # ask for code correction
-    for _ in range(3):
+    for attempt in range(3):
         try:
             sequence = ChatSequence()
             sequence.append(Message("user", propose_prompt))
@@ -151,7 +150,7 @@ def validate_code(
             correction_prompt = CORRECT_PROMPT.replace('{code}', code)\
                                             .replace('{additional_examples}', additional_examples)
             sequence.append(Message("user", correction_prompt))
-            raw_correction_content = llm_handler.chat(sequence, model=coding_llm_model)
+            raw_correction_content = llm_handler.chat(sequence, model=coding_llm_model, use_cache=attempt == 0, caller='validate_fix')
 
             # extract code blocks from the correction
             new_block_dict = extract_analysis_blocks(raw_correction_content)
@@ -163,6 +162,8 @@ def validate_code(
                 raise Exception("Failed to apply the edits")
             else:
                 return False, new_code, block_dict
+        except LLMRequestError:
+            raise
         except Exception as e:
             logging.info("Failed to apply the edits, retrying...")
     
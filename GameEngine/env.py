@@ -76,7 +76,7 @@ class DotDict(dict):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         for key, value in self.items():
-            self[key] = self._convert_value(value)
+            dict.__setitem__(self, key, self._convert_value(value))
 
     def _convert_value(self, value):
         if isinstance(value, dict) and 'is_card' in value.keys():
@@ -85,6 +85,8 @@ class DotDict(dict):
         elif isinstance(value, dict):
             return DotDict(value)
         elif isinstance(value, list):
+            if StateJournal.active is not None:
+                return TrackedList(self._convert_value(item) for item in value)
             return [self._convert_value(item) for item in value]
         return value
 
@@ -103,8 +105,295 @@ class DotDict(dict):
             raise AttributeError(f"'DotDict' object has no attribute '{key}'")
 
     def __setitem__(self, key, value):
+        if StateJournal.active is not None:
+            StateJournal.active.record_key(self, key)
         super().__setitem__(key, self._convert_value(value))
 
+    def __delitem__(self, key):
+        if StateJournal.active is not None and key in self:
+            StateJournal.active.record_key(self, key)
+        super().__delitem__(key)
+
+    def pop(self, key, *args):
+        if StateJournal.active is not None and key in self:
+            StateJournal.active.record_key(self, key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        if StateJournal.active is not None and key not in self:
+            StateJournal.active.record_key(self, key)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        super().clear()
+
+    def __deepcopy__(self, memo):
+        # copy the items directly, without converting them again or journaling
+        result = DotDict.__new__(DotDict)
+        memo[id(self)] = result
+        for key, value in self.items():
+            dict.__setitem__(result, deepcopy(key, memo), deepcopy(value, memo))
+        return result
+
+class TrackedList(list):
+    """
+    A list that records its mutations in the active StateJournal.
+    Without an active journal it behaves exactly like a list.
+    """
+
+    def __setitem__(self, index, value):
+        if StateJournal.active is not None:
+            if isinstance(index, int):
+                StateJournal.active.record_index(self, index)
+            else:
+                StateJournal.active.record_snapshot(self)
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        super().__delitem__(index)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        return super().__imul__(n)
+
+    def append(self, item):
+        if StateJournal.active is not None:
+            StateJournal.active.record_truncate(self, len(self))
+        super().append(item)
+
+    def extend(self, items):
+        if StateJournal.active is not None:
+            StateJournal.active.record_truncate(self, len(self))
+        super().extend(items)
+
+    def insert(self, index, item):
+        if StateJournal.active is not None:
+            length = len(self)
+            index = min(max(index + length if index < 0 else index, 0), length)
+            StateJournal.active.log.append((_list_delete, self, index, None))
+        super().insert(index, item)
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        if StateJournal.active is not None:
+            index = index + len(self) + 1 if index < 0 else index
+            StateJournal.active.log.append((list.insert, self, index, item))
+        return item
+
+    def remove(self, item):
+        index = self.index(item)
+        super().__delitem__(index)
+        if StateJournal.active is not None:
+            StateJournal.active.log.append((list.insert, self, index, item))
+
+    def clear(self):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        if StateJournal.active is not None:
+            StateJournal.active.record_snapshot(self)
+        super().reverse()
+
+    def __deepcopy__(self, memo):
+        result = TrackedList()
+        memo[id(self)] = result
+        list.extend(result, (deepcopy(item, memo) for item in self))
+        return result
+
+class TrackedSet(set):
+    """
+    A set that records its mutations in the active StateJournal.
+    Without an active journal it behaves exactly like a set.
+    """
+
+    def add(self, item):
+        if StateJournal.active is not None and item not in self:
+            StateJournal.active.log.append((_set_discard, self, item, None))
+        super().add(item)
+
+    def discard(self, item):
+        if StateJournal.active is not None and item in self:
+            StateJournal.active.log.append((_set_add, self, item, None))
+        super().discard(item)
+
+    def remove(self, item):
+        super().remove(item)
+        if StateJournal.active is not None:
+            StateJournal.active.log.append((_set_add, self, item, None))
+
+    def pop(self):
+        item = super().pop()
+        if StateJournal.active is not None:
+            StateJournal.active.log.append((_set_add, self, item, None))
+        return item
+
+    def _snapshot_then(method):
+        def wrapper(self, *args, **kwargs):
+            if StateJournal.active is not None:
+                StateJournal.active.record_snapshot(self)
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    clear = _snapshot_then(set.clear)
+    update = _snapshot_then(set.update)
+    difference_update = _snapshot_then(set.difference_update)
+    intersection_update = _snapshot_then(set.intersection_update)
+    symmetric_difference_update = _snapshot_then(set.symmetric_difference_update)
+    __ior__ = _snapshot_then(set.__ior__)
+    __iand__ = _snapshot_then(set.__iand__)
+    __isub__ = _snapshot_then(set.__isub__)
+    __ixor__ = _snapshot_then(set.__ixor__)
+    del _snapshot_then
+
+    def __deepcopy__(self, memo):
+        result = TrackedSet(deepcopy(item, memo) for item in self)
+        memo[id(self)] = result
+        return result
+
+_MISSING = object()
+
+def _restore_key(obj: dict, key, value):
+    if value is _MISSING:
+        dict.pop(obj, key, None)
+    else:
+        dict.__setitem__(obj, key, value)
+
+def _restore_snapshot(obj, snapshot, _=None):
+    if isinstance(obj, dict):
+        dict.clear(obj)
+        dict.update(obj, snapshot)
+    elif isinstance(obj, list):
+        list.__setitem__(obj, slice(None), snapshot)
+    else:
+        set.clear(obj)
+        set.update(obj, snapshot)
+
+def _truncate(obj: list, length: int, _=None):
+    list.__delitem__(obj, slice(length, None))
+
+def _list_delete(obj: list, index: int, _=None):
+    list.__delitem__(obj, index)
+
+def _set_add(obj: set, item, _=None):
+    set.add(obj, item)
+
+def _set_discard(obj: set, item, _=None):
+    set.discard(obj, item)
+
+class StateJournal:
+    """
+    Undo log of the mutations of a game state, for trying actions without copying the state.
+    `track` converts the lists and sets of the state into TrackedList and TrackedSet.
+    While the journal is active, every mutation of DotDict, TrackedList and TrackedSet objects
+    is recorded, and `rollback` undoes them back to a checkpoint in time proportional to the
+    number of changes. Mutations of card objects and of containers that are created during
+    the journaled steps and kept by identity (e.g. sets) are not recorded.
+
+    Usage:
+        with StateJournal(game_state) as journal:
+            checkpoint = journal.checkpoint()
+            game_state = proceed_round(action, game_state, logger)
+            journal.rollback(checkpoint)
+    """
+    active: 'StateJournal' = None
+
+    def __init__(self, game_state: Dict = None):
+        self.log: list[tuple] = []
+        self.previous: StateJournal = None
+        if game_state is not None:
+            self.track(game_state)
+
+    @staticmethod
+    def track(obj: Any) -> Any:
+        """ Convert the containers of a game state in place so that they can be journaled"""
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                if type(v) is list or type(v) is set or (isinstance(v, dict) and not isinstance(v, DotDict)):
+                    v = StateJournal.track(TrackedList(v) if type(v) is list else
+                                           TrackedSet(v) if type(v) is set else DotDict(v))
+                    dict.__setitem__(obj, k, v)
+                else:
+                    StateJournal.track(v)
+        elif isinstance(obj, list):
+            for i, v in enumerate(obj):
+                if type(v) is list or type(v) is set or (isinstance(v, dict) and not isinstance(v, DotDict)):
+                    v = StateJournal.track(TrackedList(v) if type(v) is list else
+                                           TrackedSet(v) if type(v) is set else DotDict(v))
+                    list.__setitem__(obj, i, v)
+                else:
+                    StateJournal.track(v)
+        return obj
+
+    def activate(self) -> 'StateJournal':
+        if StateJournal.active is not self:
+            self.previous = StateJournal.active
+            StateJournal.active = self
+        return self
+
+    def deactivate(self):
+        if StateJournal.active is self:
+            StateJournal.active = self.previous
+            self.previous = None
+
+    def __enter__(self) -> 'StateJournal':
+        return self.activate()
+
+    def __exit__(self, *exc):
+        self.deactivate()
+
+    def checkpoint(self) -> int:
+        return len(self.log)
+
+    def rollback(self, checkpoint: int = 0):
+        """ Undo the mutations recorded after the checkpoint"""
+        log = self.log
+        while len(log) > checkpoint:
+            undo, obj, a, b = log.pop()
+            undo(obj, a, b)
+
+    def commit(self):
+        """ Keep the current state and forget the recorded mutations"""
+        self.log.clear()
+
+    def record_key(self, obj: dict, key):
+        self.log.append((_restore_key, obj, key, dict.get(obj, key, _MISSING)))
+
+    def record_index(self, obj: list, index: int):
+        self.log.append((list.__setitem__, obj, index, list.__getitem__(obj, index)))
+
+    def record_truncate(self, obj: list, length: int):
+        self.log.append((_truncate, obj, length, None))
+
+    def record_snapshot(self, obj):
+        self.log.append((_restore_snapshot, obj, obj.copy() if not isinstance(obj, dict) else dict(obj), None))
+
 def cards2list(cards: list[LLMCard]) -> list[str]:
     """ Get the corresponding string representation of cards"""
     cards_list = []
@@ -165,6 +454,185 @@ def get_observation(game_state: Dict) -> DotDict:
     
     return DotDict(observation)
 
+def clone_state(obj: Any) -> Any:
+    """
+    Copy the containers (DotDict, dict, list, set, tuple) of a game state.
+    Cards and other leaf values are shared with the original, so this is much
+    cheaper than deepcopy. It is meant for search and simulation, where cards
+    are never mutated in place.
+    """
+    if isinstance(obj, DotDict):
+        clone = DotDict.__new__(DotDict)
+        dict.update(clone, {k: clone_state(v) for k, v in obj.items()})
+        return clone
+    if isinstance(obj, list):
+        return [clone_state(item) for item in obj]
+    if isinstance(obj, dict):
+        return {k: clone_state(v) for k, v in obj.items()}
+    if isinstance(obj, set):
+        return set(obj)
+    if isinstance(obj, tuple):
+        return tuple(clone_state(item) for item in obj)
+    return obj
+
+def import_cards(obj: Any, known_cards: Dict[str, LLMCard] = None) -> Any:
+    """
+    Copy the containers of a game state or an observation like `clone_state`, with its cards
+    rebuilt as LLMCard of this module: the cards of another game module (e.g. the observation
+    of another environment of the game) and the serialized cards (dicts with 'is_card').
+    A card with the same string in known_cards is used instead, it keeps the None fields
+    that get_observation drops. Dict keys keep their types, unlike a json round trip.
+    """
+    if isinstance(obj, LLMCard):
+        return obj
+    if "LLMCard" in str(type(obj)) or (isinstance(obj, dict) and 'is_card' in obj):
+        field = obj.field if hasattr(obj, 'field') else {k: v for k, v in obj.items() if k != 'is_card'}
+        card = LLMCard(dict(field))
+        if known_cards is not None:
+            return known_cards.get(card.get_str(), card)
+        return card
+    if isinstance(obj, DotDict):
+        clone = DotDict.__new__(DotDict)
+        dict.update(clone, {k: import_cards(v, known_cards) for k, v in obj.items()})
+        return clone
+    if isinstance(obj, list):
+        return [import_cards(item, known_cards) for item in obj]
+    if isinstance(obj, dict):
+        return {k: import_cards(v, known_cards) for k, v in obj.items()}
+    if isinstance(obj, set):
+        return {import_cards(item, known_cards) for item in obj}
+    if isinstance(obj, tuple):
+        return tuple(import_cards(item, known_cards) for item in obj)
+    return obj
+
+def collect_cards(obj: Any, cards: list = None) -> list[LLMCard]:
+    """ Collect all LLMCard objects in a (nested) game state or observation"""
+    if cards is None:
+        cards = []
+    if isinstance(obj, LLMCard):
+        cards.append(obj)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            collect_cards(v, cards)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            collect_cards(item, cards)
+    return cards
+
+def _restore_container_types(value: Any, template: Any) -> Any:
+    """
+    get_observation converts sets to lists. Convert them back wherever the
+    fresh game state (template) holds a set at the same position.
+    """
+    if isinstance(template, set) and isinstance(value, list):
+        return set(value)
+    if isinstance(value, dict) and isinstance(template, dict):
+        for k, v in value.items():
+            if k in template:
+                dict.__setitem__(value, k, _restore_container_types(v, template[k]))
+    elif isinstance(value, list) and isinstance(template, list) and len(value) == len(template):
+        for i, (v, t) in enumerate(zip(value, template)):
+            if isinstance(v, dict):
+                value[i] = _restore_container_types(v, t)
+    return value
+
+def determinize(observation: Dict, template_state: Dict, rng: random.Random = None) -> DotDict:
+    """
+    Sample a full game state that is consistent with the observation of the acting player.
+    Hidden card piles appear as `<name>_size` fields in the observation. They are refilled
+    with cards drawn from the unseen cards, which are the cards of a fresh game
+    (template_state) minus every card visible in the observation. Cards are matched by
+    their string representation, so duplicated cards are handled as a multiset.
+    Private fields of the other players are reset to their initial values in template_state,
+    with their cards redrawn from the unseen cards.
+    """
+    if rng is None:
+        rng = random
+    known_cards = {card.get_str(): card for card in collect_cards(template_state)}
+    state = import_cards(observation, known_cards)
+    if not isinstance(state, DotDict):
+        state = DotDict(state)
+    for key in ['legal_actions', 'recent_history', 'info', 'legal-actions']:
+        if key in state:
+            dict.__delitem__(state, key)
+    observer = state['common']['current_player']
+    hidden_players = []
+
+    # unseen cards = all cards of the game - visible cards
+    unseen: Dict[str, list] = {}
+    for card in collect_cards(template_state):
+        unseen.setdefault(card.get_str(), []).append(card)
+    for card in collect_cards(state):
+        same_cards = unseen.get(card.get_str())
+        if same_cards:
+            same_cards.pop()
+    pool = [card for cards in unseen.values() for card in cards]
+    rng.shuffle(pool)
+    universe = collect_cards(template_state)
+
+    def draw(n: int) -> list[LLMCard]:
+        drawn = [pool.pop() for _ in range(min(n, len(pool)))]
+        # the observation is inconsistent with the fresh game (e.g. cards created during play)
+        while len(drawn) < n and universe:
+            drawn.append(rng.choice(universe))
+        return drawn
+
+    def refill(facedown: Dict, template_facedown: Dict, all_sized: bool) -> Dict:
+        result = DotDict.__new__(DotDict)
+        for k, v in facedown.items():
+            name = k[:-len('_size')] if k.endswith('_size') else None
+            is_hidden_pile = name is not None and isinstance(v, int) and \
+                (all_sized or isinstance(template_facedown.get(name, []), list)) and name not in facedown
+            if is_hidden_pile:
+                dict.__setitem__(result, name, draw(v))
+            else:
+                dict.__setitem__(result, k, v)
+        return result
+
+    template_common = template_state['common']
+    if 'facedown_cards' in state['common']:
+        dict.__setitem__(state['common'], 'facedown_cards', refill(
+            state['common']['facedown_cards'], template_common.get('facedown_cards', {}), all_sized=False))
+    for i, player in enumerate(state.get('players', [])):
+        template_player = template_state['players'][i]
+        if i == observer:
+            if 'current_player' in player.get('public', {}) and 'current_player' not in template_player.get('public', {}):
+                dict.__delitem__(player['public'], 'current_player')
+            continue
+        if 'facedown_cards' in player and not state['common']['is_over']:
+            dict.__setitem__(player, 'facedown_cards', refill(
+                player['facedown_cards'], template_player.get('facedown_cards', {}), all_sized=True))
+        if 'private' not in player and 'private' in template_player:
+            dict.__setitem__(player, 'private', clone_state(template_player['private']))
+            hidden_players.append(i)
+
+    # private card lists of the other players take the size of the observer's own list
+    # (e.g. hands in trick-taking games), balanced so that the unseen cards are used up:
+    # players right after the observer get extra cards, those right before it lose cards
+    slots = []
+    observer_private = state['players'][observer].get('private', {}) if 'players' in state else {}
+    for i in hidden_players:
+        for k, v in state['players'][i]['private'].items():
+            if isinstance(v, list) and v and all(isinstance(item, LLMCard) for item in v):
+                own = observer_private.get(k)
+                slots.append([i, k, len(own) if isinstance(own, list) else len(v)])
+    if slots:
+        num_players = len(state['players'])
+        after = sorted(slots, key=lambda slot: (slot[0] - observer) % num_players)
+        surplus = len(pool) - sum(slot[2] for slot in slots)
+        while surplus > 0:
+            for slot in after[:surplus]:
+                slot[2] += 1
+            surplus = len(pool) - sum(slot[2] for slot in slots)
+        while surplus < 0 and any(slot[2] > 0 for slot in slots):
+            for slot in reversed(after):
+                if surplus < 0 and slot[2] > 0:
+                    slot[2] -= 1
+                    surplus += 1
+        for i, k, size in slots:
+            dict.__setitem__(state['players'][i]['private'], k, draw(size))
+    return _restore_container_types(state, template_state)
+
 def create_display_json(game_state: Dict, legal_actions) -> Dict:
     play_json = get_observation(game_state)
     play_json['info'] = {"game": game_name}
@@ -186,6 +654,8 @@ class LLMGame:
         self.logger = EnvLogger(config)
         self.agents: list[BaseAgent] = None
         self.show_action_hint = False
+        self.simulation_logger: EnvLogger = None
+        self.template_state: DotDict = None
         self.num_players = recommended_num_players if 'game_num_players' not in config or config['game_num_players'] is None else config['game_num_players']
         assert self.num_players is not None, "Please specify the number of players in the config"
         
@@ -308,6 +778,58 @@ class LLMGame:
         display_info["msg"] = self.logger.get_history(game_state['common']['current_player'], for_display=True)
 
         return game_state, observation, display_info
+
+    """
+    Simulation API for search agents. These methods do not touch the game logger
+    and can be called on copies of the game state as many times as needed.
+    """
+
+    def _get_simulation_logger(self) -> EnvLogger:
+        if self.simulation_logger is None or len(self.simulation_logger.log_items) > 1000:
+            self.simulation_logger = EnvLogger({'enable_info': False})
+        return self.simulation_logger
+
+    def clone_state(self, game_state: Dict) -> DotDict:
+        """ Cheap copy of a game state, see `clone_state`"""
+        return clone_state(game_state)
+
+    def _get_template_state(self) -> DotDict:
+        if self.template_state is None:
+            self.template_state = DotDict(initiation(self.num_players, self._get_simulation_logger()))
+        return self.template_state
+
+    def import_observation(self, observation: Dict) -> DotDict:
+        """ Copy of an observation with its cards rebuilt in this game module, see `import_cards`"""
+        known_cards = {card.get_str(): card for card in collect_cards(self._get_template_state())}
+        state = import_cards(observation, known_cards)
+        return state if isinstance(state, DotDict) else DotDict(state)
+
+    def determinize(self, observation: Dict, rng: random.Random = None) -> DotDict:
+        """ Sample a full game state consistent with the observation, see `determinize`"""
+        return determinize(observation, self._get_template_state(), rng)
+
+    def legal_actions(self, game_state: Dict) -> list[dict]:
+        return get_legal_actions(game_state)
+
+    def observe(self, game_state: Dict) -> DotDict:
+        """ Observation of the current player, including the legal actions"""
+        observation = get_observation(game_state)
+        observation['legal_actions'] = get_legal_actions(game_state)
+        return observation
+
+    def simulate(self, game_state: Dict, action: dict) -> DotDict:
+        """ Apply an action without logging. The game state may be modified in place."""
+        return proceed_round(action, game_state, self._get_simulation_logger())
+
+    def payoffs(self, game_state: Dict) -> List[Union[int, float]]:
+        return get_payoffs(game_state, self._get_simulation_logger())
+
+    def journal(self, game_state: Dict) -> StateJournal:
+        """
+        Track the game state and start recording its mutations, see StateJournal.
+        Call `deactivate` on the journal when the trial moves are done.
+        """
+        return StateJournal(game_state).activate()
 """End of the game engine"""
 """Beginning of the code template"""
 game_name = None # TODO: specify the game name
@@ -1,5 +1,9 @@
 import re
 import os
+import types
+import hashlib
+import linecache
+from collections import OrderedDict
 
 
 def extract_from_json(raw_content):
@@ -56,4 +60,43 @@ def try_read_file(file_path: str) -> str:
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
     except:
-        return file_path
\ No newline at end of file
+        return file_path
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def code_filename(code: str) -> str:
+    """The file name of the code in the tracebacks, see load_code_module."""
+    return f"<game_code {code_hash(code)[:12]}>"
+
+
+_code_modules: OrderedDict = OrderedDict()
+max_code_modules = 32  # compiled modules kept, least recently used first out
+
+
+def load_code_module(code: str) -> types.ModuleType:
+    """
+    Compile the code into a module object that is not registered in sys.modules,
+    cached by the hash of the code. Nothing is written to disk; the source is registered
+    in linecache, so tracebacks show the lines of the code.
+    """
+    key = code_hash(code)
+    filename = code_filename(code)
+    if filename not in linecache.cache:
+        linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+    module = _code_modules.get(key)
+    if module is not None:
+        _code_modules.move_to_end(key)
+        return module
+
+    module = types.ModuleType(f"game_code_{key[:12]}")
+    module.__file__ = filename
+    exec(compile(code, filename, 'exec'), module.__dict__)
+
+    _code_modules[key] = module
+    while len(_code_modules) > max_code_modules:
+        old_key, old_module = _code_modules.popitem(last=False)
+        linecache.cache.pop(old_module.__file__, None)
+    return module
@@ -1,17 +1,23 @@
+from collections import deque
 from copy import deepcopy
 import logging
-from typing import List, Union
+from typing import Deque, List, Union
 from GameEngine.utils.base_message import BaseMsg, InfoMsg, CreateAnimMsg, MoveAnimMsg, DecisionMsg, TurnEndMsg
+from GameEngine.utils.state_hash import StateHasher
 
 
 class EnvLogger:
     total_turn_limit = 1000
     last_n = 15
     max_log_length = 5000
+    # loop detection, see check_loop
+    loop_window = 48
+    loop_max_states = 6
 
     def __init__(self, config):
         self.state_trajectory: List[dict] = []
         self.log_items: List[Union[str, BaseMsg]] = []
+        self.log_offset = 0  # number of log items clipped from the front
         self.gameplay_logger = None
         self.console_logger = None
         self.enable_info = True
@@ -19,6 +25,15 @@ class EnvLogger:
         if 'enable_info' in config:
             self.enable_info = config['enable_info']
 
+        # raise as soon as the game loops, see check_loop
+        self.detect_loops = config.get('detect_loops', False)
+        self.loop_hasher = StateHasher(ignore_order=True)
+        # only the number of cards in each place and the other fields are progress
+        self.progress_hasher = StateHasher(ignore_order=True, ignore_cards=True)
+        self.turn_fingerprints: Deque[int] = deque(maxlen=self.loop_window)
+        self.turn_progress: Deque[int] = deque(maxlen=self.loop_window)
+        self.turn_log_starts: Deque[int] = deque(maxlen=self.loop_window)
+
         # gameplay logger for recording the games
         if 'log_path' in config:
             logger_name = config['log_path'].split('/')[-1].split('.')[0]
@@ -48,6 +63,10 @@ class EnvLogger:
     def reset(self):
         self.state_trajectory = []
         self.log_items = []
+        self.log_offset = 0
+        self.turn_fingerprints.clear()
+        self.turn_progress.clear()
+        self.turn_log_starts.clear()
 
     def info(self, msg, role=None):
         if not self.enable_info:
@@ -86,6 +105,8 @@ class EnvLogger:
         Append game state to the state trajectory.
         """
         self.state_trajectory.append(deepcopy(state))
+        if self.detect_loops:
+            self.check_loop(state)
         if len(self.state_trajectory) > self.total_turn_limit:
             front_index = max(0, len(self.state_trajectory) - self.last_n)
             last_n_logs = self.log_items[front_index:]
@@ -96,7 +117,51 @@ class EnvLogger:
                 last_n_logs.pop(0)
             last_logs = '\n'.join(last_n_logs)
             raise Exception('The game environment reaches the turn limit. Please check if there is infinite loop.\nLast few turns: \n{}'.format(last_logs))
-    
+
+    def check_loop(self, state):
+        """
+        Raise if the game makes no progress in the last loop_window turns, i.e. they either
+        - only go through a few distinct game states (regardless of the order of the cards), or
+        - repeat a cycle of turns where only the order and the place of the cards change, e.g.
+          the played cards are reshuffled into the deck again and again.
+        The message shows the turns of the cycle ending at this state.
+        """
+        self.turn_fingerprints.append(self.loop_hasher.fingerprint(state))
+        self.turn_progress.append(self.progress_hasher.fingerprint(state))
+        self.turn_log_starts.append(self.log_offset + len(self.log_items))
+        if len(self.turn_fingerprints) < self.loop_window:
+            return
+
+        fingerprints = list(self.turn_fingerprints)
+        progress = list(self.turn_progress)
+        last = len(fingerprints) - 1
+        # the shortest period of the progress, repeated 3 times at least
+        period = next((p for p in range(1, self.loop_window // 3 + 1)
+                       if all(progress[i] == progress[i + p] for i in range(last - p + 1))), None)
+        if period is not None:
+            previous = last - period
+            reason = f'repeat a cycle of {period} turns where only the order and the place of the cards change'
+        else:
+            num_states = len(set(fingerprints))
+            if num_states > self.loop_max_states:
+                return
+            # the previous turn in the same state, or the last few turns if the state is new
+            previous = next((i for i in range(last - 1, -1, -1) if fingerprints[i] == fingerprints[last]),
+                            last - self.last_n)
+            reason = f'only go through {num_states} distinct game states (regardless of the order of the cards)'
+
+        turn = len(self.state_trajectory)
+        first_turn = turn - (last - previous)
+        front_index = max(0, self.turn_log_starts[previous] - self.log_offset)
+        cycle_logs = [str(item) for item in self.log_items[front_index:]]
+        while len(''.join(cycle_logs)) > self.max_log_length:
+            cycle_logs.pop(0)
+        cycle_logs = '\n'.join(cycle_logs)
+        raise Exception(f'The game environment makes no progress: the last {self.loop_window} turns {reason}. '
+                        f'Please check if there is infinite loop, e.g. infinite reshuffling of the deck or actions never '
+                        f'changing the game state.\nThe cycle, turns {first_turn} to {turn - 1}, after which it starts again '
+                        f'from turn {turn}: \n{cycle_logs}')
+
     def get_history(self, player_id: int, for_display=False) -> List[dict]:
         """
         Get the history messages for a specific player.
@@ -113,6 +178,7 @@ class EnvLogger:
         msg_list.reverse()
 
         # clip the log items to the last 100 items
+        self.log_offset += max(0, len(self.log_items) - 100)
         self.log_items = self.log_items[-100:]
 
         # parse the messages
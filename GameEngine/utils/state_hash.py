@@ -0,0 +1,195 @@
+"""
+Stable fingerprints of game states and observations, and a bounded transposition table.
+
+A fingerprint is a 64-bit integer that only depends on the content of the state:
+- dict keys are order-insensitive, sets are unordered
+- lists are ordered (deck order and hand indices matter to the game code), except the
+  fields listed in `unordered_keys`, which are hashed as multisets
+- cards are identified by their fields (including the id when the game defines one),
+  never by object identity, so the fingerprint is the same across copies, processes and runs,
+  and for serialized cards (dicts with 'is_card')
+
+It works with the DotDict and LLMCard classes of any game module.
+"""
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, Dict, Iterable
+import struct
+
+# keys of observations that do not belong to the game state
+VOLATILE_KEYS = ('recent_history', 'info', 'legal_actions', 'legal-actions')
+
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _CARD, _LIST, _BAG, _DICT, _OTHER = \
+    (bytes([i]) for i in range(11))
+
+
+def _is_card(obj: Any) -> bool:
+    return type(obj).__name__ == 'LLMCard'
+
+
+def _card_str(card) -> str:
+    if isinstance(card, dict):
+        # serialized card, see LLMCard.__json__
+        return '-'.join(str(v) for k, v in card.items() if k != 'is_card' and v is not None)
+    card_str = getattr(card, 'str', None)
+    return card_str if isinstance(card_str, str) else card.get_str()
+
+
+def _digest(data: bytes) -> bytes:
+    return blake2b(data, digest_size=8).digest()
+
+
+class StateHasher:
+    """
+    Compute fingerprints of nested game states.
+
+    Args:
+        unordered_keys: names of list fields hashed as multisets, e.g. ('hand',)
+        ignore_keys: names of fields left out of the fingerprint at any depth
+        ignore_order: hash all lists as multisets, e.g. a reshuffled deck is the same deck
+        ignore_cards: all cards are the same, with ignore_order a list of cards is hashed as its length
+    """
+
+    def __init__(self, unordered_keys: Iterable[str] = (), ignore_keys: Iterable[str] = VOLATILE_KEYS,
+                 ignore_order: bool = False, ignore_cards: bool = False):
+        self.unordered_keys = frozenset(unordered_keys)
+        self.ignore_keys = frozenset(ignore_keys)
+        self.ignore_order = ignore_order
+        self.ignore_cards = ignore_cards
+
+    def fingerprint(self, obj: Any) -> int:
+        return int.from_bytes(self.digest(obj), 'big')
+
+    def digest(self, obj: Any) -> bytes:
+        return _digest(self._encode(obj, False))
+
+    def _encode(self, obj: Any, unordered: bool) -> bytes:
+        if obj is None:
+            return _NONE
+        if obj is True:
+            return _TRUE
+        if obj is False:
+            return _FALSE
+        if isinstance(obj, int):
+            if -2**63 <= obj < 2**63:
+                return _INT + struct.pack('>q', obj)
+            return _INT + str(obj).encode()
+        if isinstance(obj, float):
+            # 1.0 and 1 are equal in the game code, keep them equal here
+            if obj.is_integer() and -2**63 <= obj < 2**63:
+                return _INT + struct.pack('>q', int(obj))
+            return _FLOAT + struct.pack('>d', obj)
+        if isinstance(obj, str):
+            data = obj.encode()
+            return _STR + struct.pack('>I', len(data)) + data
+        if _is_card(obj) or (isinstance(obj, dict) and obj.get('is_card') is True):
+            if self.ignore_cards:
+                return _CARD
+            data = _card_str(obj).encode()
+            return _CARD + struct.pack('>I', len(data)) + data
+        if isinstance(obj, dict):
+            items = []
+            for k, v in obj.items():
+                if k in self.ignore_keys:
+                    continue
+                items.append(_digest(self._encode(k, False) + self._encode(v, k in self.unordered_keys)))
+            items.sort()
+            return _DICT + b''.join(items)
+        if isinstance(obj, (set, frozenset)) or ((unordered or self.ignore_order) and isinstance(obj, (list, tuple))):
+            return _BAG + b''.join(sorted(_digest(self._encode(item, False)) for item in obj))
+        if isinstance(obj, (list, tuple)):
+            return _LIST + struct.pack('>I', len(obj)) + b''.join(
+                _digest(self._encode(item, False)) for item in obj)
+        data = repr(obj).encode()
+        return _OTHER + struct.pack('>I', len(data)) + data
+
+
+_default_hasher = StateHasher()
+
+
+def state_fingerprint(obj: Any, unordered_keys: Iterable[str] = None) -> int:
+    """
+    Fingerprint of a game state or an observation.
+    Fields that only exist in observations (recent history, legal actions) are ignored.
+    """
+    if unordered_keys is None:
+        return _default_hasher.fingerprint(obj)
+    return StateHasher(unordered_keys).fingerprint(obj)
+
+
+class TranspositionTable:
+    """
+    A bounded LRU table from fingerprints to evaluations.
+    The least recently used entry is evicted when the table is full.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        assert max_size > 0, "max_size must be positive"
+        self.max_size = max_size
+        self.table: OrderedDict[int, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: int, default: Any = None) -> Any:
+        if key in self.table:
+            self.table.move_to_end(key)
+            self.hits += 1
+            return self.table[key]
+        self.misses += 1
+        return default
+
+    def put(self, key: int, value: Any):
+        if key in self.table:
+            self.table.move_to_end(key)
+        self.table[key] = value
+        if len(self.table) > self.max_size:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def clear(self):
+        self.table.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.table),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+if __name__ == "__main__":
+    import time
+    import json
+    import random
+    from GameEngine.env import LLMGameStateEncoder
+    from GameEngine.utils.game_run import make_env
+    from GameEngine.utils.base_agents import RandomAgent
+
+    env = make_env('data/gameplay_ai_generation/examples/uno/uno.py', seed=0)
+    env.set_agents([RandomAgent() for _ in range(env.num_players)])
+    game_state, observation = env.reset()
+    for _ in range(10):
+        game_state, observation, _ = env.step(game_state, observation)
+
+    # the fingerprint does not depend on the dict order or on the copy
+    shuffled = env.clone_state(game_state)
+    keys = list(shuffled['common'].keys())
+    random.shuffle(keys)
+    common = {k: shuffled['common'][k] for k in keys}
+    shuffled['common'] = common
+    assert state_fingerprint(shuffled) == state_fingerprint(game_state)
+    assert state_fingerprint(observation) == state_fingerprint(env.observe(game_state))
+    assert state_fingerprint(observation) == state_fingerprint(json.loads(json.dumps(observation, cls=LLMGameStateEncoder)))
+
+    start = time.time()
+    for _ in range(1000):
+        state_fingerprint(game_state)
+    print(f"Fingerprint of a uno state: {(time.time() - start):.3f} ms")
@@ -1,10 +1,9 @@
-from retrying import retry
 import os
 import json
 
 from GameEngine.utils.base_agents import BaseAgent
 from GameEngine.utils.base_message import observation_to_str
-from Utils.LLMHandler import LLMHandler
+from Utils.LLMHandler import LLMHandler, StopAfterBlock, reask
 
 BELIEF_PROMPT = """
 You are a player in a card game. Please do your best to beat the other players and win the game.
@@ -69,7 +68,7 @@ class BeliefAgent(BaseAgent):
         self.world_belief = ""
 
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def eval_step(self, state):
         observation_str = observation_to_str(state)
         actions_str = "\n".join([f"{i}: {action}" for i, action in enumerate(state['legal_actions'])])
@@ -77,6 +76,8 @@ class BeliefAgent(BaseAgent):
         format_assertion = False
         range_assertion = False
 
+        # an invalid answer is asked again, not read from the cache
+        retried = False
         while not (format_assertion and range_assertion):
         # while action_idx < 0 or action_idx >= len(state['legal_actions']):
 
@@ -86,7 +87,9 @@ class BeliefAgent(BaseAgent):
                             .replace("{reflection}", self.reflection)\
                                 .replace("{self_belief}", self.self_belief)\
                                     .replace("{world_belief}", self.world_belief)
-            response = self.llm_handler.chat(prompt)
+            response = self.llm_handler.chat(prompt, use_cache=not retried, caller='agent_action',
+                                             stop_when=StopAfterBlock('json'))
+            retried = True
             json_str = self.parse_action(response)
             format_assertion = self.format_assertion(json_str, ['self-belief', 'world-belief', 'action'])
 
@@ -1,9 +1,8 @@
-from retrying import retry
 import json
 
 from GameEngine.utils.base_agents import BaseAgent
 from GameEngine.utils.base_message import observation_to_str
-from Utils.LLMHandler import LLMHandler
+from Utils.LLMHandler import LLMHandler, StopAfterBlock, reask
 
 COT_PROMPT = """
 You are a player in a card game. Please do your best to beat the other players and win the game.
@@ -36,7 +35,7 @@ class CoTAgent(BaseAgent):
         self.game_description = game_description
         self.llm_handler = llm_handler
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def eval_step(self, state):
         
         observation_str = observation_to_str(state)
@@ -44,10 +43,14 @@ class CoTAgent(BaseAgent):
         format_assertion = False
         range_assertion = False
 
+        # an invalid answer is asked again, not read from the cache
+        retried = False
         while not (format_assertion and range_assertion):
             prompt = COT_PROMPT.replace("{game_description}", self.game_description).replace("{observation}", observation_str)
             # print(prompt)
-            response = self.llm_handler.chat(prompt)
+            response = self.llm_handler.chat(prompt, use_cache=not retried, caller='agent_action',
+                                             stop_when=StopAfterBlock('json'))
+            retried = True
 
             json_str = self.parse_action(response)
 
@@ -2,6 +2,7 @@ import random
 from GameEngine.utils.base_agents import BaseAgent
 
 from itertools import groupby, combinations
+from functools import lru_cache
 from typing import List, Dict, Tuple
 
 
@@ -31,10 +32,118 @@ def _find_card_in_hand(hand: List[dict], card_str: str):
             return card
     return None
 
+"""
+Bitmask meld solver. A hand is a 52-bit mask, bit = suit index * 13 + rank order - 1,
+with the suits in alphabetical order, so the bit order is the order of the hand sorted
+by suit and rank. All 264 runs are precomputed as masks and indexed by card. Sets are only
+formed by same-rank cards that are adjacent in this order, like in the reference
+enumeration below and in the gin_rummy game code, so the deadwood matches the game's
+own scoring. Results are memoized across calls: the lowest card of a mask is either
+deadwood or part of one of the melds that contain it.
+"""
+_SUIT_INDEX = {'Clubs': 0, 'Diamonds': 1, 'Hearts': 2, 'Spades': 3}
+
+def _build_run_masks() -> List[int]:
+    """ Runs of 3 or more consecutive cards of the same suit, ace low."""
+    runs = []
+    for suit in range(4):
+        for start in range(13):
+            for end in range(start + 3, 14):
+                runs.append(sum(1 << (suit * 13 + rank) for rank in range(start, end)))
+    return runs
+
+_RUN_MASKS = _build_run_masks()
+_RUNS_BY_CARD = [tuple(run for run in _RUN_MASKS if run >> bit & 1) for bit in range(52)]
+_CARD_VALUES = [min(bit % 13 + 1, 10) for bit in range(52)]
+# cards that can start a run of 3 in their suit (ranks A to J)
+_RUN_START_MASK = sum(1 << bit for bit in range(52) if bit % 13 <= 10)
+
+@lru_cache(maxsize=None)
+def _card_bit(rank: str, suit: str) -> int:
+    return _SUIT_INDEX[suit] * 13 + _get_rank_order(rank) - 1
+
+def _hand_to_mask(hand: List[Dict]) -> int:
+    mask = 0
+    for card in hand:
+        mask |= 1 << _card_bit(card['rank'], card['suit'])
+    return mask
+
+@lru_cache(maxsize=1 << 16)
+def _set_masks(mask: int) -> Tuple[int, ...]:
+    """ Sets (3 or 4 of a kind) of same-rank cards that are adjacent in the bit order."""
+    bits = [bit for bit in range(52) if mask >> bit & 1]
+    sets = []
+    i = 0
+    while i < len(bits):
+        j = i + 1
+        while j < len(bits) and bits[j] % 13 == bits[i] % 13:
+            j += 1
+        group = bits[i:j]
+        if len(group) >= 3:
+            for combo in combinations(group, 3):
+                sets.append(sum(1 << bit for bit in combo))
+            if len(group) == 4:
+                sets.append(sum(1 << bit for bit in group))
+        i = j
+    return tuple(sets)
+
+@lru_cache(maxsize=1 << 16)
+def _solve_mask(mask: int, sets: Tuple[int, ...] = ()) -> Tuple[int, Tuple[int, ...]]:
+    """ Returns the minimum deadwood of a hand mask and the melds (masks) that achieve it."""
+    if mask == 0:
+        return 0, ()
+    low = mask & -mask
+    bit = low.bit_length() - 1
+    if sets:
+        sets = tuple(meld for meld in sets if meld & mask == meld)
+    deadwood, melds = _solve_mask(mask ^ low, sets)
+    best = (deadwood + _CARD_VALUES[bit], melds)
+    for meld in _RUNS_BY_CARD[bit] + sets:
+        if meld & low and meld & mask == meld:
+            deadwood, melds = _solve_mask(mask ^ meld, sets)
+            if deadwood < best[0]:
+                best = (deadwood, (meld,) + melds)
+    return best
+
 def _find_best_melds(hand: List[Dict]) -> Tuple[List[List[Dict]], int]:
     """
     Finds the optimal combination of melds in a hand to minimize deadwood value.
 
+    Args:
+        hand (List[Dict]): A list of card dictionaries, e.g., {'rank': 'K', 'suit': 'Spades'}.
+            The hand is not modified.
+
+    Returns:
+        Tuple[List[List[Dict]], int]: A tuple containing:
+            - The list of melds in the best combination.
+            - The resulting minimum deadwood value.
+    """
+    if not hand:
+        return [], 0
+    mask = _hand_to_mask(hand)
+    sets = _set_masks(mask)
+    # cards that fit in no meld are deadwood anyway, leave them out of the search
+    run_starts = mask & (mask >> 1) & (mask >> 2) & _RUN_START_MASK
+    meldable = run_starts | (run_starts << 1) | (run_starts << 2)
+    for meld in sets:
+        meldable |= meld
+    deadwood, meld_masks = _solve_mask(meldable, sets)
+    unmeldable = mask & ~meldable
+    while unmeldable:
+        low = unmeldable & -unmeldable
+        deadwood += _CARD_VALUES[low.bit_length() - 1]
+        unmeldable ^= low
+    if not meld_masks:
+        return [], deadwood
+    cards_by_bit = {_card_bit(card['rank'], card['suit']): card for card in hand}
+    melds = [[cards_by_bit[bit] for bit in sorted(cards_by_bit) if meld >> bit & 1] for meld in meld_masks]
+    return melds, deadwood
+
+def _find_best_melds_reference(hand: List[Dict]) -> Tuple[List[List[Dict]], int]:
+    """
+    Reference implementation of `_find_best_melds`, kept for the benchmark below.
+    Finds the optimal combination of melds in a hand to minimize deadwood value.
+
     This version uses plain dictionaries to represent cards, e.g.,
     {'rank': 'K', 'suit': 'Spades'}.
 
@@ -139,6 +248,8 @@ class GinRummyRuleAgent(BaseAgent):
     4. For any other situation (e.g., drawing a card), it will choose a random
        legal action.
     '''
+    meld_solver = staticmethod(_find_best_melds)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.use_raw = True
@@ -202,7 +313,7 @@ class GinRummyRuleAgent(BaseAgent):
             remaining_hand = [c for c in hand if c != card_to_discard]
             
             # Calculate the minimum deadwood for the remaining hand
-            _, deadwood_count = _find_best_melds(remaining_hand)
+            _, deadwood_count = self.meld_solver(remaining_hand)
 
             if deadwood_count < min_resulting_deadwood:
                 min_resulting_deadwood = deadwood_count
@@ -212,3 +323,38 @@ class GinRummyRuleAgent(BaseAgent):
         
         # If there are multiple "best" discards, choose one randomly
         return random.choice(best_discard_options) if best_discard_options else random.choice(discard_actions)
+
+
+if __name__ == "__main__":
+    # Benchmark the per-decision latency of both meld solvers on the discard decisions
+    # of self-play games, and check that the decisions are identical.
+    import time
+    from GameEngine.utils.game_run import make_env
+
+    env = make_env('data/gameplay_ai_generation/examples/gin_rummy/gin_rummy.py', seed=0)
+    agent = GinRummyRuleAgent()
+    env.set_agents([agent, agent])
+    states = []
+    for _ in range(20):
+        game_state, observation = env.reset()
+        while not game_state['common']['is_over']:
+            if any(a['action'] == 'discard' for a in observation['legal_actions']):
+                states.append(observation)
+            game_state, observation, _ = env.step(game_state, observation)
+
+    reference_agent = GinRummyRuleAgent()
+    reference_agent.meld_solver = staticmethod(_find_best_melds_reference)
+    _solve_mask.cache_clear()
+    _set_masks.cache_clear()
+    results = {}
+    for name, bench_agent in [('reference', reference_agent), ('bitmask', agent)]:
+        decisions = []
+        start = time.perf_counter()
+        for i, state in enumerate(states):
+            random.seed(i)
+            decisions.append(bench_agent.step(state)[0])
+        elapsed = time.perf_counter() - start
+        results[name] = decisions
+        print(f"{name}: {len(states)} decisions, {elapsed / len(states) * 1e6:.1f} us per decision")
+    assert results['reference'] == results['bitmask'], "The decisions differ"
+    print("Decisions are identical")
@@ -6,6 +6,7 @@ import threading
 from GameplayAI.utils.q_func_design import LLMQFunc
 from GameEngine.utils.base_agents import BaseAgent
 from Utils.LLMHandler import LLMHandler
+from Utils.LLMUsage import bind_usage_context
 
 
 
@@ -68,7 +69,7 @@ class HeuristicEnsembleAgent(BaseAgent):
             threads = []
             result = [None] * len(policy_list)
             for i, policy in enumerate(policy_list):
-                thread = threading.Thread(target=init_llmqfunc, args=(game_description, policy, input_description, True, llm_handler, result, i))
+                thread = threading.Thread(target=bind_usage_context(init_llmqfunc), args=(game_description, policy, input_description, True, llm_handler, result, i))
                 threads.append(thread)
                 thread.start()
             for thread in threads:
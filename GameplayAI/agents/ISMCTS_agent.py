@@ -0,0 +1,370 @@
+import json
+import math
+import time
+import random
+import logging
+import multiprocessing as mp
+import numpy as np
+from typing import Dict, Tuple
+
+from GameEngine.env import LLMGame
+from GameEngine.utils.base_agents import BaseAgent
+from GameEngine.utils.game_run import make_env
+from GameEngine.utils.state_hash import state_fingerprint, TranspositionTable
+
+logger = logging.getLogger(__name__)
+
+MAX_ERROR_RATE = 0.5  # failed iterations of a search above which a warning is logged
+
+
+def action_key(action) -> str:
+    """ A hashable key of an action, cards are represented by their strings"""
+    return json.dumps(action, sort_keys=True, default=str)
+
+
+class ISMCTSNode:
+    """
+    A node of the single-observer information set search tree.
+    The statistics are from the view of the player who made the move into this node.
+    """
+    __slots__ = ['action', 'player', 'children', 'visits', 'reward', 'avails']
+
+    def __init__(self, action: dict = None, player: int = None):
+        self.action = action
+        self.player = player
+        self.children: Dict[str, ISMCTSNode] = {}
+        self.visits = 0
+        self.reward = 0.0
+        self.avails = 1
+
+    def ucb_score(self, exploration: float) -> float:
+        return self.reward / self.visits + exploration * math.sqrt(math.log(self.avails) / self.visits)
+
+
+class ISMCTS:
+    """
+    Information Set Monte Carlo Tree Search (SO-ISMCTS, Cowling et al. 2012).
+    Each iteration samples a determinization of the hidden cards that is consistent
+    with the observation, then descends the shared tree restricted to the actions
+    that are legal in this determinization.
+    """
+
+    def __init__(self, env: LLMGame, rollout_agent: BaseAgent = None,
+                 exploration: float = 0.7, max_rollout_depth: int = 200, rng: random.Random = None,
+                 determinization_reuse: int = 1):
+        self.env = env
+        self.determinization_reuse = determinization_reuse
+        self.rollout_agent = rollout_agent
+        self.exploration = exploration
+        self.max_rollout_depth = max_rollout_depth
+        self.rng = rng if rng is not None else random.Random()
+        self.iterations = 0
+        self.errors = 0
+        self.last_error = None
+
+    def search(self, observation: Dict, iterations: int = None, time_budget: float = None) -> Dict[str, Tuple[int, float]]:
+        """
+        Run the search from the observation of the acting player.
+        Returns the visits and total reward of each root action.
+        """
+        root = ISMCTSNode()
+        deadline = time.time() + time_budget if time_budget is not None else None
+        count = 0
+        journal = None
+        try:
+            while (iterations is None or count < iterations) and (deadline is None or time.time() < deadline):
+                if self.determinization_reuse > 1:
+                    # a determinization is reused by rolling back the moves of the previous iteration
+                    if count % self.determinization_reuse == 0:
+                        if journal is not None:
+                            journal.deactivate()
+                        determinization = self.env.determinize(observation, self.rng)
+                        journal = self.env.journal(determinization)
+                count += 1
+                self.iterations += 1
+                try:
+                    if journal is not None:
+                        self.iterate(root, determinization)
+                    else:
+                        self.iterate(root, self.env.determinize(observation, self.rng))
+                except Exception as e:
+                    # simulated states may hit corners of generated game code, skip this iteration
+                    self.errors += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                finally:
+                    if journal is not None:
+                        journal.rollback(0)
+        finally:
+            if journal is not None:
+                journal.deactivate()
+        return {key: (child.visits, child.reward) for key, child in root.children.items()}
+
+    def iterate(self, root: ISMCTSNode, state: Dict):
+        """ One iteration from a determinized state, the state is modified in place"""
+        env = self.env
+        node = root
+        path = [root]
+
+        # selection and expansion
+        while not state['common']['is_over']:
+            legal_actions = env.legal_actions(state)
+            if state['common']['is_over']:
+                break
+            if not legal_actions:
+                raise ValueError("No legal actions in a non-terminal state")
+            keyed = {action_key(action): action for action in legal_actions}
+            untried = [key for key in keyed if key not in node.children]
+            player = state['common']['current_player']
+            if untried:
+                key = self.rng.choice(untried)
+                child = ISMCTSNode(keyed[key], player)
+                node.children[key] = child
+                for other_key in keyed:
+                    if other_key != key and other_key in node.children:
+                        node.children[other_key].avails += 1
+                state = env.simulate(state, keyed[key])
+                path.append(child)
+                break
+            candidates = [node.children[key] for key in keyed]
+            for child in candidates:
+                child.avails += 1
+            node = max(candidates, key=lambda child: child.ucb_score(self.exploration))
+            state = env.simulate(state, keyed[action_key(node.action)])
+            path.append(node)
+
+        # rollout
+        depth = 0
+        while not state['common']['is_over'] and depth < self.max_rollout_depth:
+            legal_actions = env.legal_actions(state)
+            if state['common']['is_over']:
+                break
+            if not legal_actions:
+                raise ValueError("No legal actions in a non-terminal state")
+            if self.rollout_agent is None:
+                action = self.rng.choice(legal_actions)
+            else:
+                rollout_observation = env.observe(state)
+                action, _ = self.rollout_agent.eval_step(rollout_observation)
+            state = env.simulate(state, action)
+            depth += 1
+
+        # backpropagation, a win counts 1 for every player with the highest payoff
+        num_players = state['common']['num_players']
+        if state['common']['is_over']:
+            payoffs = env.payoffs(state)
+            best = max(payoffs)
+            rewards = [1.0 if payoff == best else 0.0 for payoff in payoffs]
+        else:
+            rewards = [1.0 / num_players] * num_players
+        for visited in path:
+            visited.visits += 1
+            if visited.player is not None:
+                visited.reward += rewards[visited.player]
+
+
+"""
+Root parallelization. Every worker process builds an independent tree from the same
+observation and the root statistics are summed. Workers are forked, so they inherit
+the search environment and the rollout agent of the parent without pickling them.
+"""
+_worker_agent: 'ISMCTSAgent' = None
+
+
+def _search_worker(args) -> Tuple[Dict[str, Tuple[int, float]], int, int, str]:
+    observation, iterations, time_budget, seed = args
+    # the forked workers inherit the global generators of the parent, the game code shuffles with them
+    random.seed(seed)
+    np.random.seed(seed)
+    searcher = _worker_agent.make_searcher(seed)
+    stats = searcher.search(observation, iterations, time_budget)
+    return stats, searcher.iterations, searcher.errors, searcher.last_error
+
+
+class ISMCTSAgent(BaseAgent):
+    ''' Information Set Monte Carlo Tree Search agent.
+
+    It works with any generated game: hidden cards are re-sampled from the observation
+    (see `determinize` in the game engine) and the game code itself is used as the simulator.
+    Rollouts are random by default, or follow a given agent such as HeuristicEnsembleAgent.
+    '''
+
+    def __init__(self,
+                 game_code_path: str,
+                 rollout_agent: BaseAgent = None,
+                 iterations: int = 200,
+                 time_budget: float = None,
+                 num_workers: int = 1,
+                 exploration: float = 0.7,
+                 max_rollout_depth: int = 200,
+                 seed: int = None,
+                 transposition_table: TranspositionTable = None,
+                 determinization_reuse: int = 4,
+                 **kwargs):
+        '''
+        Args:
+            game_code_path (str): path of the game code, used to build the search environment
+            rollout_agent (BaseAgent): agent used in rollouts, random rollouts if None
+            iterations (int): iterations per decision and per worker, unlimited if None
+            time_budget (float): seconds per decision, unlimited if None
+            num_workers (int): number of processes for root parallelization
+            exploration (float): UCB exploration constant
+            max_rollout_depth (int): maximum number of actions in a rollout
+            seed (int): seed of the search
+            transposition_table (TranspositionTable): root statistics of previous searches keyed by
+                the observation fingerprint, shared across decisions and games. A new table if None.
+            determinization_reuse (int): iterations per sampled determinization. Between them the
+                state is rolled back with the engine StateJournal instead of sampled again.
+        '''
+        super().__init__(**kwargs)
+        assert iterations is not None or time_budget is not None, "Either iterations or time_budget is required"
+        self.use_raw = True
+        self.game_code_path = game_code_path
+        self.rollout_agent = rollout_agent
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.num_workers = num_workers
+        self.exploration = exploration
+        self.max_rollout_depth = max_rollout_depth
+        self.determinization_reuse = determinization_reuse
+        self.rng = random.Random(seed)
+        self.pool = None
+        self.last_search = {}  # iterations and failed iterations of the last search
+        self.transposition_table = transposition_table if transposition_table is not None else TranspositionTable(10000)
+
+        # creating an environment reseeds the global random generator, keep it untouched
+        random_state = random.getstate()
+        self.env = make_env(game_code_path)
+        random.setstate(random_state)
+
+    def make_searcher(self, seed: int) -> ISMCTS:
+        return ISMCTS(self.env, self.rollout_agent, self.exploration, self.max_rollout_depth,
+                      random.Random(seed), self.determinization_reuse)
+
+    def _get_pool(self):
+        if self.pool is None and self.num_workers > 1 and 'fork' in mp.get_all_start_methods():
+            global _worker_agent
+            _worker_agent = self
+            self.pool = mp.get_context('fork').Pool(self.num_workers)
+        return self.pool
+
+    def search(self, observation: Dict) -> Dict[str, Tuple[int, float]]:
+        """
+        Search from the observation and return the summed root statistics,
+        including those of earlier searches from the same information set.
+        """
+        # the cards of the observation belong to the game module of the caller
+        observation = self.env.import_observation(observation)
+        fingerprint = state_fingerprint(observation)
+        seeds = [self.rng.randrange(2**32) for _ in range(max(self.num_workers, 1))]
+
+        # simulations consume the global random generator (e.g. shuffling in the game code)
+        random_state = random.getstate()
+        try:
+            pool = self._get_pool()
+            if pool is not None:
+                results = pool.map(_search_worker, [(observation, self.iterations, self.time_budget, seed) for seed in seeds])
+            else:
+                random.seed(seeds[0])
+                searcher = self.make_searcher(seeds[0])
+                results = [(searcher.search(observation, self.iterations, self.time_budget),
+                            searcher.iterations, searcher.errors, searcher.last_error)]
+        finally:
+            random.setstate(random_state)
+
+        iterations = sum(result[1] for result in results)
+        errors = sum(result[2] for result in results)
+        self.last_search = {'iterations': iterations, 'errors': errors}
+        if iterations and errors / iterations > MAX_ERROR_RATE:
+            last_error = next(result[3] for result in results if result[3] is not None)
+            logger.warning(f"{errors} of {iterations} ISMCTS iterations failed in the game code, "
+                           f"the last one with {last_error}")
+
+        stats: Dict[str, Tuple[int, float]] = dict(self.transposition_table.get(fingerprint, {}))
+        for worker_stats, *_ in results:
+            for key, (visits, reward) in worker_stats.items():
+                total_visits, total_reward = stats.get(key, (0, 0.0))
+                stats[key] = (total_visits + visits, total_reward + reward)
+        self.transposition_table.put(fingerprint, stats)
+        return stats
+
+    def eval_step(self, state) -> Tuple[dict, Dict]:
+        legal_actions = state['legal_actions']
+        info = {'legal_actions': legal_actions}
+        if len(legal_actions) == 0:
+            return None, info
+        if len(legal_actions) == 1:
+            info['probs'] = [1.0]
+            return legal_actions[0], info
+
+        stats = self.search(state)
+        info['search_iterations'] = self.last_search['iterations']
+        info['search_errors'] = self.last_search['errors']
+        visits = [stats.get(action_key(action), (0, 0.0))[0] for action in legal_actions]
+        total = sum(visits)
+        if total == 0:
+            # every simulation failed, fall back to a random action (the search logged a warning)
+            info['probs'] = [1 / len(legal_actions) for _ in legal_actions]
+            return self.rng.choice(legal_actions), info
+
+        info['probs'] = [v / total for v in visits]
+        info['visits'] = visits
+        best = max(visits)
+        action = self.rng.choice([action for action, v in zip(legal_actions, visits) if v == best])
+        return action, info
+
+    def step(self, state):
+        return self.eval_step(state)
+
+    def close(self):
+        """ Terminate the worker processes"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import argparse
+    from GameEngine.utils.base_agents import RandomAgent
+
+    # the search must run on the games whose observations have int keys (hearts_variation,
+    # go-fish_variation) and cards with None fields (i-doubt-it_variation)
+    parser = argparse.ArgumentParser(description="Check that the ISMCTS simulations run on the example games")
+    parser.add_argument("games", nargs='*',
+                        default=['hearts_variation', 'go-fish_variation', 'i-doubt-it_variation', 'uno'])
+    parser.add_argument("--decisions", type=int, default=5, help="searches per game, along a random game")
+    parser.add_argument("--iterations", type=int, default=30)
+    args = parser.parse_args()
+
+    failed_games = []
+    for game_name in args.games:
+        game_code_path = os.path.join('data', 'gameplay_ai_generation', 'examples', game_name, f"{game_name}.py")
+        env = make_env(game_code_path, seed=0)
+        agent = ISMCTSAgent(game_code_path, iterations=args.iterations, seed=0)
+        env.set_agents([RandomAgent() for _ in range(env.get_num_players())])
+        game_state, observation = env.reset()
+        iterations, errors = 0, 0
+        for _ in range(args.decisions):
+            if game_state['common']['is_over']:
+                break
+            if len(observation['legal_actions']) > 1:
+                agent.search(observation)
+                iterations += agent.last_search['iterations']
+                errors += agent.last_search['errors']
+            game_state, observation, _ = env.step(game_state, observation)
+        print(f"{game_name}: {errors} of {iterations} iterations failed")
+        if errors:
+            failed_games.append(game_name)
+    sys.exit(1 if failed_games else 0)
@@ -0,0 +1,342 @@
+import os
+import time
+import random
+import logging
+from bisect import bisect
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from GameEngine.utils.base_agents import BaseAgent
+
+logger = logging.getLogger(__name__)
+
+"""
+A dedicated model of data/gameplay_ai_generation/examples/leduc_holdem, following its rules:
+- 6 cards (J, J, Q, Q, K, K), one private card per player, one public card in round 2
+- blinds 1 (player 0) and 2 (player 1), player 0 acts first in both rounds
+- raise amounts 2 and 4 in rounds 1 and 2, at most 2 raises per round
+- a call or a check ends the betting round
+- the winner wins the total contribution of the loser, a pair with the public card wins
+Actions are stored in 3 slots: fold, call or check, raise.
+"""
+RANKS = ['J', 'Q', 'K']
+FOLD, CALL, RAISE = 0, 1, 2
+RAISE_AMOUNTS = {1: 2, 2: 4}
+MAX_RAISES = 2
+DEFAULT_STRATEGY_PATH = 'data/gameplay_ai_generation/examples/leduc_holdem/ai/cfr_strategy.npz'
+
+
+class LeducNode:
+    """ A decision node of the public betting tree."""
+
+    def __init__(self, node_id: int, round: int, prefix: int, num_raises: int, player: int, call_amount: int):
+        self.node_id = node_id
+        self.round = round
+        self.prefix = prefix  # index of the round 1 betting for round 2 nodes
+        self.num_raises = num_raises
+        self.player = player
+        self.call_amount = call_amount
+        # per action slot: ('node', id), ('fold', folder, totals), ('showdown', totals) or None if illegal
+        self.children: List[Tuple] = [None, None, None]
+        self.infoset_base = 0
+
+    def legal_mask(self) -> np.ndarray:
+        return np.array([child is not None for child in self.children])
+
+    def num_infosets(self) -> int:
+        return 3 if self.round == 1 else 9
+
+
+def build_tree() -> List[LeducNode]:
+    nodes: List[LeducNode] = []
+    round_ends = {}  # round 1 totals -> prefix
+
+    def build(round: int, prefix: int, num_raises: int, player: int, round_contribution: list, totals: list) -> int:
+        node = LeducNode(len(nodes), round, prefix, num_raises, player,
+                         round_contribution[1 - player] - round_contribution[player])
+        nodes.append(node)
+
+        node.children[FOLD] = ('fold', player, tuple(totals))
+
+        # call or check, both end the betting round
+        after_call = list(totals)
+        after_call[player] += node.call_amount
+        if round == 1:
+            next_prefix = round_ends.setdefault(after_call[0], len(round_ends))
+            node.children[CALL] = ('node', build(2, next_prefix, 0, 0, [0, 0], after_call))
+        else:
+            node.children[CALL] = ('showdown', tuple(after_call))
+
+        if num_raises < MAX_RAISES:
+            amount = node.call_amount + RAISE_AMOUNTS[round]
+            next_round_contribution = list(round_contribution)
+            next_round_contribution[player] += amount
+            next_totals = list(totals)
+            next_totals[player] += amount
+            node.children[RAISE] = ('node', build(round, prefix, num_raises + 1, 1 - player,
+                                                  next_round_contribution, next_totals))
+        return node.node_id
+
+    build(1, 0, 0, 0, [1, 2], [1, 2])
+    base = 0
+    for node in nodes:
+        node.infoset_base = base
+        base += node.num_infosets()
+    return nodes
+
+
+class LeducCFRTrainer:
+    """
+    CFR+ (Tammelin 2014) with alternating updates and linear averaging.
+    The traversal follows the 12 public betting nodes and is vectorized over
+    all deals of (player 0 card, player 1 card, public card).
+    """
+
+    def __init__(self):
+        self.nodes = build_tree()
+        self.num_infosets = sum(node.num_infosets() for node in self.nodes)
+
+        # deals with non-zero probability
+        deals = []
+        for r0 in range(3):
+            for r1 in range(3):
+                for rp in range(3):
+                    counts = [2, 2, 2]
+                    prob = counts[r0] / 6
+                    counts[r0] -= 1
+                    prob *= counts[r1] / 5
+                    counts[r1] -= 1
+                    prob *= counts[rp] / 4
+                    if prob > 0:
+                        deals.append((r0, r1, rp, prob))
+        deals = np.array(deals)
+        self.ranks = deals[:, :2].astype(int).T  # (2, D)
+        self.public_rank = deals[:, 2].astype(int)
+        self.chance = deals[:, 3]
+
+        # showdown result for player 0: 1 win, -1 loss, 0 tie
+        pair0 = self.ranks[0] == self.public_rank
+        pair1 = self.ranks[1] == self.public_rank
+        high = np.sign(self.ranks[0] - self.ranks[1])
+        self.showdown = np.where(pair0 & ~pair1, 1, np.where(pair1 & ~pair0, -1, high)).astype(float)
+
+        # infoset index of each deal at each node, for the acting player
+        self.infoset_index = []
+        for node in self.nodes:
+            own = self.ranks[node.player]
+            if node.round == 1:
+                self.infoset_index.append(node.infoset_base + own)
+            else:
+                self.infoset_index.append(node.infoset_base + own * 3 + self.public_rank)
+        self.legal = np.zeros((self.num_infosets, 3), dtype=bool)
+        for node in self.nodes:
+            self.legal[node.infoset_base:node.infoset_base + node.num_infosets()] = node.legal_mask()
+
+        self.regrets = np.zeros((self.num_infosets, 3))
+        self.strategy_sum = np.zeros((self.num_infosets, 3))
+        self.iterations = 0
+
+    def _utility(self, child: Tuple, player: int) -> np.ndarray:
+        """ Terminal utility of the player for every deal."""
+        if child[0] == 'fold':
+            _, folder, totals = child
+            value = totals[folder] if folder != player else -totals[folder]
+            return np.full(len(self.chance), float(value))
+        _, totals = child
+        sign = 1 if player == 0 else -1
+        return sign * self.showdown * totals[0]
+
+    def current_strategy(self) -> np.ndarray:
+        positive = np.maximum(self.regrets, 0) * self.legal
+        total = positive.sum(axis=1, keepdims=True)
+        uniform = self.legal / self.legal.sum(axis=1, keepdims=True)
+        return np.where(total > 0, positive / np.where(total > 0, total, 1), uniform)
+
+    def average_strategy(self) -> np.ndarray:
+        total = self.strategy_sum.sum(axis=1, keepdims=True)
+        uniform = self.legal / self.legal.sum(axis=1, keepdims=True)
+        return np.where(total > 0, self.strategy_sum / np.where(total > 0, total, 1), uniform)
+
+    def _cfr(self, node_id: int, player: int, reach: np.ndarray, opponent_reach: np.ndarray,
+             strategy: np.ndarray, weight: float) -> np.ndarray:
+        """ Counterfactual values of the player for every deal, weighted by the opponent and chance reach."""
+        node = self.nodes[node_id]
+        infosets = self.infoset_index[node_id]
+        sigma = strategy[infosets]
+        values = np.zeros((len(self.chance), 3))
+        for action, child in enumerate(node.children):
+            if child is None:
+                continue
+            if node.player == player:
+                child_reach, child_opponent_reach = reach * sigma[:, action], opponent_reach
+            else:
+                child_reach, child_opponent_reach = reach, opponent_reach * sigma[:, action]
+            if child[0] == 'node':
+                values[:, action] = self._cfr(child[1], player, child_reach, child_opponent_reach, strategy, weight)
+            else:
+                values[:, action] = self._utility(child, player) * child_opponent_reach
+        if node.player != player:
+            return values.sum(axis=1)
+
+        value = (sigma * values).sum(axis=1)
+        np.add.at(self.regrets, infosets, (values - value[:, None]) * node.legal_mask())
+        np.add.at(self.strategy_sum, infosets, weight * reach[:, None] * sigma)
+        return value
+
+    def iterate(self):
+        self.iterations += 1
+        for player in range(2):
+            strategy = self.current_strategy()
+            self._cfr(0, player, np.ones(len(self.chance)), self.chance.copy(), strategy, self.iterations)
+            np.maximum(self.regrets, 0, out=self.regrets)
+
+    def _best_response(self, node_id: int, player: int, opponent_reach: np.ndarray, strategy: np.ndarray) -> np.ndarray:
+        node = self.nodes[node_id]
+        infosets = self.infoset_index[node_id]
+        values = np.zeros((len(self.chance), 3))
+        for action, child in enumerate(node.children):
+            if child is None:
+                continue
+            child_opponent_reach = opponent_reach if node.player == player else opponent_reach * strategy[infosets, action]
+            if child[0] == 'node':
+                values[:, action] = self._best_response(child[1], player, child_opponent_reach, strategy)
+            else:
+                values[:, action] = self._utility(child, player) * child_opponent_reach
+        if node.player != player:
+            return values.sum(axis=1)
+
+        # the best action of each infoset maximizes the sum of values over its deals
+        action_values = np.zeros((self.num_infosets, 3))
+        np.add.at(action_values, infosets, values)
+        action_values[~self.legal] = -np.inf
+        best = action_values.argmax(axis=1)
+        return values[np.arange(len(self.chance)), best[infosets]]
+
+    def exploitability(self, strategy: np.ndarray = None) -> float:
+        """ Mean gain (in chips per game) of the best responses to the strategy."""
+        if strategy is None:
+            strategy = self.average_strategy()
+        values = [self._best_response(0, player, self.chance.copy(), strategy).sum() for player in range(2)]
+        return (values[0] + values[1]) / 2
+
+    def train(self, target_exploitability: float = 1e-3, max_iterations: int = 100000,
+              check_every: int = 50, verbose: bool = True) -> float:
+        """ Iterate until the average strategy is less exploitable than the target."""
+        start = time.time()
+        exploitability = self.exploitability()
+        while exploitability > target_exploitability and self.iterations < max_iterations:
+            for _ in range(check_every):
+                self.iterate()
+            exploitability = self.exploitability()
+            if verbose:
+                logger.info(f"Iteration {self.iterations}: exploitability {exploitability:.6f} ({time.time() - start:.1f}s)")
+        return exploitability
+
+    def node_keys(self) -> np.ndarray:
+        return np.array([(node.round, node.prefix, node.num_raises) for node in self.nodes], dtype=np.int8)
+
+    def save(self, path: str = DEFAULT_STRATEGY_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path,
+            strategy=self.average_strategy().astype(np.float32),
+            node_keys=self.node_keys(),
+            exploitability=np.float32(self.exploitability()),
+            iterations=np.int32(self.iterations),
+        )
+
+
+class LeducHoldemCFRAgent(BaseAgent):
+    ''' Leduc Hold'em equilibrium agent.
+
+    It plays the average strategy of CFR+, loaded from a compact (infosets x 3) array,
+    by a table lookup. The strategy is trained and saved first if the file does not exist.
+    '''
+
+    def __init__(self, strategy_path: str = DEFAULT_STRATEGY_PATH, seed: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self.use_raw = True
+        self.rng = random.Random(seed)
+
+        trainer = LeducCFRTrainer()
+        if os.path.exists(strategy_path):
+            data = np.load(strategy_path)
+            assert np.array_equal(data['node_keys'], trainer.node_keys()), \
+                f"The strategy in {strategy_path} does not match the game tree"
+            strategy = data['strategy'].astype(float)
+        else:
+            logger.warning(f"Strategy file not found: {strategy_path}, training CFR+ instead.")
+            trainer.train(verbose=False)
+            trainer.save(strategy_path)
+            strategy = trainer.average_strategy()
+
+        # (round, prefix, num_raises) -> infoset base, and the cumulative distribution of each infoset
+        self.node_lookup: Dict[Tuple[int, int, int], Tuple[int, int]] = {
+            (node.round, node.prefix, node.num_raises): (node.infoset_base, node.round) for node in trainer.nodes
+        }
+        self.cumulative = [np.cumsum(row).tolist() for row in strategy]
+        self.rank_index = {rank: i for i, rank in enumerate(RANKS)}
+
+    def infoset(self, state: Dict) -> int:
+        common = state['common']
+        player = state['players'][common['current_player']]
+        own = self.rank_index[player['facedown_cards']['hand'][0]['rank']]
+        if common['round'] == 1:
+            base, _ = self.node_lookup[(1, 0, common['num_raises'])]
+            return base + own
+        # contributions of the round 1 betting, 2, 4 or 6 chips
+        public = player['public']
+        prefix = (public['total_pot_contribution'] - public['round_pot_contribution']) // 2 - 1
+        base, _ = self.node_lookup[(2, prefix, common['num_raises'])]
+        return base + own * 3 + self.rank_index[common['faceup_cards']['public_card']['rank']]
+
+    def step(self, state):
+        ''' Sample an action from the equilibrium strategy.
+
+        Args:
+            state (dict): Structured state from the game.
+
+        Returns:
+            (dict, dict): A tuple containing the chosen action dictionary
+                          and an info dictionary for analysis.
+        '''
+        legal_actions = state['legal_actions']
+        try:
+            cumulative = self.cumulative[self.infoset(state)]
+        except (KeyError, IndexError, TypeError):
+            # the state is not covered by the model
+            return self.rng.choice(legal_actions), {'agent_strategy': 'random_fallback'}
+        slot = min(bisect(cumulative, self.rng.random() * cumulative[-1]), 2)
+        name = 'fold' if slot == FOLD else 'raise' if slot == RAISE else None
+        for action in legal_actions:
+            if action['action'] == name or (name is None and action['action'] in ('call', 'check')):
+                return action, {'agent_strategy': 'cfr'}
+        return self.rng.choice(legal_actions), {'agent_strategy': 'random_fallback'}
+
+    def eval_step(self, state):
+        return self.step(state)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    trainer = LeducCFRTrainer()
+    exploitability = trainer.train(target_exploitability=1e-3)
+    trainer.save(DEFAULT_STRATEGY_PATH)
+    print(f"Saved the average strategy of {trainer.iterations} iterations to {DEFAULT_STRATEGY_PATH}, "
+          f"exploitability {exploitability:.6f} chips per game")
+
+    # decision latency of the table lookup
+    agent = LeducHoldemCFRAgent(DEFAULT_STRATEGY_PATH, seed=0)
+    state = {
+        'common': {'current_player': 1, 'round': 2, 'num_raises': 1,
+                   'faceup_cards': {'public_card': {'rank': 'Q'}}},
+        'players': [{'public': {'total_pot_contribution': 8, 'round_pot_contribution': 4}, 'facedown_cards': {}},
+                    {'public': {'total_pot_contribution': 4, 'round_pot_contribution': 0},
+                     'facedown_cards': {'hand': [{'rank': 'K'}]}}],
+        'legal_actions': [{'action': 'fold'}, {'action': 'call'}, {'action': 'raise'}],
+    }
+    start = time.perf_counter()
+    for _ in range(100000):
+        agent.step(state)
+    print(f"Decision latency: {(time.perf_counter() - start) * 10:.2f} us")
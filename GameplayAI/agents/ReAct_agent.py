@@ -1,9 +1,8 @@
-from retrying import retry
 import json
 
 from GameEngine.utils.base_agents import BaseAgent
 from GameEngine.utils.base_message import observation_to_str
-from Utils.LLMHandler import LLMHandler
+from Utils.LLMHandler import LLMHandler, StopAfterBlock, reask
 
 REACT_PROMPT = """
 You are a player in a card game. Please do your best to beat the other players and win the game.
@@ -57,7 +56,7 @@ class ReActAgent(BaseAgent):
         else:
             self.llm_handler = LLMHandler()
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def eval_step(self, state):
         observation_str = observation_to_str(state)
 
@@ -66,9 +65,13 @@ class ReActAgent(BaseAgent):
         format_assertion = False
         range_assertion = False
 
+        # an invalid answer is asked again, not read from the cache
+        retried = False
         while not (format_assertion and range_assertion):
             prompt = REACT_PROMPT.replace("{game_description}", self.game_description).replace("{observation}", observation_str).replace("{actions}", actions_str)
-            response = self.llm_handler.chat(prompt)
+            response = self.llm_handler.chat(prompt, use_cache=not retried, caller='agent_action',
+                                             stop_when=StopAfterBlock('json'))
+            retried = True
             json_str = self.parse_action(response)
             format_assertion = self.format_assertion(json_str, ['action'])
             if not format_assertion:
@@ -1,10 +1,9 @@
-from retrying import retry
 import os
 import json
 
 from GameEngine.utils.base_agents import BaseAgent
 from GameEngine.utils.base_message import observation_to_str
-from Utils.LLMHandler import LLMHandler
+from Utils.LLMHandler import LLMHandler, StopAfterBlock, reask
 
 REFLEXION_PROMPT = """
 You are a player in a card game. Please do your best to beat the other players and win the game.
@@ -97,7 +96,7 @@ class ReflexionAgent(BaseAgent):
             self.reflection = ""
 
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def eval_step(self, state):
         observation_str = observation_to_str(state)
         actions_str = "\n".join([f"{i}: {action}" for i, action in enumerate(state['legal_actions'])])
@@ -105,9 +104,13 @@ class ReflexionAgent(BaseAgent):
         format_assertion = False
         range_assertion = False
 
+        # an invalid answer is asked again, not read from the cache
+        retried = False
         while not (format_assertion and range_assertion):
             prompt = REFLEXION_PROMPT.replace("{game_description}", self.game_description).replace("{observation}", observation_str).replace("{actions}", actions_str).replace("{reflection}", self.reflection)
-            response = self.llm_handler.chat(prompt)
+            response = self.llm_handler.chat(prompt, use_cache=not retried, caller='agent_action',
+                                             stop_when=StopAfterBlock('json'))
+            retried = True
             json_str = self.parse_action(response)
             format_assertion = self.format_assertion(json_str, ['action'])
             if not format_assertion:
@@ -122,13 +125,15 @@ class ReflexionAgent(BaseAgent):
     def step(self, state):
         return self.eval_step(state)
     
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def reflect(self, payoffs, idx):
         format_assertion = False
+        retried = False
         while not format_assertion:
 
             prompt = REFLECTION.replace("{game_description}", self.game_description).replace("{payoffs}", ", ".join(map(str, payoffs))).replace("{idx}", str(idx)).replace("{reflection}", self.reflection)
-            response = self.llm_handler.chat(prompt)
+            response = self.llm_handler.chat(prompt, use_cache=not retried, caller='reflect')
+            retried = True
             json_str = self.parse_action(response)
             format_assertion = self.format_assertion(json_str, ['reflection']) 
         self.reflection = json.loads(json_str)['reflection']
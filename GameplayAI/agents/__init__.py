@@ -4,5 +4,7 @@ from GameplayAI.agents.Reflexion_agent import ReflexionAgent
 from GameplayAI.agents.Belief_agent import BeliefAgent
 from GameplayAI.agents.Uno_rule_agent import UnoRuleAgent
 from GameplayAI.agents.Leduc_holdem_rule import LeducHoldemRuleAgent
+from GameplayAI.agents.Leduc_holdem_cfr import LeducHoldemCFRAgent
 from GameplayAI.agents.Gin_rummy_rule import GinRummyRuleAgent
-from GameplayAI.agents.Heuristic_ensemble_agent import HeuristicEnsembleAgent
\ No newline at end of file
+from GameplayAI.agents.Heuristic_ensemble_agent import HeuristicEnsembleAgent
+from GameplayAI.agents.ISMCTS_agent import ISMCTSAgent
\ No newline at end of file
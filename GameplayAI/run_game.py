@@ -7,7 +7,7 @@ from typing import Union
 from pathlib import Path
 from GameEngine.utils.base_agents import BaseAgent, RandomAgent, HumanAgent
 from GameplayAI.agents import (CoTAgent, ReActAgent, ReflexionAgent,  
-    UnoRuleAgent, LeducHoldemRuleAgent, GinRummyRuleAgent)
+    UnoRuleAgent, LeducHoldemRuleAgent, LeducHoldemCFRAgent, GinRummyRuleAgent, ISMCTSAgent)
 
 from GameEngine.utils.game_run import make_env, tournament
 from GameEngine.utils.base_message import observation_to_str, history_to_str
@@ -84,7 +84,7 @@ if '__main__' == __name__:
         type=str,
         default='RandomAgent',
         choices=['RandomAgent', 'CoTAgent', 'ReActAgent', 'ReflexionAgent', 
-                 'HEAgent', 'RuleAgent', 'HEA-NoOpt', 'HEA-NoEns'],
+                 'HEAgent', 'RuleAgent', 'HEA-NoOpt', 'HEA-NoEns', 'ISMCTSAgent', 'CFRAgent'],
         help='Name of the defense agent',
         required=True
     )
@@ -93,17 +93,23 @@ if '__main__' == __name__:
         type=str, 
         default='HumanAgent',
         choices=['RandomAgent', 'HumanAgent', 'HEAgent', 'HEA-NoOpt', 'HEA-NoEns', 
-                 'CoTAgent', 'ReActAgent', 'ReflexionAgent', 'RuleAgent'],
+                 'CoTAgent', 'ReActAgent', 'ReflexionAgent', 'RuleAgent', 'ISMCTSAgent', 'CFRAgent'],
         help='Name of the attack agent',
         required=True
     )
     parser.add_argument('--llm_model', type=str, default='gpt-4o-mini', help='LLM choice', required=False)
+    parser.add_argument('--llm_cache', type=str, default=None, help='Path of a sqlite database caching the LLM responses', required=False)
+    parser.add_argument('--llm_routes', type=str, default=None, help='YAML file mapping call sites (e.g. agent_action) to models', required=False)
     parser.add_argument('--run_num', type=int, default=1, help='Run rounds', required=False)
     parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducibility', required=False)
     parser.add_argument('--log', action='store_true', help='Whether to save the game log', required=False)
     parser.add_argument('--log_path', type=str, default=None, help='Path to save the game log, default to game_play_<timestamp>.log', required=False)
     parser.add_argument('--training', action='store_true', help='Whether to enable training mode', required=False)
     parser.add_argument('--output_csv', type=str, default=None, help='Append game results to csv file', required=False)
+    parser.add_argument('--mcts_iterations', type=int, default=200, help='ISMCTS iterations per decision and per worker', required=False)
+    parser.add_argument('--mcts_time_budget', type=float, default=None, help='ISMCTS seconds per decision', required=False)
+    parser.add_argument('--mcts_workers', type=int, default=1, help='ISMCTS worker processes (root parallelization)', required=False)
+    parser.add_argument('--mcts_rollout', type=str, default='RandomAgent', choices=['RandomAgent', 'HEAgent'], help='ISMCTS rollout policy', required=False)
     
     args = parser.parse_args()
 
@@ -132,10 +138,18 @@ if '__main__' == __name__:
     game_dir_path = os.path.join(folder_path, game_name)
 
     # prepare LLM-based agents
-    llm_handler = LLMHandler(llm_model) 
+    llm_handler = LLMHandler(llm_model, cache=args.llm_cache, routes=args.llm_routes)
     with open(game_description_path, 'r', encoding='utf-8') as f:
         game_description = f.read()
 
+    def make_ismcts_agent() -> ISMCTSAgent:
+        rollout_agent = load_agent(game_dir_path, method='ours') if args.mcts_rollout == 'HEAgent' else None
+        if isinstance(rollout_agent, RandomAgent):
+            rollout_agent = None
+        return ISMCTSAgent(game_code_path, rollout_agent=rollout_agent, 
+                           iterations=args.mcts_iterations, time_budget=args.mcts_time_budget, 
+                           num_workers=args.mcts_workers, seed=seed)
+
     # Configure attack agent
     if attack_agent_name == 'HumanAgent':
         hint_agent = load_agent(game_dir_path, method='ours')
@@ -163,6 +177,13 @@ if '__main__' == __name__:
             attack_agent = LeducHoldemRuleAgent()
         else:
             raise ValueError(f"Rule agent not implemented for game: {game_name}")
+    elif attack_agent_name == 'ISMCTSAgent':
+        attack_agent = make_ismcts_agent()
+    elif attack_agent_name == 'CFRAgent':
+        if game_name == 'leduc_holdem':
+            attack_agent = LeducHoldemCFRAgent(seed=seed)
+        else:
+            raise ValueError(f"CFR agent not implemented for game: {game_name}")
     else:
         attack_agent = RandomAgent()
         
@@ -188,6 +209,13 @@ if '__main__' == __name__:
             defense_agent = LeducHoldemRuleAgent()
         else:
             raise ValueError(f"Rule agent not implemented for game: {game_name}")
+    elif defense_agent_name == 'ISMCTSAgent':
+        defense_agent = make_ismcts_agent()
+    elif defense_agent_name == 'CFRAgent':
+        if game_name == 'leduc_holdem':
+            defense_agent = LeducHoldemCFRAgent(seed=seed)
+        else:
+            raise ValueError(f"CFR agent not implemented for game: {game_name}")
     else:
         defense_agent = RandomAgent()
 
@@ -21,6 +21,6 @@ def extract_action_from_desc(
     chat_seq = ChatSequence()
     chat_seq.append(Message("system", system_prompt))
     chat_seq.append(Message("user", desc))
-    actions = llm_handler.chat(chat_seq)
+    actions = llm_handler.chat(chat_seq, caller='action_desc')
     actions = extract_from_language(actions, 'markdown')
     return actions
\ No newline at end of file
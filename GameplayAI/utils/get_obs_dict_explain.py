@@ -1,7 +1,6 @@
-from Utils.LLMHandler import LLMHandler
+from Utils.LLMHandler import LLMHandler, reask
 import json
 from GameplayAI.utils.extract import extract_from_language
-from retrying import retry
 from GameEngine.utils.game_run import make_env
 from GameEngine.utils.base_agents import RandomAgent
 from typing import Any
@@ -32,7 +31,7 @@ Example Output:
 ```
 """
 
-@retry(stop_max_attempt_number=3)
+@reask(stop_max_attempt_number=3)
 def explain_obs_dict(game_code: str, state: dict, llm_handler: LLMHandler) -> dict:
     """
     Explain the meaning of a game state dictionary
@@ -40,7 +39,7 @@ def explain_obs_dict(game_code: str, state: dict, llm_handler: LLMHandler) -> di
     prompt = dict_explain_prompt.replace("{code_placeholder}", game_code) \
         .replace("{state_placeholder}", json.dumps(state, indent=4, cls=LLMGameStateEncoder))
     # print(prompt)
-    result = llm_handler.chat(prompt)
+    result = llm_handler.chat(prompt, caller='explain_obs')
     json_result = extract_from_language(result, 'json')
     return json.loads(json_result)
 
@@ -1,7 +1,6 @@
-from Utils.LLMHandler import LLMHandler, ChatSequence, Message
+from Utils.LLMHandler import LLMHandler, ChatSequence, Message, reask
 from typing import List, Tuple
 import json
-from retrying import retry
 from GameplayAI.utils.extract import extract_from_language
 
 
@@ -24,14 +23,14 @@ user_prompt = """
 {code}
 """
 
-@retry(wait_fixed=2000, stop_max_attempt_number=3)
+@reask(wait_fixed=2000, stop_max_attempt_number=3)
 def max_or_min(
         desc: str, code:str, llm_handler: LLMHandler
         ) -> bool:
     chat_seq = ChatSequence()
     chat_seq.append(Message("system", system_prompt))
     chat_seq.append(Message("user", user_prompt.replace("{code}", code)))
-    actions = llm_handler.chat(chat_seq)
+    actions = llm_handler.chat(chat_seq, caller='max_or_min')
     actions = extract_from_language(actions, 'json')
     actions = json.loads(actions)
     is_max = actions["maximize"]
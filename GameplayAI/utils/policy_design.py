@@ -1,10 +1,10 @@
 from pydantic import BaseModel
 import logging
 import json
-from retrying import retry
 from typing import Literal
 
-from Utils.LLMHandler import LLMHandler, ChatSequence, Message
+from Utils.LLMHandler import LLMHandler, ChatSequence, Message, StopAfterBlock, reask
+from Utils.LLMUsage import bind_usage_context
 from GameplayAI.utils.extract import extract_from_language
 from GameplayAI.utils.get_action_desc import extract_action_from_desc
 import threading
@@ -163,9 +163,9 @@ class LLMPolicy:
 
         # design strategies and metrics in parallel
         logger.info("designing strategies and metrics...")
-        singular_thread = threading.Thread(target=self.design_singlular_strategy)
-        strategy_thread = threading.Thread(target=self.design_strategy)
-        metric_thread = threading.Thread(target=self.design_metric)
+        singular_thread = threading.Thread(target=bind_usage_context(self.design_singlular_strategy))
+        strategy_thread = threading.Thread(target=bind_usage_context(self.design_strategy))
+        metric_thread = threading.Thread(target=bind_usage_context(self.design_metric))
         singular_thread.start()
         strategy_thread.start()
         metric_thread.start()
@@ -199,7 +199,7 @@ class LLMPolicy:
             result.append("\n".join(concat))
         return result
     
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def design_singlular_strategy(self) -> Strategy:
         singular_strategy_prompt = singular_strategy_template.replace("{game_description}", self.game_description)\
             .replace("{game_actions}", self.game_actions)\
@@ -217,7 +217,7 @@ class LLMPolicy:
             raise e
         return self.singular_strategy
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def design_strategy(self) -> Strategies:
         strategy_prompt = strategy_template.replace("{game_description}", self.game_description)\
             .replace("{game_actions}", self.game_actions)\
@@ -236,7 +236,7 @@ class LLMPolicy:
             raise e
         return self.strategies
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def design_metric(self) -> Metrics:
         metric_prompt = metric_template.replace("{game_description}", self.game_description)\
             .replace("{game_actions}", self.game_actions)\
@@ -255,7 +255,7 @@ class LLMPolicy:
             raise e
         return self.metrics
 
-    @retry(stop_max_attempt_number=5)
+    @reask(stop_max_attempt_number=5)
     def reflect_strategy(self, game_strategy: Strategy, game_metrics: Metrics) -> Reflection:
         reflection_prompt = reflection_template.replace("{game_description}", self.game_description)\
             .replace("{game_actions}", self.game_actions)\
@@ -274,9 +274,9 @@ class LLMPolicy:
             # print(result_json)
             raise e
     
-    @retry(stop_max_attempt_number=3)
+    @reask(stop_max_attempt_number=3)
     def chat_and_parse_json(self, chat_seq: ChatSequence) -> dict:
-        result = self.llm.chat(chat_seq)
+        result = self.llm.chat(chat_seq, caller='policy', stop_when=StopAfterBlock('json'))
         result_json = extract_from_language(result, 'json')
         return result_json
 
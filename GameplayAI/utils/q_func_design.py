@@ -2,9 +2,8 @@ import traceback
 import logging
 import json
 from typing import Union, Tuple
-from retrying import retry
 
-from Utils.LLMHandler import LLMHandler, ChatSequence, Message
+from Utils.LLMHandler import LLMHandler, ChatSequence, Message, reask
 from GameEngine.env import LLMGameStateEncoder
 
 general_system_message = "You are an action-value engineer trying to write action-value functions in python. Your goal is to write an action-value function that will help the agent decide actions in a card game."
@@ -141,7 +140,7 @@ class LLMQFunc:
     def deactivate(self):
         self.active = False
     
-    @retry(stop_max_attempt_number=3)
+    @reask(stop_max_attempt_number=3)
     def create_code(self):
         logger.info("Generating code for the feature...")
         if self.llm_handler is None:
@@ -155,12 +154,12 @@ class LLMQFunc:
         chat_seq = ChatSequence()
         chat_seq.append(Message(role="system", content=general_system_message))
         chat_seq.append(Message(role="user", content=prompt))
-        result1 = llm_handler.chat(chat_seq)
+        result1 = llm_handler.chat(chat_seq, caller='qfunc_create')
 
         # refine the code 
         chat_seq.append(Message(role="assistant", content=result1))
         chat_seq.append(Message(role="user", content=func_refine_template))
-        result2 = llm_handler.chat(chat_seq)
+        result2 = llm_handler.chat(chat_seq, caller='qfunc_refine')
 
         # remove delimiters from the result
         code1 = self._sanitize_output(result1)
@@ -184,7 +183,7 @@ class LLMQFunc:
         except ValueError:
             return ""
 
-    @retry(stop_max_attempt_number=3)
+    @reask(stop_max_attempt_number=3)
     def score(self, state: dict, action: str) -> float:
         if self.code is None:
             raise Exception("No code generated")
@@ -245,7 +244,7 @@ class LLMQFunc:
             error_traceback = traceback.format_exc()
             return None, error_traceback
         
-    @retry(stop_max_attempt_number=3)
+    @reask(stop_max_attempt_number=3)
     def fix_bug(self, state: dict, action: dict, error_message: str) -> str:
         if self.llm_handler is None:
             self.llm_handler = LLMHandler()
@@ -260,7 +259,7 @@ class LLMQFunc:
         chat_seq = ChatSequence()
         chat_seq.append(Message(role="system", content=general_system_message))
         chat_seq.append(Message(role="user", content=bug_fix_prompt))
-        result = llm_handler.chat(chat_seq)
+        result = llm_handler.chat(chat_seq, caller='qfunc_fix')
         code = self._sanitize_output(result)
         if code == "":
             raise Exception("No code is received")
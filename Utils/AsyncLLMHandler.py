@@ -0,0 +1,95 @@
+"""
+Concurrent LLM requests on top of LLMHandler.
+
+The requests run in worker threads with the synchronous LLMHandler, so they share its
+cache, logging, token counting and the per provider and model rate limits (see LLMRateLimit).
+A semaphore shared by all AsyncLLMHandlers bounds the number of requests in flight.
+
+Usage:
+    handler = AsyncLLMHandler(LLMHandler("gpt-4o-mini"))
+    # in async code
+    answer = await handler.chat("Hello")
+    answers = await handler.chat_many(["Hello", "Bonjour"])
+    # in sync code
+    answers = handler.chat_many_sync(["Hello", "Bonjour"])
+"""
+from __future__ import annotations
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+from Utils.LLMHandler import LLMHandler, ChatSequence
+from Utils.LLMCache import bind_cache_context
+from Utils.LLMUsage import bind_usage_context
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+_shared_semaphore = threading.BoundedSemaphore(DEFAULT_MAX_CONCURRENCY)
+_shared_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+
+
+def _get_shared_executor() -> ThreadPoolExecutor:
+    global _shared_executor
+    with _executor_lock:
+        if _shared_executor is None:
+            _shared_executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_CONCURRENCY, thread_name_prefix="llm")
+        return _shared_executor
+
+
+class AsyncLLMHandler:
+    """
+    Args:
+        llm_handler: the handler sending the requests, a new LLMHandler(**handler_kwargs) if None
+        max_concurrency: requests in flight of this handler, sharing the process-wide
+            limit of DEFAULT_MAX_CONCURRENCY requests if None
+    """
+
+    def __init__(self, llm_handler: LLMHandler = None, max_concurrency: int = None, **handler_kwargs):
+        self.llm_handler = llm_handler if llm_handler is not None else LLMHandler(**handler_kwargs)
+        if max_concurrency is None:
+            self.semaphore = _shared_semaphore
+            self.executor = _get_shared_executor()
+        else:
+            self.semaphore = threading.BoundedSemaphore(max_concurrency)
+            self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+
+    def _chat_bounded(self, messages, model, kwargs) -> str:
+        with self.semaphore:
+            return self.llm_handler.chat(messages, model=model, **kwargs)
+
+    async def chat(self, messages: Union[ChatSequence, list[dict], str], model: str = None, **kwargs) -> str:
+        loop = asyncio.get_running_loop()
+        # the worker thread tags and caches the request like the caller
+        chat = bind_usage_context(bind_cache_context(self._chat_bounded))
+        return await loop.run_in_executor(self.executor, functools.partial(chat, messages, model, kwargs))
+
+    async def chat_many(self, messages_list: List[Union[ChatSequence, list[dict], str]],
+                        model: str = None, return_exceptions: bool = False, **kwargs) -> List[str]:
+        """
+        Send the requests concurrently and return the responses in order.
+        With `return_exceptions`, a failed request gives its exception instead of raising.
+        """
+        return await asyncio.gather(
+            *[self.chat(messages, model=model, **kwargs) for messages in messages_list],
+            return_exceptions=return_exceptions)
+
+    def chat_sync(self, messages: Union[ChatSequence, list[dict], str], model: str = None, **kwargs) -> str:
+        return self._chat_bounded(messages, model, kwargs)
+
+    def chat_many_sync(self, messages_list: List[Union[ChatSequence, list[dict], str]],
+                       model: str = None, return_exceptions: bool = False, **kwargs) -> List[str]:
+        """Sync facade of chat_many, usable with or without a running event loop."""
+        coroutine = self.chat_many(messages_list, model=model, return_exceptions=return_exceptions, **kwargs)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        # called from async code, run the requests in their own loop
+        with ThreadPoolExecutor(max_workers=1) as runner:
+            return runner.submit(asyncio.run, coroutine).result()
+
+    def get_usage(self):
+        return self.llm_handler.get_usage()
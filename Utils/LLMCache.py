@@ -0,0 +1,178 @@
+"""
+A disk-backed, content-addressed cache of LLM responses.
+
+Responses are stored in a sqlite database keyed by a hash of the request
+(model, messages and sampling kwargs), so a repeated request, e.g. when a run of
+the pipeline is resumed or a game is re-evaluated, is answered from disk.
+The database can be shared by processes; entries expire after `ttl` seconds and the
+least recently used entries are evicted beyond `max_entries`.
+
+Requests whose answer shall be sampled again (re-asking after an invalid answer, or
+several candidates from the same prompt) skip the lookup with `cache_bypass()`
+or tell the candidates apart with `cache_namespace()`.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+_local = threading.local()
+
+
+@contextmanager
+def cache_bypass():
+    """
+    Requests made in this context are sent to the LLM even when cached.
+    The new responses still replace the cached ones.
+    """
+    previous = getattr(_local, 'bypass', False)
+    _local.bypass = True
+    try:
+        yield
+    finally:
+        _local.bypass = previous
+
+
+def is_cache_bypassed() -> bool:
+    return getattr(_local, 'bypass', False)
+
+
+@contextmanager
+def cache_namespace(name: str):
+    """
+    Requests made in this context are cached apart from identical requests made
+    outside of it, e.g. one namespace per trial of the pipeline.
+    Namespaces can be nested.
+    """
+    previous = getattr(_local, 'namespace', '')
+    _local.namespace = f"{previous}/{name}" if previous else str(name)
+    try:
+        yield
+    finally:
+        _local.namespace = previous
+
+
+def get_cache_namespace() -> str:
+    return getattr(_local, 'namespace', '')
+
+
+def bind_cache_context(func):
+    """Wrap func to run with the current cache namespace and bypass, e.g. in another thread."""
+    namespace, bypass = get_cache_namespace(), is_cache_bypassed()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = (get_cache_namespace(), is_cache_bypassed())
+        _local.namespace, _local.bypass = namespace, bypass
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.namespace, _local.bypass = previous
+    return wrapper
+
+
+class LLMCache:
+    """
+    Args:
+        path: path of the sqlite database, created if not exists
+        ttl: seconds before an entry expires, never if None
+        max_entries: the least recently used entries are evicted beyond this number
+    """
+
+    def __init__(self, path: str = 'llm_cache.sqlite', ttl: float = None, max_entries: int = 100000):
+        assert max_entries is None or max_entries > 0, "max_entries must be positive"
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, accessed REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def make_key(model: str, messages: list[dict], kwargs: Dict = None, namespace: str = '') -> str:
+        request = {
+            "model": model,
+            "messages": messages,
+            "kwargs": kwargs or {},
+            "namespace": namespace,
+        }
+        data = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now))
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed LIMIT ?)", (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+        }
+
+    def close(self):
+        self._conn.close()
+
+    def __getstate__(self):
+        # the connection is reopened in the new process
+        state = self.__dict__.copy()
+        del state['_conn'], state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
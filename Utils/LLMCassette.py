@@ -0,0 +1,119 @@
+"""
+Record and replay of LLM requests.
+
+A cassette is a JSONL file of request/response pairs (chat completions and embeddings).
+In 'record' mode every live response is appended to it; in 'replay' mode responses are
+served from it without any network access, so runs of the pipeline or of the agent
+creation can be benchmarked offline and reproducibly. Identical requests replay their
+recorded responses in order, e.g. when an invalid answer was asked again.
+
+Usage:
+    handler.use_cassette('data/cassettes/uno.jsonl', mode='record')   # live run
+    handler.use_cassette('data/cassettes/uno.jsonl', mode='replay')   # offline run
+
+The stub server (Utils.LLMStubServer) can also serve a cassette to any client
+pointed at it with `server_address`.
+"""
+from __future__ import annotations
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Literal, Optional
+
+CassetteMode = Literal["record", "replay", "auto"]
+
+# request fields that do not change the answer
+_IGNORED_KWARGS = ("stream", "stream_options", "stop_when")
+
+
+class CassetteMissError(KeyError):
+    """The request was not recorded in the cassette."""
+
+
+def chat_request_key(model: str, messages: List[Dict], kwargs: Dict = None) -> str:
+    kwargs = {k: v for k, v in (kwargs or {}).items() if k not in _IGNORED_KWARGS}
+    data = json.dumps({"model": model, "messages": messages, "kwargs": kwargs},
+                      sort_keys=True, ensure_ascii=False, default=str)
+    return "chat-" + hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def embedding_request_key(model: str, texts: List[str]) -> str:
+    data = json.dumps({"model": model, "input": texts}, ensure_ascii=False)
+    return "embedding-" + hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Args:
+        path: the JSONL file
+        mode: 'record' appends live responses, 'replay' serves recorded responses and raises
+            CassetteMissError for others, 'auto' replays when recorded and records otherwise
+    """
+
+    def __init__(self, path: str, mode: CassetteMode = "replay"):
+        assert mode in ("record", "replay", "auto"), f"Unknown cassette mode: {mode}"
+        self.path = path
+        self.mode = mode
+        self.entries: Dict[str, List[Dict]] = {}
+        self.positions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if mode != "record" and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.setdefault(entry["key"], []).append(entry)
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette not found: {path}")
+
+        folder = os.path.dirname(path)
+        if mode != "replay" and folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode in ("replay", "auto")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode in ("record", "auto")
+
+    def play(self, key: str) -> Optional[Dict]:
+        """
+        The next recorded entry of the request, the last one again when all were played.
+        None when the request was not recorded and the cassette can record it,
+        CassetteMissError in 'replay' mode.
+        """
+        with self._lock:
+            entries = self.entries.get(key)
+            if not entries:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise CassetteMissError(f"Request {key} is not in the cassette {self.path}")
+                return None
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            self.hits += 1
+            return entries[min(position, len(entries) - 1)]
+
+    def record(self, key: str, request: Dict, response, **fields):
+        """Append a live response, `fields` keep e.g. the token usage and latency."""
+        entry = {"key": key, "request": request, "response": response, **fields}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self.entries.setdefault(key, []).append(entry)
+            # the played position moves past the new entry, like a replay of this run would
+            self.positions[key] = len(self.entries[key])
+            # a single write per entry, appends of other processes are not interleaved
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "cassette_hits": self.hits,
+            "cassette_misses": self.misses,
+        }
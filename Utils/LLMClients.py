@@ -0,0 +1,115 @@
+"""
+Process-wide registry of LLM clients and HTTP sessions.
+
+Clients are keyed by base URL and API key, so every LLMHandler talking to the same
+endpoint shares one client and its pool of keep-alive connections instead of opening
+new connections. The registry is per process: a forked worker builds its own clients
+rather than sharing sockets with its parent.
+"""
+from __future__ import annotations
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_MAXSIZE = 32  # keep-alive connections per host
+
+_clients: Dict[Tuple, Any] = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(key: Tuple, factory):
+    key = (os.getpid(),) + key
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+        return client
+
+
+def get_http_session(base_url: str) -> requests.Session:
+    """A requests session with a pool of keep-alive connections to the base URL."""
+    def factory():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    return _get_or_create(("session", base_url), factory)
+
+
+def get_openai_client(api_key: str, base_url: str = None):
+    """A shared OpenAI client, the requests are retried by the handler's retry policy."""
+    def factory():
+        from openai import OpenAI
+        return OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    return _get_or_create(("openai", base_url, api_key), factory)
+
+
+def get_anthropic_client(api_key: str):
+    """A shared Anthropic client, raises ImportError if anthropic is not installed."""
+    def factory():
+        from anthropic import Anthropic
+        return Anthropic(api_key=api_key, max_retries=0)
+    return _get_or_create(("anthropic", None, api_key), factory)
+
+
+def clear_clients():
+    """Close and forget the clients of this process."""
+    with _lock:
+        for key in [key for key in _clients if key[0] == os.getpid()]:
+            client = _clients.pop(key)
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+if __name__ == "__main__":
+    # Benchmark: per-request latency of fresh clients vs. shared pooled clients against the local stub server
+    import time
+    from openai import OpenAI
+    from Utils.LLMStubServer import StubLLMServer
+    from Utils.LLMHandler import LLMHandler
+
+    num_requests = 200
+    with StubLLMServer() as server:
+        messages = [{"role": "user", "content": "Hello"}]
+        texts = ["def get_legal_actions(game_state): pass"]
+
+        start = time.perf_counter()
+        for _ in range(num_requests):
+            OpenAI(api_key="no-key-needed", base_url=server.url, max_retries=0)\
+                .chat.completions.create(model="stub", messages=messages)
+        fresh_chat = (time.perf_counter() - start) / num_requests
+
+        start = time.perf_counter()
+        for _ in range(num_requests):
+            requests.post(server.url + "/embeddings", json={"input": texts, "model": "stub"}, timeout=30)
+        fresh_embed = (time.perf_counter() - start) / num_requests
+
+        start = time.perf_counter()
+        for _ in range(num_requests):
+            LLMHandler("gpt-4o-mini", server_address=server.url).chat(messages)
+        shared_chat = (time.perf_counter() - start) / num_requests
+
+        session = get_http_session(server.url)
+        start = time.perf_counter()
+        for _ in range(num_requests):
+            session.post(server.url + "/embeddings", json={"input": texts, "model": "stub"}, timeout=30)
+        pooled_embed = (time.perf_counter() - start) / num_requests
+
+        handler = LLMHandler("gpt-4o-mini", server_address=server.url)
+        start = time.perf_counter()
+        for _ in range(num_requests):
+            handler.get_text_embeddings_multi(texts)
+        shared_embed = (time.perf_counter() - start) / num_requests
+
+    print(f"chat, new client per request:       {fresh_chat * 1000:.2f} ms")
+    print(f"chat, new handler, shared client:   {shared_chat * 1000:.2f} ms")
+    print(f"embeddings, requests.post:          {fresh_embed * 1000:.2f} ms")
+    print(f"embeddings, pooled session:         {pooled_embed * 1000:.2f} ms")
+    print(f"embeddings, handler:                {shared_embed * 1000:.2f} ms")
@@ -1,13 +1,27 @@
 from __future__ import annotations
 import os
-from retrying import retry
-from openai import OpenAI
 from dataclasses import dataclass, field
-from typing import Literal, TypedDict, Union
+from typing import Callable, Literal, Optional, TypedDict, Union
 import requests
 from urllib.parse import urljoin
 import re
 import json
+import time
+import random
+import logging
+import threading
+import functools
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from Utils.LLMCache import LLMCache, cache_bypass, is_cache_bypassed, get_cache_namespace
+from Utils.LLMRateLimit import get_rate_limiter
+from Utils.LLMUsage import UsageLedger
+from Utils.LLMSingleFlight import SingleFlight
+from Utils.LLMClients import get_openai_client, get_anthropic_client, get_http_session
+from Utils.LLMLogWriter import get_log_writer
+from Utils.LLMRouting import ModelRouter
+from Utils.LLMCassette import Cassette, CassetteMode, chat_request_key, embedding_request_key
 
 MessageRole = Literal["system", "user", "assistant"]
 
@@ -74,26 +88,322 @@ def get_api_key(key_name: str) -> str:
             raise KeyError(f"{key_name} not found in environment or .env file")
     return api_key
 
+
+def get_provider(llm_model: str, server_address: str = None) -> str:
+    """
+    Get the provider serving the model: server, openai, openrouter, deepseek or anthropic.
+    """
+    if server_address is not None:
+        return "server"
+    if llm_model.startswith("gpt") or "o1" in llm_model:
+        return "openai"
+    if llm_model.startswith("qwen") or "gemini" in llm_model:
+        return "openrouter"
+    if llm_model.startswith("deepseek"):
+        return "deepseek"
+    if llm_model.startswith("claude"):
+        return "anthropic"
+    raise ValueError(f"Unsupported model: {llm_model}")
+
+
+"""
+Retry policy of the requests to the LLM providers.
+
+Every request goes through one RetryPolicy: transient errors (rate limits, timeouts,
+connection errors, 5xx) are retried with exponential backoff and full jitter, waiting
+at least as long as the provider asks in its rate-limit headers. Other errors, e.g. an
+invalid request or a wrong key, fail immediately. A circuit breaker per provider fails
+fast during outages. The SDK clients do not retry on their own, so a request is sent at
+most `max_attempts` times, and callers re-asking for a better answer (see `reask`) do
+not retry failed requests again.
+"""
+
+
+class LLMRequestError(Exception):
+    """A request to the LLM provider failed for good. The provider error is the __cause__."""
+
+
+class CircuitOpenError(LLMRequestError):
+    """The provider failed repeatedly, requests fail fast until the circuit closes."""
+
+
+class LLMResponseError(Exception):
+    """The provider answered without a usable response, e.g. without choices."""
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524, 529}
+RETRYABLE_ERROR_NAMES = {'APIConnectionError', 'APITimeoutError', 'InternalServerError', 'RateLimitError'}
+
+
+def _status_code(err: Exception) -> int:
+    status_code = getattr(err, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(err, 'response', None), 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(err: Exception) -> bool:
+    """Whether the error is transient, i.e. the same request may succeed later."""
+    if isinstance(err, LLMRequestError):
+        return False
+    status_code = _status_code(err)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(err, (LLMResponseError, TimeoutError, ConnectionError,
+                        requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(err).__mro__)
+
+
+def _parse_duration(value: str) -> float:
+    """Parse durations like '1.5', '250ms', '6s' or '1m30s' into seconds."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _parse_time(value: str) -> float:
+    """Parse an HTTP or RFC 3339 date into seconds from now."""
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_after(err: Exception) -> float:
+    """Seconds the provider asks to wait before retrying, from the response headers, None if not given."""
+    headers = getattr(getattr(err, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    headers = {str(k).lower(): str(v) for k, v in headers.items()}
+    if 'retry-after-ms' in headers:
+        seconds = _parse_duration(headers['retry-after-ms'])
+        if seconds is not None:
+            return seconds / 1000
+    if 'retry-after' in headers:
+        seconds = _parse_duration(headers['retry-after'])
+        if seconds is None:
+            seconds = _parse_time(headers['retry-after'])
+        if seconds is not None:
+            return seconds
+    if _status_code(err) == 429:
+        # OpenAI and Anthropic report when the exhausted limit resets
+        waits = []
+        for key in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+            if key in headers:
+                waits.append(_parse_duration(headers[key]))
+        for key in ('anthropic-ratelimit-requests-reset', 'anthropic-ratelimit-tokens-reset'):
+            if key in headers:
+                waits.append(_parse_time(headers[key]))
+        waits = [wait for wait in waits if wait is not None]
+        if waits:
+            return max(waits)
+    return None
+
+
+class CircuitBreaker:
+    """
+    Open the circuit after `failure_threshold` consecutive transient failures.
+    While open, requests fail fast with CircuitOpenError. After `reset_timeout` seconds
+    one request is let through, closing the circuit if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self.probing):
+                raise CircuitOpenError(
+                    f"Circuit open after {self.failures} consecutive failures, "
+                    f"retry in {self.reset_timeout - (time.monotonic() - self.opened_at):.0f}s")
+            if state == "half-open":
+                self.probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """The circuit breaker shared by all handlers of the provider."""
+    with _circuit_breakers_lock:
+        if provider not in _circuit_breakers:
+            _circuit_breakers[provider] = CircuitBreaker()
+        return _circuit_breakers[provider]
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 1.0  # seconds before the first retry, doubled for each retry
+    max_delay: float = 30.0
+    max_retry_after: float = 120.0  # longest wait asked by the provider that is respected
+
+    def __post_init__(self):
+        # the game code reseeds the global random generator, keep it untouched
+        self._rng = random.Random()
+
+    def wait_time(self, attempt: int, err: Exception) -> float:
+        """Full jitter backoff, but not shorter than the wait asked by the provider."""
+        backoff = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        asked = retry_after(err)
+        if asked is not None:
+            return max(backoff, min(asked, self.max_retry_after))
+        return backoff
+
+    def call(self, func, circuit_breaker: CircuitBreaker = None):
+        """Call func() until it succeeds, raising LLMRequestError if it fails for good."""
+        for attempt in range(1, self.max_attempts + 1):
+            if circuit_breaker is not None:
+                circuit_breaker.before_call()
+            try:
+                result = func()
+            except Exception as err:
+                retryable = is_retryable(err)
+                if circuit_breaker is not None:
+                    if retryable:
+                        circuit_breaker.record_failure()
+                    else:
+                        # the provider is up, the request itself is wrong
+                        circuit_breaker.record_success()
+                if not retryable:
+                    raise LLMRequestError(f"LLM request failed: {err}") from err
+                if attempt == self.max_attempts:
+                    raise LLMRequestError(f"LLM request failed after {attempt} attempts: {err}") from err
+                wait = self.wait_time(attempt, err)
+                logging.warning(f"LLM request failed (attempt {attempt}/{self.max_attempts}), "
+                                f"retrying in {wait:.1f}s: {err}")
+                time.sleep(wait)
+            else:
+                if circuit_breaker is not None:
+                    circuit_breaker.record_success()
+                return result
+
+
+class StopAfterBlock:
+    """
+    Stop predicate of a streamed chat: true once the text contains a closed fenced block,
+    e.g. StopAfterBlock('json') for the first complete ```json block.
+    """
+
+    def __init__(self, language: str = ''):
+        self.language = language
+        opening = re.escape(language) if language else r'[\w+-]*'
+        self.pattern = re.compile(r'```' + opening + r'[ \t]*\n.*?\n[ \t]*```', re.DOTALL)
+
+    def __call__(self, text: str) -> bool:
+        return self.pattern.search(text) is not None
+
+    def __repr__(self) -> str:
+        # part of the cache key of the requests
+        return f"StopAfterBlock({self.language!r})"
+
+
+def stop_key(stop_when: Callable[[str], bool]) -> Optional[str]:
+    """
+    The stop predicate in the cache key of a request: its repr without memory addresses, so an
+    inline lambda or closure has the same key in every run, e.g. "<function debug.<locals>.<lambda>>".
+    A response cut by a predicate is never returned for a request without one.
+    """
+    if stop_when is None:
+        return None
+    return re.sub(r' at 0x[0-9a-fA-F]+', '', repr(stop_when))
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+# identical requests in flight are sent once, for all handlers of the process
+_single_flight = SingleFlight()
+
+
+def is_deterministic_request(kwargs: dict) -> bool:
+    """
+    Whether the request explicitly asks for greedy decoding (temperature 0, one choice), i.e. identical
+    requests may share an answer. Without a temperature the provider samples (temperature 1).
+    """
+    return kwargs.get('temperature') == 0 and kwargs.get('n', 1) == 1
+
+
 class LLMHandler:
     llm_model = None
     record_messages = False
     log_path: str
     client = None
-    prompt_token_usage = 0
-    completion_token_usage = 0
-    embedding_token_usage = 0
     clean_json = False
     unified_kwargs = {}
+    cache: LLMCache = None
+    cassette: Cassette = None
+    router: ModelRouter = None
+    retry_policy: RetryPolicy = RetryPolicy()
 
     def __init__(self, llm_model: str = "gpt-4o-2024-08-06", 
                  record_messages: bool = False, 
                  log_path: str = 'llm.log',
-                 server_address: str = None):
+                 server_address: str = None,
+                 cache: Union[LLMCache, str] = None,
+                 retry_policy: RetryPolicy = None,
+                 cassette: Cassette = None,
+                 routes: Union[ModelRouter, dict, str] = None):
         
         self.llm_model = llm_model
+        # every request is recorded, the handler may be shared by threads
+        self.usage_ledger = UsageLedger()
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
         self.record_messages = record_messages
         self.log_path = log_path
 
+        # opt-in response cache, given as an LLMCache or the path of its database
+        if isinstance(cache, str):
+            cache = LLMCache(cache)
+        self.cache = cache
+        # opt-in record/replay of the requests, see use_cassette
+        self.cassette = cassette
+        # call site to model, see set_routes
+        self.set_routes(routes)
+
         # create the folder if the log_path does not exist
         log_folder = os.path.dirname(log_path)
         if not os.path.exists(log_folder) and self.record_messages:
@@ -101,37 +411,31 @@ class LLMHandler:
 
         # if using a server, set the server address
         self.server_address = server_address
-        if server_address is not None:
+        self.provider = get_provider(llm_model, server_address)
+        if self.provider == "server":
             api_key = "no-key-needed"
             base_url = server_address
         # if the llm_model is compatible with OpenAI API, use the OpenAI API
-        elif llm_model.startswith("gpt") or "o1" in llm_model:
+        elif self.provider == "openai":
             base_url = None
             api_key = get_api_key("OPENAI_API_KEY")
-        elif llm_model.startswith("qwen") or "gemini" in llm_model:
+        elif self.provider == "openrouter":
             base_url="https://openrouter.ai/api/v1"
             api_key = get_api_key("OPENROUTER_API_KEY")
-        elif llm_model.startswith("deepseek"):
+        elif self.provider == "deepseek":
             base_url="https://api.deepseek.com"
             api_key = get_api_key("DEEPSEEK_API_KEY")
         # if using Claude
-        elif llm_model.startswith("claude"):
+        else:
             try:
-                from anthropic import Anthropic
-                self.client = Anthropic(
-                    api_key=get_api_key("ANTHROPIC_API_KEY"),
-                )
-                return self
+                self.client = get_anthropic_client(get_api_key("ANTHROPIC_API_KEY"))
             except ImportError:
                 print('Optional: Anthropic is not installed. Please install it if you want to use the Claude model.')
                 self.client = None
-        else:
-            raise ValueError(f"Unsupported model: {llm_model}")
+            return
 
-        self.client = OpenAI(
-                api_key=api_key,
-                base_url=base_url,
-            )
+        # clients are shared by the handlers of the same endpoint and key
+        self.client = get_openai_client(api_key, base_url)
         
     def clean_json_response(self, response: str) -> str:
         """
@@ -161,9 +465,24 @@ class LLMHandler:
         except json.JSONDecodeError:
             return cleaned
 
-    @retry(wait_fixed=5000, stop_max_attempt_number=3)
     def chat(self, messages: Union[ChatSequence, list[dict], str], 
-                      model=None, **kwargs) -> str:
+                      model=None, use_cache: bool = True, caller: str = None,
+                      stop_when: Callable[[str], bool] = None, **kwargs) -> str:
+        """
+        Send the messages to the LLM and return the response content.
+        With a cache enabled, a cached response of the same request is returned instead,
+        unless `use_cache` is False or in a `cache_bypass()` context, e.g. when the same
+        prompt is asked again for a different answer.
+        `caller` tags the request in the usage ledger, e.g. 'debug' or 'validate'.
+        With `stop_when`, the response is streamed and the generation is cancelled as soon as
+        `stop_when(text_so_far)` is true, e.g. StopAfterBlock('json') when only the first
+        json block is parsed. The text received so far is returned.
+        An identical request already in flight is waited for instead of sent again, if the
+        request does not bypass the cache and sets temperature=0, sampled requests are all sent.
+        Without `model`, the model routed for `caller` is used (see set_routes), else llm_model.
+        Requests bypassing the cache are re-asks, counted per call site as a quality signal.
+        Raises LLMRequestError if the request fails for good, see RetryPolicy.
+        """
         # if messages is a ChatSequence, convert it to a list of dicts
         if isinstance(messages, ChatSequence):
             messages = messages.raw()
@@ -171,12 +490,156 @@ class LLMHandler:
         if isinstance(messages, str):
             messages = [{"role": "user", "content": messages}]
 
+        # asked again, the previous answer was rejected
+        reasked = not use_cache or is_cache_bypassed()
+        if model is None and self.router is not None:
+            model = self.router.select(caller, reasked)
         if model is None:
             model = self.llm_model
 
         # save the messages to a file
         self.save_messages(messages)
 
+        content = None
+        use_cache = not reasked
+        request_kwargs = {**self.unified_kwargs, **kwargs}
+        request_key = LLMCache.make_key(
+            model, messages, {**request_kwargs, "server_address": self.server_address, "stop_when": stop_key(stop_when)},
+            namespace=get_cache_namespace())
+        if self.cache is not None and use_cache:
+            content = self.cache.get(request_key)
+            if content is not None:
+                self.usage_ledger.record(model, caller=caller, cache="hit", reasked=reasked)
+
+        if content is None:
+            def request():
+                return self.retry_policy.call(
+                    lambda: self._complete(messages, model, caller=caller, stop_when=stop_when, reasked=reasked,
+                                           cache="miss" if self.cache is not None else None, **kwargs),
+                    get_circuit_breaker(self.provider))
+
+            if use_cache and is_deterministic_request(request_kwargs):
+                content, shared = _single_flight.do(request_key, request)
+            else:
+                content, shared = request(), False
+            if shared:
+                self.usage_ledger.record(model, caller=caller, coalesced=True, reasked=reasked)
+            elif self.cache is not None:
+                self.cache.put(request_key, content, model)
+
+        if self.clean_json:
+            content = self.clean_json_response(content)
+
+        self.save_messages([{"role": "assistant", "content": content}])
+        return content
+
+    def _complete(self, messages: list[dict], model: str, caller: str = None, cache: str = None,
+                  stop_when: Callable[[str], bool] = None, reasked: bool = False, **kwargs) -> str:
+        """Request a completion from the LLM provider, record its usage and return the raw content."""
+        cassette_key = None
+        if self.cassette is not None:
+            cassette_key = chat_request_key(model, messages, {**self.unified_kwargs, **kwargs})
+            entry = self.cassette.play(cassette_key)
+            if entry is not None:
+                self.usage_ledger.record(model, caller=caller, cache=cache, reasked=reasked,
+                                         prompt_tokens=entry["prompt_tokens"],
+                                         completion_tokens=entry["completion_tokens"],
+                                         stopped_early=entry.get("stopped_early", False))
+                return entry["response"]
+
+        # wait for the rate limit shared by all handlers of the provider and model
+        rate_limiter = get_rate_limiter(self.provider, model)
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+
+        start = time.perf_counter()
+        stopped_early = False
+        try:
+            # o1 models do not stream, they answer in full
+            if stop_when is None or "o1" in model:
+                content, prompt_tokens, completion_tokens = self._request_completion(messages, model, **kwargs)
+            else:
+                content, prompt_tokens, completion_tokens, stopped_early = \
+                    self._request_streamed_completion(messages, model, stop_when, **kwargs)
+        except Exception as err:
+            self.usage_ledger.record(model, caller=caller, cache=cache, reasked=reasked,
+                                     latency=time.perf_counter() - start, error=repr(err))
+            raise
+        latency = time.perf_counter() - start
+        self.usage_ledger.record(model, caller=caller, cache=cache, latency=latency, reasked=reasked,
+                                 prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                 stopped_early=stopped_early)
+        if cassette_key is not None:
+            self.cassette.record(cassette_key, {"model": model, "messages": messages, **kwargs}, content,
+                                 prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                 stopped_early=stopped_early, latency=latency)
+        return content
+
+    def _request_streamed_completion(self, messages: list[dict], model: str,
+                                     stop_when: Callable[[str], bool], **kwargs) -> tuple[str, int, int, bool]:
+        """
+        Stream a completion until it is complete or stop_when is satisfied.
+        Return the content, prompt tokens, completion tokens and whether it stopped early.
+        Without usage in the stream (cancelled streams), the tokens are estimated.
+        """
+        parts = []
+        chunks = 0
+        stopped_early = False
+        prompt_tokens, completion_tokens = None, None
+
+        def receive(delta: str) -> bool:
+            nonlocal chunks
+            parts.append(delta)
+            chunks += 1
+            # a closing fence or any other stop condition needs a new backtick or line
+            return ('`' in delta or '\n' in delta) and stop_when(''.join(parts))
+
+        if "claude" in model:
+            with self.client.messages.stream(max_tokens=4096, messages=messages, model=model) as stream:
+                for delta in stream.text_stream:
+                    if receive(delta):
+                        stopped_early = True
+                        break
+                try:
+                    usage = stream.current_message_snapshot.usage
+                    prompt_tokens, completion_tokens = usage.input_tokens, usage.output_tokens
+                except AttributeError:
+                    pass
+        else:
+            # OpenAI reports the usage in the last chunk when asked
+            stream_kwargs = {"stream_options": {"include_usage": True}} if self.provider == "openai" else {}
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **stream_kwargs,
+                **self.unified_kwargs,
+                **kwargs
+                )
+            try:
+                for chunk in stream:
+                    if getattr(chunk, 'usage', None) is not None:
+                        prompt_tokens = chunk.usage.prompt_tokens
+                        completion_tokens = chunk.usage.completion_tokens
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    if receive(chunk.choices[0].delta.content):
+                        stopped_early = True
+                        break
+            finally:
+                # closing the connection cancels the generation
+                stream.close()
+
+        content = ''.join(parts)
+        if prompt_tokens is None:
+            prompt_tokens = sum(_estimate_tokens(str(message["content"])) for message in messages)
+        if completion_tokens is None:
+            completion_tokens = chunks
+        return content, prompt_tokens, completion_tokens, stopped_early
+
+    def _request_completion(self, messages: list[dict], model: str, **kwargs) -> tuple[str, int, int]:
+        """Return the content, prompt tokens and completion tokens of a completion."""
+        prompt_tokens, completion_tokens = 0, 0
         if "claude" in model:
             try:
                 response = self.client.messages.create(
@@ -188,9 +651,15 @@ class LLMHandler:
                 print(f'ANTHROPIC ERROR: {err}')
                 raise err
 
-            content = response.content[0].text
-            if self.clean_json:
-                content = self.clean_json_response(content)
+            try:
+                content = response.content[0].text
+            except (AttributeError, IndexError, TypeError) as err:
+                raise LLMResponseError(f"Malformed response: {response}") from err
+            try:
+                prompt_tokens = response.usage.input_tokens
+                completion_tokens = response.usage.output_tokens
+            except AttributeError:
+                pass
         else:
             try:
                 response = self.client.chat.completions.create(
@@ -199,43 +668,76 @@ class LLMHandler:
                     **self.unified_kwargs,
                     **kwargs
                     )
-                content = response.choices[0].message.content
-                if self.clean_json:
-                    content = self.clean_json_response(content)
                 try:
-                    self.prompt_token_usage += response.usage.prompt_tokens
-                    self.completion_token_usage += response.usage.completion_tokens
+                    content = response.choices[0].message.content
+                except (AttributeError, IndexError, TypeError) as err:
+                    raise LLMResponseError(f"Malformed response: {response}") from err
+                try:
+                    prompt_tokens = response.usage.prompt_tokens
+                    completion_tokens = response.usage.completion_tokens
                 except AttributeError:
                     # Handle the case where usage is not available
                     pass
             except Exception as err:
                 print(f'OPENAI ERROR: {err}')
                 raise err
-
-        self.save_messages([{"role": "assistant", "content": content}])
-        return content
+        return content, prompt_tokens or 0, completion_tokens or 0
 
     def save_messages(self, messages: list[dict]):
+        """Queue the messages for the background writer of the log, see LLMLogWriter."""
         if not self.record_messages:
             return
-        with open(self.log_path, 'a', encoding='utf-8') as f:
-            for message in messages:
-                f.write(f'{message["role"]}: ')
-                f.write(f'{message["content"]}\n')
-                f.write(f'prompt_tokens: {self.prompt_token_usage}\n')
-                f.write(f'completion_tokens: {self.completion_token_usage}\n')
-                f.write(f'embedding_tokens: {self.embedding_token_usage}\n')
-                f.write('-----------------------------------\n\n')
+        usage = (f'prompt_tokens: {self.prompt_token_usage}\n'
+                 f'completion_tokens: {self.completion_token_usage}\n'
+                 f'embedding_tokens: {self.embedding_token_usage}\n'
+                 '-----------------------------------\n\n')
+        get_log_writer(self.log_path).write(
+            "".join(f'{message["role"]}: {message["content"]}\n{usage}' for message in messages))
+
+    def flush_log(self):
+        """Block until the queued messages are written to the log."""
+        if self.record_messages:
+            get_log_writer(self.log_path).flush()
 
     def get_text_embeddings_multi(self, texts: list[str]) -> list[list[float]]:
         """
         Get the text embeddings from the server or OpenAI API.
         """
         assert all(isinstance(text, str) for text in texts)
-
+        return self.retry_policy.call(
+            lambda: self._embed(texts),
+            get_circuit_breaker(self.provider))
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        cassette_key = None
+        if self.cassette is not None:
+            cassette_key = embedding_request_key("text-embedding-3-large", texts)
+            entry = self.cassette.play(cassette_key)
+            if entry is not None:
+                self.usage_ledger.record("text-embedding-3-large", kind="embedding",
+                                         embedding_tokens=entry["embedding_tokens"])
+                return entry["response"]
+
+        start = time.perf_counter()
+        try:
+            embeddings, tokens = self._request_embeddings(texts)
+        except Exception as err:
+            self.usage_ledger.record("text-embedding-3-large", kind="embedding",
+                                     latency=time.perf_counter() - start, error=repr(err))
+            raise
+        latency = time.perf_counter() - start
+        self.usage_ledger.record("text-embedding-3-large", kind="embedding",
+                                 latency=latency, embedding_tokens=tokens)
+        if cassette_key is not None:
+            self.cassette.record(cassette_key, {"model": "text-embedding-3-large", "input": texts}, embeddings,
+                                 embedding_tokens=tokens, latency=latency)
+        return embeddings
+
+    def _request_embeddings(self, texts: list[str]) -> tuple[list[list[float]], int]:
+        """Return the embeddings and the prompt tokens."""
         if self.server_address:
             try:
-                response = requests.post(
+                response = get_http_session(self.server_address).post(
                     urljoin(self.server_address, "/v1/embeddings"),
                     json={
                         "input": texts,
@@ -245,8 +747,7 @@ class LLMHandler:
                 )
                 response.raise_for_status()
                 result = response.json()
-                self.embedding_token_usage += result.get("prompt_tokens", 0)
-                return result["embeddings"]
+                return result["embeddings"], result.get("prompt_tokens", 0)
             except requests.exceptions.RequestException as e:
                 print(f'Server Error (Embeddings): {str(e)}')
                 raise
@@ -258,23 +759,87 @@ class LLMHandler:
                 dimensions=1536,
             )
 
-            self.embedding_token_usage += response.usage.prompt_tokens
-            return [r.embedding for r in response.data]
+            return [r.embedding for r in response.data], response.usage.prompt_tokens
     
     def get_text_embeddings(self, text: str) -> list[float]:
         return self.get_text_embeddings_multi([text])[0]
     
-    def get_usage(self):
+    @property
+    def prompt_token_usage(self) -> int:
+        return self.usage_ledger.totals["prompt_tokens"]
+
+    @property
+    def completion_token_usage(self) -> int:
+        return self.usage_ledger.totals["completion_tokens"]
+
+    @property
+    def embedding_token_usage(self) -> int:
+        return self.usage_ledger.totals["embedding_tokens"]
+
+    def get_usage(self, **filters):
+        """
+        Token usage, optionally of the records matching the filters,
+        e.g. `get_usage(game='uno')` or `get_usage(caller='debug')`.
+        """
+        totals = self.usage_ledger.get_totals(**filters)
         return {
-            "prompt_tokens": self.prompt_token_usage,
-            "completion_tokens": self.completion_token_usage,
-            "embedding_tokens": self.embedding_token_usage
+            "prompt_tokens": totals["prompt_tokens"],
+            "completion_tokens": totals["completion_tokens"],
+            "embedding_tokens": totals["embedding_tokens"],
+            "calls": totals["calls"],
+            "latency": round(totals["latency"], 3),
+            "cache_hits": totals["cache_hits"],
+            "cache_misses": totals["cache_misses"],
+            "coalesced": totals["coalesced"],
+            "reasks": totals["reasks"],
         }
+
+    def get_route_stats(self, **filters) -> dict:
+        """
+        Latency and quality signals of the chat requests per call site and model,
+        e.g. `{'max_or_min': {'gpt-4o-mini': {'calls': 12, 'mean_latency': 0.8, 'reask_rate': 0.1, ...}}}`.
+        """
+        stats = {}
+        for (caller, model), totals in self.usage_ledger.aggregate(by=('caller', 'model'), kind="chat", **filters).items():
+            requests = totals["calls"] + totals["cache_hits"] + totals["coalesced"]
+            stats.setdefault(caller, {})[model] = {
+                "calls": totals["calls"],
+                "mean_latency": round(totals["latency"] / totals["calls"], 3) if totals["calls"] else 0.0,
+                "errors": totals["errors"],
+                "reasks": totals["reasks"],
+                "reask_rate": round(totals["reasks"] / requests, 3) if requests else 0.0,
+                "completion_tokens": totals["completion_tokens"],
+            }
+        return stats
     
     def add_usage(self, usage: dict):
-        self.prompt_token_usage += usage["prompt_tokens"]
-        self.completion_token_usage += usage["completion_tokens"]
-        self.embedding_token_usage += usage["embedding_tokens"]
+        self.usage_ledger.record(
+            self.llm_model, kind="imported",
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            embedding_tokens=usage["embedding_tokens"])
+
+    def export_usage(self, path: str, **filters):
+        """Write the usage records matching the filters as JSONL."""
+        self.usage_ledger.export_jsonl(path, **filters)
+
+    def enable_cache(self, path: str = 'llm_cache.sqlite', ttl: float = None, max_entries: int = 100000):
+        """Cache the responses in a sqlite database, see LLMCache."""
+        self.cache = LLMCache(path, ttl=ttl, max_entries=max_entries)
+        return self.cache
+
+    def use_cassette(self, path: str, mode: CassetteMode = "replay"):
+        """Record the requests to a cassette file or replay them from it, see Cassette."""
+        self.cassette = Cassette(path, mode=mode)
+        return self.cassette
+
+    def set_routes(self, routes: Union[ModelRouter, dict, str, None]):
+        """Route the requests by call site, given as a ModelRouter, a dict or a YAML file, see LLMRouting."""
+        if isinstance(routes, str):
+            routes = ModelRouter.from_file(routes)
+        elif isinstance(routes, dict):
+            routes = ModelRouter(routes)
+        self.router = routes
 
     def set_log_path(self, log_path: str):
         self.log_path = log_path
@@ -286,21 +851,49 @@ class LLMHandler:
     def set_server_address(self, address: str):
         """Set the server address for LLM communication."""
         self.server_address = address.rstrip('/')  # Remove trailing slash if present
-        # Clear existing clients when switching to server mode
-        self.client = None
-        self.client2 = None
+        self.provider = "server"
+        # Switch to the shared client of the server
+        self.client = get_openai_client("no-key-needed", self.server_address)
 
     def get_server_address(self) -> str:
         """Get the current server address."""
         return self.server_address
 
 
+def reask(stop_max_attempt_number: int = 3, wait_fixed: int = 0):
+    """
+    Retry a function that asks the LLM and checks its answer, like `retrying.retry`.
+    The attempts after the first bypass the response cache, so the LLM is asked again
+    instead of returning the same cached answer.
+    Failed requests (LLMRequestError) are not retried again, the handler already did.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = 1
+            while True:
+                try:
+                    if attempt == 1:
+                        return func(*args, **kwargs)
+                    with cache_bypass():
+                        return func(*args, **kwargs)
+                except LLMRequestError:
+                    raise
+                except Exception:
+                    if attempt >= stop_max_attempt_number:
+                        raise
+                    attempt += 1
+                    time.sleep(wait_fixed / 1000)
+        return wrapper
+    return decorator
+
+
 def get_text_embeddings(text: str) -> list[float]:
     """
     Get the text embeddings from the OpenAI API.
     """
 
-    client = OpenAI()
+    client = get_openai_client(get_api_key("OPENAI_API_KEY"))
 
     response = client.embeddings.create(
         input=text,
@@ -0,0 +1,133 @@
+"""
+Background writer of the LLM message logs.
+
+The messages are queued by the calling thread and written in batches by one writer thread
+per log file, which keeps the file open, rotates it when it grows past `max_bytes` and
+flushes everything left when the process exits. Handlers and threads logging to the same
+path share its writer, so their messages are never interleaved.
+"""
+from __future__ import annotations
+import os
+import queue
+import atexit
+import logging
+import threading
+from typing import Dict, Tuple
+
+MAX_BYTES = 50 * 1024 * 1024  # rotate the log past this size
+BACKUP_COUNT = 3  # rotated logs kept as log_path.1 ... log_path.3
+BATCH_SIZE = 256  # messages written per batch at most
+
+_writers: Dict[Tuple[int, str], "LogWriter"] = {}
+_lock = threading.Lock()
+
+
+class LogWriter:
+    """
+    Args:
+        path: the log file, appended to
+        max_bytes: size after which the log is rotated, never rotated if 0
+        backup_count: number of rotated logs kept
+    """
+    _STOP = object()
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue: queue.Queue = queue.Queue()
+        self.file = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"log-writer-{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def write(self, text: str):
+        """Queue the text, it is written by the writer thread."""
+        if self.closed:
+            raise ValueError(f"Log writer of {self.path} is closed")
+        self.queue.put(text)
+
+    def flush(self):
+        """Block until everything queued so far is written."""
+        if not self.closed:
+            self.queue.join()
+
+    def close(self):
+        """Write everything queued and stop the writer thread."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(self._STOP)
+        self.thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            texts = [text for text in batch if text is not self._STOP]
+            stop = len(texts) < len(batch)
+            try:
+                if texts:
+                    self._write_batch(texts)
+            except OSError as err:
+                logging.warning(f"Failed to write the LLM log {self.path}: {err}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        if self.file is not None:
+            self.file.close()
+
+    def _write_batch(self, texts):
+        if self.file is None:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)
+            self.file = open(self.path, 'a', encoding='utf-8')
+        pending, size = [], self.file.tell()
+        for text in texts:
+            # character count, close enough to the size in bytes to decide when to rotate
+            if self.max_bytes and size > 0 and size + len(text) > self.max_bytes:
+                self.file.write("".join(pending))
+                self._rotate()
+                pending, size = [], 0
+            pending.append(text)
+            size += len(text)
+        self.file.write("".join(pending))
+        self.file.flush()
+
+    def _rotate(self):
+        self.file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+
+def get_log_writer(path: str) -> LogWriter:
+    """The writer of the log file shared in this process."""
+    key = (os.getpid(), os.path.abspath(path))
+    with _lock:
+        writer = _writers.get(key)
+        if writer is None or writer.closed:
+            writer = LogWriter(path)
+            _writers[key] = writer
+        return writer
+
+
+@atexit.register
+def close_log_writers():
+    """Flush and close the writers of this process."""
+    with _lock:
+        writers = [writer for key, writer in _writers.items() if key[0] == os.getpid()]
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,101 @@
+"""
+Client-side rate limiting of LLM requests.
+
+Every provider and model has a token bucket shared by all handlers of the process,
+so threads and async tasks fanning out requests stay below the provider limits
+instead of tripping 429 errors.
+"""
+from __future__ import annotations
+import time
+import asyncio
+import threading
+from typing import Dict, Optional, Tuple
+
+# default requests per minute of each provider, None for no limit
+DEFAULT_REQUESTS_PER_MINUTE: Dict[str, Optional[float]] = {
+    "openai": 500,
+    "openrouter": 200,
+    "deepseek": 120,
+    "anthropic": 50,
+    "server": None,
+}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+
+    Args:
+        rate: tokens added per second
+        capacity: maximum number of tokens, i.e. the allowed burst
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        assert rate > 0, "rate must be positive"
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """Take the tokens and return the seconds to wait until they are available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # tokens may go negative, later callers wait for the earlier ones
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until the tokens are available, return the seconds waited."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float = 1.0) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+_limits: Dict[Tuple[str, Optional[str]], Tuple[Optional[float], Optional[float]]] = {}
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def set_rate_limit(provider: str, requests_per_minute: Optional[float],
+                   model: str = None, burst: float = None):
+    """
+    Set the limit of a provider, or of one model of the provider when `model` is given.
+    `requests_per_minute=None` removes the limit.
+    """
+    with _registry_lock:
+        _limits[(provider, model)] = (requests_per_minute, burst)
+        # buckets are rebuilt with the new limit
+        for key in [key for key in _buckets if key[0] == provider and (model is None or key[1] == model)]:
+            del _buckets[key]
+
+
+def get_rate_limiter(provider: str, model: str) -> Optional[TokenBucket]:
+    """The bucket shared by the requests to the model of the provider, None if unlimited."""
+    key = (provider, model)
+    with _registry_lock:
+        if key in _buckets:
+            return _buckets[key]
+        if (provider, model) in _limits:
+            requests_per_minute, burst = _limits[(provider, model)]
+        elif (provider, None) in _limits:
+            requests_per_minute, burst = _limits[(provider, None)]
+        else:
+            requests_per_minute, burst = DEFAULT_REQUESTS_PER_MINUTE.get(provider), None
+        if requests_per_minute is None:
+            return None
+        bucket = TokenBucket(requests_per_minute / 60, burst if burst is not None else max(1.0, requests_per_minute / 60))
+        _buckets[key] = bucket
+        return bucket
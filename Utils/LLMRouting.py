@@ -0,0 +1,69 @@
+"""
+Routing of the LLM requests to models by call site.
+
+Each request is tagged with its call site (the `caller` of LLMHandler.chat, e.g. 'max_or_min'
+or 'agent_action'). A routing table maps call sites to models, so cheap tasks are answered
+by a cheap, fast model and the others by the handler's model. A route can name a second
+model for the re-asks, i.e. the requests made again after an answer was rejected.
+
+Routing table, e.g. in the `llm_routes` section of a config:
+    explain_obs: gpt-4o-mini
+    max_or_min: gpt-4o-mini
+    agent_action:
+      model: gpt-4o-mini
+      reask_model: gpt-4o-2024-08-06
+
+The routed models are requested from the handler's provider, so they must be served by it.
+The usage ledger records the latency and the re-asks (the quality signal) per call site and
+model, see LLMHandler.get_route_stats.
+"""
+from __future__ import annotations
+import os
+from typing import Dict, Optional, Union
+
+import yaml
+
+Route = Union[str, Dict[str, str]]
+
+
+class ModelRouter:
+    """
+    Args:
+        routes: call site to model, or to {'model': ..., 'reask_model': ...}
+    """
+
+    def __init__(self, routes: Dict[str, Route] = None):
+        self.routes: Dict[str, Dict[str, str]] = {}
+        for caller, route in (routes or {}).items():
+            self.set_route(caller, route)
+
+    def set_route(self, caller: str, route: Route):
+        if isinstance(route, str):
+            route = {"model": route}
+        unknown = set(route) - {"model", "reask_model"}
+        assert not unknown, f"Unknown route keys for {caller}: {unknown}"
+        assert "model" in route, f"The route of {caller} has no model"
+        self.routes[caller] = dict(route)
+
+    def select(self, caller: Optional[str], reasked: bool = False) -> Optional[str]:
+        """The model of the call site, None if it is not routed."""
+        route = self.routes.get(caller)
+        if route is None:
+            return None
+        if reasked:
+            return route.get("reask_model", route["model"])
+        return route["model"]
+
+    def __contains__(self, caller: str) -> bool:
+        return caller in self.routes
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    @classmethod
+    def from_file(cls, path: str) -> "ModelRouter":
+        """Load the routing table from a YAML file of call site to route."""
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Routing table not found: {path}")
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(yaml.safe_load(f) or {})
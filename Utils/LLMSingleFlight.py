@@ -0,0 +1,57 @@
+"""
+Coalescing of identical in-flight requests.
+
+When a request is already in flight, callers making the same request wait for its
+result instead of sending a duplicate, e.g. threads designing several policies or
+ensemble features from the same prompt at the same time.
+"""
+from __future__ import annotations
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Call func() unless a call with the same key is in flight, in which case wait for
+        its result (or exception). Returns the result and whether it was shared.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.followers += 1
+                leader = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = func()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
@@ -0,0 +1,239 @@
+"""
+A local OpenAI-compatible stub server for offline tests and benchmarks.
+
+It answers /v1/chat/completions (also streamed) and /v1/embeddings with canned responses
+after an optional delay, over HTTP/1.1 keep-alive connections. Use it with
+`LLMHandler(server_address=server.url)`.
+With a cassette (see Utils.LLMCassette), the recorded responses are served instead, falling
+back to the canned ones for requests that were not recorded.
+
+Usage:
+    server = StubLLMServer(latency=0.01).start()
+    handler = LLMHandler("gpt-4o-mini", server_address=server.url)
+    ...
+    server.stop()
+
+or from the command line:
+    python -m Utils.LLMStubServer --port 8000 [--cassette data/cassettes/uno.jsonl]
+"""
+from __future__ import annotations
+import json
+import time
+import socket
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+from Utils.LLMCassette import Cassette, chat_request_key, embedding_request_key
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+def _count_tokens(text: str) -> int:
+    # a rough estimate, about four characters per token
+    return max(1, len(text) // 4)
+
+
+def default_chat_responder(request: Dict) -> str:
+    """Echo the last message in a fenced block, so callers parsing blocks get a valid answer."""
+    last = request.get("messages", [{}])[-1].get("content", "")
+    return f"```\n{last[:200]}\n```"
+
+
+def default_embedder(text: str) -> List[float]:
+    """A deterministic pseudo embedding of the text."""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(EMBEDDING_DIMENSIONS)]
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+
+    def setup(self):
+        # headers and body are written separately, do not delay the body
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, chunks: List[Dict], token_latency: float):
+        """Send server-sent events in chunked encoding, stop when the client disconnects."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in chunks + ["[DONE]"]:
+                data = chunk if isinstance(chunk, str) else json.dumps(chunk)
+                event = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(event):X}\r\n".encode() + event + b"\r\n")
+                self.wfile.flush()
+                if token_latency:
+                    time.sleep(token_latency)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client cancelled the generation
+            self.server.stub.cancelled_count += 1
+            self.close_connection = True
+
+    def do_POST(self):
+        server: StubLLMServer = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server.request_count += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions") and request.get("stream"):
+            self._send_stream(server.chat_completion_chunks(request), server.token_latency)
+        elif path.endswith("/chat/completions"):
+            self._send_json(200, server.chat_completion(request))
+        elif path.endswith("/embeddings"):
+            self._send_json(200, server.embeddings(request))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+class StubLLMServer:
+    """
+    Args:
+        port: port to listen on, a free one if 0
+        latency: seconds to wait before answering each request
+        token_latency: seconds between the chunks of a streamed answer, about one token each
+        chat_responder: function from the request body to the response content
+        embedder: function from a text to its embedding
+        cassette: recorded responses served before the responder and embedder
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 token_latency: float = 0.0,
+                 chat_responder: Callable[[Dict], str] = default_chat_responder,
+                 embedder: Callable[[str], List[float]] = default_embedder,
+                 cassette: Cassette = None):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chat_responder = chat_responder
+        self.embedder = embedder
+        self.cassette = cassette
+        self.request_count = 0
+        self.cancelled_count = 0
+        self.httpd = ThreadingHTTPServer((host, port), _StubRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _play(self, key: str) -> Dict:
+        if self.cassette is None or key not in self.cassette.entries:
+            return None
+        return self.cassette.play(key)
+
+    def chat_completion(self, request: Dict) -> Dict:
+        kwargs = {k: v for k, v in request.items() if k not in ("model", "messages")}
+        entry = self._play(chat_request_key(request.get("model"), request.get("messages", []), kwargs))
+        if entry is not None:
+            content = entry["response"]
+            prompt_tokens, completion_tokens = entry["prompt_tokens"], entry["completion_tokens"]
+        else:
+            content = self.chat_responder(request)
+            prompt_tokens = sum(_count_tokens(str(m.get("content", ""))) for m in request.get("messages", []))
+            completion_tokens = _count_tokens(content)
+        return {
+            "id": f"chatcmpl-stub-{self.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def chat_completion_chunks(self, request: Dict) -> List[Dict]:
+        """The streamed chat completion, about four characters per chunk."""
+        completion = self.chat_completion(request)
+        content = completion["choices"][0]["message"]["content"]
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        base["object"] = "chat.completion.chunk"
+        chunks = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+        for i in range(0, len(content), 4):
+            chunks.append({**base, "choices": [{"index": 0, "delta": {"content": content[i:i + 4]}, "finish_reason": None}]})
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if request.get("stream_options", {}).get("include_usage"):
+            chunks.append({**base, "choices": [], "usage": completion["usage"]})
+        return chunks
+
+    def embeddings(self, request: Dict) -> Dict:
+        texts = request.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        entry = self._play(embedding_request_key(request.get("model"), texts))
+        if entry is not None:
+            embeddings, prompt_tokens = entry["response"], entry["embedding_tokens"]
+        else:
+            embeddings = [self.embedder(text) for text in texts]
+            prompt_tokens = sum(_count_tokens(text) for text in texts)
+        return {
+            "object": "list",
+            "model": request.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i, "embedding": e} for i, e in enumerate(embeddings)],
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+            # the format expected by LLMHandler in server mode
+            "embeddings": embeddings,
+            "prompt_tokens": prompt_tokens,
+        }
+
+    def start(self) -> "StubLLMServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--token_latency", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--cassette", type=str, default=None, help="Serve the responses recorded in this cassette")
+    args = parser.parse_args()
+
+    cassette = Cassette(args.cassette, mode="replay") if args.cassette else None
+    server = StubLLMServer(port=args.port, latency=args.latency, token_latency=args.token_latency,
+                           cassette=cassette)
+    print(f"Serving on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,166 @@
+"""
+Thread-safe accounting of LLM usage.
+
+Every request is recorded in a UsageLedger with its tokens, latency, model and a caller tag
+(e.g. 'structurize', 'draft', 'debug', 'validate', 'qfunc_fix'). The game and stage of the
+records come from `usage_context()`, so the ledger can be aggregated per game and per stage,
+and exported as JSONL for cost and latency analysis. Re-asks, i.e. requests made again after
+an answer was rejected, are counted as a quality signal of the call site and model.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_local = threading.local()
+
+USAGE_KEYS = ('game', 'stage', 'caller')
+
+
+@contextmanager
+def usage_context(**context: Optional[str]):
+    """
+    Tag the requests made in this context, e.g. `usage_context(game='uno', stage='debug')`.
+    Nested contexts override the given keys only.
+    """
+    unknown = set(context) - set(USAGE_KEYS)
+    assert not unknown, f"Unknown usage keys: {unknown}"
+    previous = get_usage_context()
+    _local.context = {**previous, **{k: v for k, v in context.items() if v is not None}}
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+def get_usage_context() -> Dict[str, str]:
+    return dict(getattr(_local, 'context', {}))
+
+
+def bind_usage_context(func):
+    """Wrap func to run with the current usage context, e.g. as the target of a new thread."""
+    context = get_usage_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with usage_context(**context):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@dataclass
+class UsageRecord:
+    model: str
+    kind: str = "chat"  # chat, embedding or imported
+    caller: Optional[str] = None
+    game: Optional[str] = None
+    stage: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_tokens: int = 0
+    latency: float = 0.0  # seconds
+    cache: Optional[str] = None  # 'hit' or 'miss' when a cache is used
+    coalesced: bool = False  # answered by an identical request in flight, not sent
+    stopped_early: bool = False  # streamed and cancelled once the needed part was received
+    reasked: bool = False  # asked again after the previous answer was rejected
+    error: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+
+def _empty_totals() -> Dict[str, float]:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "embedding_tokens": 0,
+        "latency": 0.0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "coalesced": 0,
+        "reasks": 0,
+    }
+
+
+def _add_to_totals(totals: Dict[str, float], record: UsageRecord):
+    # requests sent to the provider
+    if record.kind != "imported" and record.cache != "hit" and not record.coalesced:
+        totals["calls"] += 1
+    if record.error is not None:
+        totals["errors"] += 1
+    totals["prompt_tokens"] += record.prompt_tokens
+    totals["completion_tokens"] += record.completion_tokens
+    totals["embedding_tokens"] += record.embedding_tokens
+    totals["latency"] += record.latency
+    if record.cache == "hit":
+        totals["cache_hits"] += 1
+    elif record.cache == "miss":
+        totals["cache_misses"] += 1
+    if record.coalesced:
+        totals["coalesced"] += 1
+    if record.reasked:
+        totals["reasks"] += 1
+
+
+class UsageLedger:
+    """An append-only, thread-safe list of usage records with running totals."""
+
+    def __init__(self):
+        self.records: List[UsageRecord] = []
+        self.totals = _empty_totals()
+        self._lock = threading.Lock()
+
+    def record(self, model: str, **fields) -> UsageRecord:
+        """Add a record, tagged with the current usage context unless given."""
+        context = get_usage_context()
+        for key in USAGE_KEYS:
+            if fields.get(key) is None:
+                fields[key] = context.get(key)
+        record = UsageRecord(model=model, **fields)
+        with self._lock:
+            self.records.append(record)
+            _add_to_totals(self.totals, record)
+        return record
+
+    def get_records(self, **filters) -> List[UsageRecord]:
+        """Records matching all filters, e.g. `get_records(game='uno', caller='debug')`."""
+        with self._lock:
+            records = list(self.records)
+        return [r for r in records if all(getattr(r, k) == v for k, v in filters.items())]
+
+    def get_totals(self, **filters) -> Dict[str, float]:
+        if not filters:
+            with self._lock:
+                return dict(self.totals)
+        totals = _empty_totals()
+        for record in self.get_records(**filters):
+            _add_to_totals(totals, record)
+        return totals
+
+    def aggregate(self, by: Iterable[str] = ('game', 'stage'), **filters) -> Dict[Tuple, Dict[str, float]]:
+        """Totals grouped by the given record fields, e.g. per game and stage."""
+        by = tuple(by)
+        groups: Dict[Tuple, Dict[str, float]] = {}
+        for record in self.get_records(**filters):
+            key = tuple(getattr(record, k) for k in by)
+            if key not in groups:
+                groups[key] = _empty_totals()
+            _add_to_totals(groups[key], record)
+        return groups
+
+    def export_jsonl(self, path: str, append: bool = False, **filters):
+        """Write the records matching the filters, one JSON object per line."""
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'a' if append else 'w', encoding='utf-8') as f:
+            for record in self.get_records(**filters):
+                f.write(json.dumps(asdict(record)) + '\n')
+
+    def __len__(self) -> int:
+        return len(self.records)
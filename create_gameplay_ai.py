@@ -4,6 +4,7 @@ import json
 from GameplayAI.create_agent import create_agent
 from GameplayAI.optimize_agent import optimize_weights
 from Utils.LLMHandler import LLMHandler
+from Utils.LLMUsage import usage_context
 import logging
 import json
 import time
@@ -32,16 +33,20 @@ def main(folder_path, llm_handler: LLMHandler, policy_num=4):
             if not os.path.exists(os.path.join(policy_folder_path, "policy_reflect_fixed.json")):
                 # create agent
                 logger.info(f"Creating agent for {game_name}")
-                create_agent(
-                    game_description_file_path,
-                    game_code_file_path,
-                    policy_folder_path,
-                    llm_handler,
-                    policy_num=policy_num,
-                )
-                # save token usage
+                with usage_context(game=game_name, stage="propose_and_code"):
+                    create_agent(
+                        game_description_file_path,
+                        game_code_file_path,
+                        policy_folder_path,
+                        llm_handler,
+                        policy_num=policy_num,
+                    )
+                # save token usage of this game
                 with open(token_usage_json_path, "w") as f:
-                    f.write(json.dumps(llm_handler.get_usage()))
+                    f.write(json.dumps(llm_handler.get_usage(game=game_name)))
+                llm_handler.export_usage(os.path.join(folder_path, game_name, "usage.jsonl"), game=game_name)
+                logger.info(f"LLM latency and re-asks per call site for {game_name}: "
+                            f"{json.dumps(llm_handler.get_route_stats(game=game_name))}")
                 # get time usage
                 end_time = time.time()
                 with open(time_json_path, "w") as f:
@@ -94,11 +99,21 @@ if __name__ == "__main__":
                         help="Path to the working folder")
     parser.add_argument("--policy_num", type=int, default=4,
                         help="Number of policies to create")
+    parser.add_argument("--llm_cache", type=str, default=None,
+                        help="Path of a sqlite database caching the LLM responses, no cache if not given")
+    parser.add_argument("--llm_routes", type=str, default=None,
+                        help="YAML file mapping call sites (e.g. explain_obs, max_or_min) to models")
+    parser.add_argument("--llm_cassette", type=str, default=None,
+                        help="Path of a cassette file recording the LLM requests, or replaying them offline")
+    parser.add_argument("--cassette_mode", type=str, default="replay", choices=["record", "replay", "auto"],
+                        help="Record the LLM requests to the cassette or replay them from it")
 
     # Parse the arguments
     args = parser.parse_args()
     folder_path = args.folder_path
     policy_num = args.policy_num
 
-    llm_handler = LLMHandler(llm_model="gpt-4o")
+    llm_handler = LLMHandler(llm_model="gpt-4o", cache=args.llm_cache, routes=args.llm_routes)
+    if args.llm_cassette:
+        llm_handler.use_cassette(args.llm_cassette, mode=args.cassette_mode)
     main(folder_path, llm_handler, policy_num=policy_num)